@@ -11,6 +11,7 @@ pip install -r requirements.txt --upgrade
 
 cd jatszohaz
 python3 manage.py migrate
+python3 manage.py createcachetable
 python3 manage.py collectstatic --no-input --clear
 python3 manage.py compilemessages
 
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import logging
+from time import perf_counter
+from urllib.parse import urljoin
+from django.conf import settings
+from rent.models import Rent
+from jatszohaz.utils import send_message_to_members
+from .models import CronRun
+
+
+logger = logging.getLogger(__name__)
+
+# rents are reported this long after crossing one of the thresholds below
+GRACE_PERIOD = timedelta(days=1)
+
+# (date field, statuses) pairs: rents still in one of the statuses after the date plus the grace period are reported
+THRESHOLDS = (
+    # created 24h+ ago, but still pending
+    ('created', (Rent.STATUS_PENDING[0], )),
+    # date_to passed, but still not closed
+    ('date_to', (Rent.STATUS_PENDING[0], Rent.STATUS_APPROVED[0], Rent.STATUS_GAVE_OUT[0])),
+    # date_from passed but not gave out
+    ('date_from', (Rent.STATUS_PENDING[0], Rent.STATUS_APPROVED[0])),
+)
+
+
+def get_overdue_rents(until):
+    """
+    Returns (set of Rent pks, number of scanned rows) of the rents which are still open after crossing a threshold.
+
+    Every threshold is checked with its own query, which can use the (status, date field) index of Rent.
+
+    :param until: inclusive upper bound of the threshold dates.
+    """
+    rent_pks = set()
+    scanned = 0
+
+    for field, statuses in THRESHOLDS:
+        pks = list(Rent.objects.filter(status__in=statuses, **{'%s__lte' % field: until}).values_list('pk', flat=True))
+        scanned += len(pks)
+        rent_pks.update(pks)
+
+    return rent_pks, scanned
+
+
+def run_cron(debug=False):
+    """
+    Notifies the members about every overdue rent, so they are reminded every day until the rents are handled.
+
+    :param debug: only log the message instead of sending it, the run is not stored either.
+    :return: CronRun object, which is saved unless debug is True.
+    """
+    started = perf_counter()
+    now = datetime.now()
+
+    rent_pks, scanned = get_overdue_rents(now - GRACE_PERIOD)
+    if rent_pks:
+        context = {'rents': [urljoin(settings.SITE_DOMAIN, str(Rent(pk=pk).get_absolute_url()))
+                             for pk in sorted(rent_pks)]}
+        if debug:
+            logger.info("Message context: %s" % context)
+        else:
+            send_message_to_members('pending_rents', context)
+        logger.info("Pending rents processed.")
+
+    run = CronRun(started=now, scanned=scanned, notified=len(rent_pks), duration=perf_counter() - started)
+    if not debug:
+        run.save()
+
+    logger.info("Finished: scanned %d rents, notified about %d in %.3f s." % (run.scanned, run.notified, run.duration))
+    return run
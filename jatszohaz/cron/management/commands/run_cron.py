@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from cron.jobs import run_cron
+
+
+class Command(BaseCommand):
+    help = "Notifies the members about every overdue rent. " \
+           "Reports the number of scanned rows and the duration."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debug', action='store_true',
+                            help='Only log the message instead of sending it, the run is not stored either.')
+
+    def handle(self, *args, **options):
+        run = run_cron(debug=options['debug'])
+        self.stdout.write(self.style.SUCCESS("Scanned %d rents, notified about %d in %.1f ms." % (
+            run.scanned, run.notified, run.duration * 1000)))
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:55
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CronRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('started', models.DateTimeField(verbose_name='Started')),
+                ('scanned', models.PositiveIntegerField(default=0, verbose_name='Scanned rents')),
+                ('notified', models.PositiveIntegerField(default=0, verbose_name='Notified rents')),
+                ('duration', models.FloatField(default=0, help_text='In seconds.', verbose_name='Duration')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+from model_utils.models import TimeStampedModel
+
+
+class CronRun(TimeStampedModel):
+    """
+    Represents a run of the cron job, with the number of scanned and reported rents and the duration.
+    """
+    started = models.DateTimeField(verbose_name=_("Started"))
+    scanned = models.PositiveIntegerField(verbose_name=_("Scanned rents"), default=0)
+    notified = models.PositiveIntegerField(verbose_name=_("Notified rents"), default=0)
+    duration = models.FloatField(verbose_name=_("Duration"), help_text=_("In seconds."), default=0)
+
+    def __str__(self):
+        return "%s (%d/%d rents, %.3f s)" % (self.started, self.notified, self.scanned, self.duration)
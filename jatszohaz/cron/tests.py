@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.test import TestCase
+
+from jatszohaz.models import JhUser
+from rent.models import Rent
+from .jobs import run_cron
+from .models import CronRun
+
+
+class CronTest(TestCase):
+    """Every still open overdue rent is reported on every run."""
+
+    def setUp(self):
+        self.renter = JhUser.objects.create(username='renter')
+        now = datetime.now()
+        self.late = self.create_rent(now - timedelta(days=5), status=Rent.STATUS_GAVE_OUT[0])
+        self.not_given_out = self.create_rent(now - timedelta(days=2), status=Rent.STATUS_APPROVED[0])
+        self.future = self.create_rent(now + timedelta(days=5), status=Rent.STATUS_APPROVED[0])
+        self.closed = self.create_rent(now - timedelta(days=5), status=Rent.STATUS_BACK[0])
+
+    def create_rent(self, date_from, status):
+        return Rent.objects.create(renter=self.renter, date_from=date_from, date_to=date_from + timedelta(days=2),
+                                   status=status)
+
+    def run_cron(self):
+        with mock.patch('cron.jobs.send_message_to_members') as send:
+            run_cron()
+        if not send.called:
+            return set()
+        return {url.rstrip('/').rsplit('/', 1)[1] for url in send.call_args[0][1]['rents']}
+
+    def test_reported_every_day(self):
+        expected = {str(self.late.pk), str(self.not_given_out.pk)}
+        self.assertEqual(self.run_cron(), expected)
+        self.assertEqual(self.run_cron(), expected)
+        self.assertEqual(CronRun.objects.count(), 2)
+
+    def test_changed_rents(self):
+        self.run_cron()
+
+        # moved into the past
+        self.future.date_from = datetime.now() - timedelta(days=3)
+        self.future.save()
+        # reopened
+        self.closed.status = Rent.STATUS_GAVE_OUT[0]
+        self.closed.save()
+        # handled
+        self.late.status = Rent.STATUS_BACK[0]
+        self.late.save()
+
+        self.assertEqual(self.run_cron(), {str(self.not_given_out.pk), str(self.future.pk), str(self.closed.pk)})
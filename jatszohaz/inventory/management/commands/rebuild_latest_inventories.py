@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from jatszohaz.utils import bump_cache_version
+from inventory.models import GamePiece
+from rent.models import AVAILABILITY_CACHE_VERSION
+
+
+class Command(BaseCommand):
+    help = "Updates the latest inventory and playable state of all game pieces from their inventories. " \
+           "Must be run after changing inventories without saving them one by one, e.g. with bulk operations."
+
+    def handle(self, *args, **options):
+        count = GamePiece.update_latest_inventories()
+        bump_cache_version(AVAILABILITY_CACHE_VERSION)
+
+        self.stdout.write(self.style.SUCCESS("%d game pieces updated." % count))
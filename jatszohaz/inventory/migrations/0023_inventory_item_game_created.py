@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_auto_20211117_2033'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['game', 'created'], name='inventory_item_game_created'),
+        ),
+    ]
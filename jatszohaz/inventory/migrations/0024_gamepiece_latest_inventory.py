@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:58
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_latest_inventories(apps, schema_editor):
+    GamePiece = apps.get_model('inventory', 'GamePiece')
+    InventoryItem = apps.get_model('inventory', 'InventoryItem')
+
+    latest = InventoryItem.objects.filter(game=models.OuterRef('pk')).order_by('-created', '-pk')
+    GamePiece.objects.update(
+        latest_inventory=models.Subquery(latest.values('pk')[:1]),
+        playable=Coalesce(models.Subquery(latest.values('playable')[:1]), models.Value(True),
+                          output_field=models.BooleanField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0023_inventory_item_game_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamepiece',
+            name='latest_inventory',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.InventoryItem', verbose_name='Latest inventory'),
+        ),
+        migrations.AddField(
+            model_name='gamepiece',
+            name='playable',
+            field=models.BooleanField(default=True, editable=False, help_text='Playable state of the latest inventory, true if there is none.', verbose_name='Playable'),
+        ),
+        migrations.RunPython(populate_latest_inventories, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,23 @@
 import logging
-from datetime import timedelta
 
-from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from django_resized import ResizedImageField
 from model_utils.models import TimeStampedModel
 from jatszohaz.models import JhUser
+from jatszohaz.utils import bump_cache_version
 
 logger = logging.getLogger(__name__)
 
+# cache version (bumped when games change) and timeout (seconds) of the games catalogue, see jatszohaz.views.GamesView
+CATALOGUE_CACHE_VERSION = 'games-catalogue'
+CATALOGUE_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 class GameGroup(TimeStampedModel):
     """
@@ -63,25 +69,35 @@ class GameGroup(TimeStampedModel):
     class Meta:
         ordering = ['name', ]
 
-    def get_game_piece(self, date_from, date_to):
+    def get_game_piece(self, date_from, date_to, blocked=None):
         """
         Returns a connected GamePiece which is free during the given time period.
         If multiple available the one with the lowest priority will be returned.
 
+        :param blocked: result of rent.availability.get_blocked_pieces for the same period, if already known.
         :raises GameGroup.DoesNotExist if there is no free connected GamePiece object.
         """
-        for piece in self.game_pieces.order_by('priority'):
-            if piece.is_free(date_from, date_to):
+        pieces = list(self.game_pieces.order_by('priority'))
+        if blocked is None:
+            from rent.availability import get_blocked_pieces
+            blocked = get_blocked_pieces(date_from, date_to, pieces=[p.pk for p in pieces])
+
+        for piece in pieces:
+            if piece.pk not in blocked:
                 return piece
         raise GameGroup.DoesNotExist("No free piece available!")
 
-    def has_free_piece(self, date_from, date_to):
-        """Returns True if there is a connected GamePiece object that is not rented out in the given time period."""
+    def has_free_piece(self, date_from, date_to, blocked=None):
+        """
+        Returns True if there is a connected GamePiece object that is not rented out in the given time period.
 
-        for piece in self.game_pieces.all():
-            if piece.is_free(date_from, date_to):
-                return True
-        return False
+        :param blocked: result of rent.availability.get_blocked_pieces for the same period, if already known.
+        """
+        try:
+            self.get_game_piece(date_from, date_to, blocked)
+        except GameGroup.DoesNotExist:
+            return False
+        return True
 
     @property
     def players(self):
@@ -124,35 +140,42 @@ class GamePiece(TimeStampedModel):
     place = models.CharField(verbose_name=_("Place"), max_length=20, blank=True,
                              help_text=_("Where the game should be."))
     price = models.IntegerField(verbose_name=_("Price (Ft)"), validators=[MinValueValidator(0)], default=0)
+    # denormalised from the inventories, see update_latest_inventories
+    latest_inventory = models.ForeignKey('InventoryItem', on_delete=models.SET_NULL, related_name='+',
+                                         verbose_name=_("Latest inventory"), null=True, blank=True, editable=False)
+    playable = models.BooleanField(verbose_name=_("Playable"), default=True, editable=False,
+                                   help_text=_("Playable state of the latest inventory, true if there is none."))
 
     class Meta:
         ordering = ['game_group__name', ]
 
     def is_free(self, date_from, date_to, ignored_rent_pk=None):
         """Returns True if the represented board game is not rented during the given period."""
-        from rent.models import Rent
-
-        last_inv = self.get_latest_inventory_item()
-
-        # adjust date according to the RENT_RETURN_DELAY_DAYS
-        delay_days = timedelta(days=settings.RENT_RETURN_DELAY_DAYS)
-        date_from -= delay_days
-        date_to += delay_days
-
-        # check if the game piece is rentable and if there's any intersection rents
-        return (self.rentable and (last_inv is None or last_inv.playable) and
-                self.rents
-                .exclude(status__in=[Rent.STATUS_CANCELLED[0],
-                                     Rent.STATUS_DECLINED[0], Rent.STATUS_BACK[0]])
-                .exclude(pk=ignored_rent_pk)
-                .filter(
-                    models.Q(date_from__range=(date_from, date_to)) |
-                    models.Q(date_from__lte=date_from, date_to__gte=date_from)
-                )
-                .count() == 0)
+        from rent.availability import get_blocked_pieces
+
+        return self.pk not in get_blocked_pieces(date_from, date_to, ignored_rent_pk, pieces=[self.pk])
 
     def get_latest_inventory_item(self):
-        return self.inventories.last()
+        return self.latest_inventory
+
+    @staticmethod
+    def update_latest_inventories(pks=None):
+        """
+        Updates latest_inventory and playable of the given GamePiece objects from their inventories with one query.
+
+        It's done automatically when an InventoryItem is saved or deleted, `rebuild_latest_inventories` management
+        command updates all of the pieces.
+
+        :param pks: iterable of GamePiece pks, all pieces are updated if None.
+        :return: number of updated pieces.
+        """
+        latest = InventoryItem.objects.filter(game=models.OuterRef('pk')).order_by('-created', '-pk')
+        pieces = GamePiece.objects.all() if pks is None else GamePiece.objects.filter(pk__in=pks)
+        return pieces.update(
+            latest_inventory=models.Subquery(latest.values('pk')[:1]),
+            playable=Coalesce(models.Subquery(latest.values('playable')[:1]), models.Value(True),
+                              output_field=models.BooleanField()),
+        )
 
     def __str__(self):
         return '%s - %s' % (self.game_group, self.notes)
@@ -173,3 +196,25 @@ class InventoryItem(TimeStampedModel):
         permissions = (
             ('manage_inventory', _('Manage Inventory')),
         )
+        indexes = [
+            # latest inventory of a game piece
+            models.Index(fields=['game', 'created'], name='inventory_item_game_created'),
+        ]
+
+
+@receiver(post_save, sender=InventoryItem)
+@receiver(post_delete, sender=InventoryItem)
+def update_latest_inventory(sender, instance, **kwargs):
+    """The latest inventory of the game piece might have changed, or the inventory was moved to another piece."""
+    pks = {instance.game_id}
+    pks.update(GamePiece.objects.filter(latest_inventory=instance).values_list('pk', flat=True))
+    GamePiece.update_latest_inventories(pks)
+
+
+@receiver(post_save, sender=GameGroup)
+@receiver(post_delete, sender=GameGroup)
+@receiver(post_save, sender=GamePiece)
+@receiver(post_delete, sender=GamePiece)
+def invalidate_catalogue(sender, **kwargs):
+    """Games shown in the catalogue might have changed."""
+    bump_cache_version(CATALOGUE_CACHE_VERSION)
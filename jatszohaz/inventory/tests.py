@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+import random
+
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from django.urls import reverse
+
+from jatszohaz.models import JhUser
+from .models import GameGroup, GamePiece, InventoryItem
+
+
+class LatestInventoryTest(TestCase):
+    """The denormalised latest inventory of the pieces matches their inventories."""
+
+    def setUp(self):
+        self.user = JhUser.objects.create(username='member')
+        self.pieces = list()
+        for i in range(4):
+            game_group = GameGroup.objects.create(name='Game %d' % i, description='-', short_description='-',
+                                                  image='game.jpg', playtime='20 mins',
+                                                  playtime_category=GameGroup.LENGTH_SHORT[0])
+            self.pieces.extend(GamePiece.objects.create(game_group=game_group, notes=str(j)) for j in range(2))
+
+        self.random = random.Random(0)
+        self.time = datetime.now() - timedelta(days=365)
+
+    def create_inventory(self, piece, playable=None, created=None):
+        if created is None:
+            self.time += timedelta(hours=self.random.randint(1, 48))
+            created = self.time
+        if playable is None:
+            playable = self.random.random() < 0.5
+        return InventoryItem.objects.create(user=self.user, game=piece, playable=playable, created=created)
+
+    def assertLatestInventories(self):
+        """Compares the pointers with the old way: the latest inventory of each piece, one by one."""
+        for piece in GamePiece.objects.all():
+            try:
+                latest = piece.inventories.latest('created')
+            except InventoryItem.DoesNotExist:
+                latest = None
+            self.assertEqual(piece.latest_inventory, latest, piece)
+            self.assertEqual(piece.playable, latest.playable if latest else True, piece)
+
+    def test_without_inventories(self):
+        self.assertLatestInventories()
+
+    def test_create(self):
+        for i in range(30):
+            self.create_inventory(self.random.choice(self.pieces))
+            self.assertLatestInventories()
+
+    def test_older_inventory(self):
+        piece = self.pieces[0]
+        self.create_inventory(piece, playable=False)
+        # recorded later, but done earlier
+        self.create_inventory(piece, playable=True, created=self.time - timedelta(days=30))
+
+        piece.refresh_from_db()
+        self.assertFalse(piece.playable)
+        self.assertLatestInventories()
+
+    def test_delete(self):
+        inventories = [self.create_inventory(self.random.choice(self.pieces)) for i in range(30)]
+        self.random.shuffle(inventories)
+        for inventory in inventories:
+            inventory.delete()
+            self.assertLatestInventories()
+
+    def test_move(self):
+        inventories = [self.create_inventory(self.random.choice(self.pieces)) for i in range(30)]
+        for inventory in self.random.sample(inventories, 15):
+            inventory.game = self.random.choice(self.pieces)
+            inventory.playable = not inventory.playable
+            inventory.save()
+            self.assertLatestInventories()
+
+    def test_rebuild(self):
+        for i in range(20):
+            self.create_inventory(self.random.choice(self.pieces))
+        GamePiece.objects.update(latest_inventory=None, playable=True)
+
+        self.assertEqual(GamePiece.update_latest_inventories(), len(self.pieces))
+        self.assertLatestInventories()
+
+    def test_list_filter(self):
+        for i in range(20):
+            self.create_inventory(self.random.choice(self.pieces))
+        self.user.user_permissions.add(Permission.objects.get(codename='manage_inventory'))
+        self.client.force_login(self.user)
+
+        for value, playable in (('yes', True), ('no', False)):
+            response = self.client.get(reverse('inventory:list'), {'playable': value})
+            expected = [piece.pk for piece in GamePiece.objects.order_by('game_group__name', 'pk')
+                        if (not piece.inventories.exists() or piece.inventories.latest('created').playable) == playable]
+            self.assertEqual([piece.pk for piece in response.context['object_list']], expected)
@@ -2,6 +2,7 @@ import logging
 from django.contrib import messages
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
+from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
@@ -10,6 +11,7 @@ from django.views.generic import CreateView, ListView, UpdateView, FormView
 from inventory.forms import GameForm, GamePieceForm
 
 from .models import InventoryItem, GamePiece, GameGroup
+from jatszohaz.pagination import KeysetPaginationMixin
 from jatszohaz.utils import DefaultUpdateView
 
 logger = logging.getLogger(__name__)
@@ -38,11 +40,42 @@ class NewInvView(SuccessMessageMixin, InventoryPermissionRequiredMixin, CreateVi
         return super().form_valid(form)
 
 
-class InvListView(InventoryPermissionRequiredMixin, ListView):
-    """View for listing all the existing inventories."""
+class InvListView(InventoryPermissionRequiredMixin, KeysetPaginationMixin, ListView):
+    """View for listing the game pieces with their latest inventories, filtered by name, playable state and place."""
     model = GamePiece
     template_name = "inventory/list-inventory.html"
-    ordering = "game_group__name"
+    keyset_ordering = ('game_group__name', 'pk')
+    paginate_by = 50
+
+    def get_filters(self):
+        return {name: self.request.GET.get(name, '') for name in ('name', 'playable', 'place')}
+
+    def get_queryset(self):
+        objects = super().get_queryset().select_related('game_group', 'latest_inventory')
+        filters = self.get_filters()
+
+        # same as the displayed name of the piece, see GamePiece.__str__
+        if filters['name']:
+            objects = objects.filter(Q(game_group__name__icontains=filters['name']) |
+                                     Q(notes__icontains=filters['name']))
+
+        if filters['playable'] in ('yes', 'no'):
+            objects = objects.filter(playable=filters['playable'] == 'yes')
+
+        if filters['place']:
+            objects = objects.filter(place=filters['place'])
+
+        return objects
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+
+        # pass the filters to show them in the filter fields
+        context['filters'] = self.get_filters()
+        context['places'] = GamePiece.objects.exclude(place='').order_by('place')\
+            .values_list('place', flat=True).distinct()
+
+        return context
 
 
 class InvListGameView(InventoryPermissionRequiredMixin, ListView):
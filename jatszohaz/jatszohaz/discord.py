@@ -1,4 +1,6 @@
 import json
+import time
+from typing import List
 
 import requests
 from django.conf import settings
@@ -7,11 +9,55 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# maximum length of the content of a Discord message
+MAX_MESSAGE_LENGTH = 2000
+
+# (connect, read) timeouts of the webhook requests in seconds
+TIMEOUT = (3.05, 10)
+
+# a rate limited message is retried only if Discord asks to wait at most this many seconds,
+# otherwise the request fails and the notification outbox retries it later
+MAX_RETRY_AFTER = 5
+MAX_RATE_LIMIT_RETRIES = 3
+
+# reused for every request, so the HTTPS connection to Discord is kept alive
+session = requests.Session()
+session.headers.update({'Content-Type': 'application/json'})
+
+
+def split_message(message: str) -> List[str]:
+    """
+    Splits the message into parts fitting into a single Discord message.
+
+    Messages are split at line breaks if possible, lines longer than the limit are split at the limit.
+    """
+    parts = []
+    current = ''
+    for line in message.splitlines(keepends=True):
+        while len(line) > MAX_MESSAGE_LENGTH:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(line[:MAX_MESSAGE_LENGTH])
+            line = line[MAX_MESSAGE_LENGTH:]
+
+        if len(current) + len(line) > MAX_MESSAGE_LENGTH:
+            parts.append(current)
+            current = ''
+        current += line
+
+    if current or not parts:
+        parts.append(current)
+    return parts
+
 
 def send_message(message: str):
     """
-    Sends a single message to the configured Discord channel using the configured token.
+    Sends a message to the configured Discord channel using the configured token.
+
+    Messages longer than MAX_MESSAGE_LENGTH are sent in multiple parts, see split_message.
     :param message:
+    :raises requests.RequestException if sending failed.
     """
 
     url = settings.DISCORD_WEBHOOK_URL
@@ -21,11 +67,35 @@ def send_message(message: str):
         return
 
     logger.info(f"Sending message to Discord: {message[:50]}...")
-    resp = requests.post(
-        url,
-        data=json.dumps({'content': message}),
-        headers={'Content-Type': 'application/json'}
-    )
+    for part in split_message(message):
+        _post(url, part)
+
+
+def _post(url: str, content: str):
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        resp = session.post(url, data=json.dumps({'content': content}), timeout=TIMEOUT)
+        if resp.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+            break
+
+        retry_after = _get_retry_after(resp)
+        if retry_after is None or retry_after > MAX_RETRY_AFTER:
+            break
+        logger.info(f"Discord rate limit reached, retrying after {retry_after} s.")
+        time.sleep(retry_after)
 
     if resp.status_code not in (200, 204):
         logger.warning(f"Sending message failed! Response: {resp.status_code} - {resp.text}")
+        resp.raise_for_status()
+
+
+def _get_retry_after(resp: requests.Response):
+    """Returns the seconds to wait before retrying a rate limited request, or None if unknown."""
+    try:
+        return float(resp.json()['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        return float(resp.headers['Retry-After'])
+    except (ValueError, KeyError):
+        return None
@@ -0,0 +1,194 @@
+"""
+Keyset (cursor) pagination.
+
+Offset pagination needs a COUNT(*) and an OFFSET n query, which gets slower with every page. Keyset pagination
+continues after the sort key of the last shown object instead, so every page costs the same as the first one.
+"""
+import base64
+import binascii
+import json
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.http import Http404
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
+
+DIRECTION_NEXT = 'n'
+DIRECTION_PREVIOUS = 'p'
+
+
+class KeysetPaginator:
+    """
+    Paginator walking through the queryset by the values of the ordering fields.
+
+    The ordering must identify the objects uniquely, so it should end with the primary key, e.g. ('-created', '-pk').
+    Fields of non-nullable relations can be used too, e.g. ('game_group__name', 'pk').
+    Pages are identified by opaque tokens instead of page numbers, see `page`.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, ordering=None):
+        self.ordering = tuple(ordering or object_list.query.order_by or ('pk', ))
+        self.object_list = object_list.order_by(*self.ordering)
+        self.per_page = int(per_page)
+        self.current_number = 1
+
+    @cached_property
+    def count(self):
+        """Total number of objects. Only queried if used, e.g. displayed by the template."""
+        return self.object_list.count()
+
+    def get_fields(self):
+        """Returns (name, field, descending) tuples of the ordering."""
+        fields = list()
+        for order in self.ordering:
+            name = order.lstrip('-')
+            opts = self.object_list.model._meta
+            *relations, field_name = name.split(LOOKUP_SEP)
+            for relation in relations:
+                opts = opts.get_field(relation).related_model._meta
+            field = opts.pk if field_name == 'pk' else opts.get_field(field_name)
+            fields.append((name, field, order.startswith('-')))
+        return fields
+
+    def encode_token(self, direction, number, obj):
+        values = list()
+        for name, field, descending in self.get_fields():
+            related = obj
+            for relation in name.split(LOOKUP_SEP)[:-1]:
+                related = getattr(related, relation)
+            # value_to_string keeps the full precision, e.g. the microseconds of datetimes
+            values.append(field.value_to_string(related))
+        data = json.dumps([direction, number, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_token(self, token):
+        """Returns (direction, page number, list of key values) of the given token."""
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            direction, number, values = json.loads(data.decode())
+            fields = self.get_fields()
+            if direction not in (DIRECTION_NEXT, DIRECTION_PREVIOUS) or len(values) != len(fields):
+                raise ValueError
+            values = [field.to_python(value) for (name, field, descending), value in zip(fields, values)]
+            return direction, int(number), values
+        except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+            raise InvalidPage(_("Invalid page token."))
+
+    def filter_after(self, values, reverse=False):
+        """Returns a Q object matching the objects after the given key values in the ordering (or before if reverse)."""
+        condition = Q()
+        equal = Q()
+        for (name, field, descending), value in zip(self.get_fields(), values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{'%s__%s' % (name, lookup): value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, token=None):
+        """
+        Returns the page identified by the given token, or the first page if no token is given.
+
+        :raises InvalidPage if the token is malformed.
+        """
+        if not token:
+            objects = list(self.object_list[:self.per_page + 1])
+            return self._get_page(objects[:self.per_page], 1, has_previous=False,
+                                  has_next=len(objects) > self.per_page)
+
+        direction, number, values = self.decode_token(token)
+        if direction == DIRECTION_NEXT:
+            objects = list(self.object_list.filter(self.filter_after(values))[:self.per_page + 1])
+            return self._get_page(objects[:self.per_page], number, has_previous=True,
+                                  has_next=len(objects) > self.per_page)
+
+        reversed_ordering = [order[1:] if order.startswith('-') else '-' + order for order in self.ordering]
+        objects = list(self.object_list.filter(self.filter_after(values, reverse=True))
+                       .order_by(*reversed_ordering)[:self.per_page + 1])
+        return self._get_page(objects[:self.per_page][::-1], number, has_previous=len(objects) > self.per_page,
+                              has_next=True)
+
+    def _get_page(self, object_list, number, has_previous, has_next):
+        self.current_number = number
+        return KeysetPage(object_list, number, self, has_previous, has_next)
+
+    @property
+    def page_range(self):
+        """Only the number of the current page is known without counting the objects before it."""
+        return range(self.current_number, self.current_number + 1)
+
+
+class KeysetPage:
+    """
+    A page of KeysetPaginator, compatible with the page objects of Django in templates.
+
+    `previous_page_number` and `next_page_number` return the tokens of the neighbouring pages, so they can be used as
+    the page parameter of the links.
+    """
+
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page %s>' % self.number
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_page_number(self):
+        return self.paginator.encode_token(DIRECTION_PREVIOUS, self.number - 1, self.object_list[0])
+
+    def next_page_number(self):
+        return self.paginator.encode_token(DIRECTION_NEXT, self.number + 1, self.object_list[-1])
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin replacing the offset pagination with KeysetPaginator.
+
+    Set `keyset_ordering` to the ordering of the list, ending with a unique field.
+    The other GET parameters of the request, e.g. filters, are passed to the template as `page_query`, so the page
+    links can keep them.
+    """
+    paginator_class = KeysetPaginator
+    keyset_ordering = None
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page,
+                                    ordering=self.keyset_ordering, **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size, orphans=self.get_paginate_orphans(),
+                                       allow_empty_first_page=self.get_allow_empty())
+        try:
+            page = paginator.page(self.request.GET.get(self.page_kwarg))
+        except InvalidPage as e:
+            raise Http404(_('Invalid page: %(message)s') % {'message': str(e)})
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.copy()
+        query.pop(self.page_kwarg, None)
+        context['page_query'] = query.urlencode() + '&' if query else ''
+        return context
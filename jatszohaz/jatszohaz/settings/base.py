@@ -119,6 +119,8 @@ LOCAL_APPS = (
     'rent',
     'news',
     'stats',
+    'notifications',
+    'cron',
 )
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -171,6 +173,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Shared between the worker processes, so invalidation done by one process is seen by the others.
+# The table is created by the `createcachetable` management command.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'jatszohaz_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -224,7 +240,9 @@ MEDIA_URL = '/media/'
 # ######### END STATIC FILE CONFIGURATION
 
 # ######### EMAIL CONFIGURATION
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# emails are stored in the outbox and sent by its worker using OUTBOX_EMAIL_BACKEND
+EMAIL_BACKEND = 'notifications.backends.OutboxEmailBackend'
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#server-email
 DEFAULT_FROM_EMAIL = get_env_variable('DEFAULT_FROM_EMAIL', '')
@@ -259,10 +277,28 @@ LOGIN_URL = "/login/%s/" % SOCIAL_AUTH_BACKEND
 SLACK_TOKEN = get_env_variable("SLACK_TOKEN", "")
 SLACK_CHANNEL = get_env_variable("SLACK_CHANNEL", "")
 SLACK_AS_USER = True
+# messages are stored in the outbox and sent by its worker using SLACK_BACKEND_FOR_QUEUE
+SLACK_BACKEND = 'notifications.backends.OutboxSlackBackend'
 # ######## END SLACK CONFIGURATION
 
 DISCORD_WEBHOOK_URL = get_env_variable("DISCORD_WEBHOOK_URL", "")
 
+# ######## NOTIFICATION OUTBOX CONFIGURATION
+# number of background threads of the web process delivering notifications, 0 to leave it to process_outbox command
+OUTBOX_WORKER_THREADS = int(get_env_variable('OUTBOX_WORKER_THREADS', '1'))
+
+# number of delivery attempts before giving up a notification
+OUTBOX_MAX_ATTEMPTS = 5
+
+# seconds to wait before retrying a failed notification, doubled after every attempt
+OUTBOX_RETRY_DELAY = 60
+# ######## END NOTIFICATION OUTBOX CONFIGURATION
+
+# ######## STATISTICS CONFIGURATION
+# number of background threads of the web process recomputing the changed months, 0 to leave it to refresh_stats command
+STATS_WORKER_THREADS = int(get_env_variable('STATS_WORKER_THREADS', '1'))
+# ######## END STATISTICS CONFIGURATION
+
 EDU_PERSON_ENTITLEMENT_ID = int(get_env_variable('DJANGO_ENTITLEMENT_ID', '-1'))
 
 # specifies a title string, which will not be given admin rights
@@ -45,26 +45,26 @@ $(document).ready(function(){
     slider_player_filter.on('change', refreshFilters);
     slider_playtime_filter.on('change', refreshFilters);
     game_name_filter.on('input', refreshFilters);
-});
-
-$(document).ready(function(){
-    inventory_name_filter = $('#inventory-name-filter');
 
-    var refreshInventoryFilters = function(){
-        $(".inventory_item_container")
-            .filter(function(){
-                var item_name = inventory_name_filter.val().toLowerCase();
-                var name = $(this).attr('data-game-name').indexOf(item_name) > -1;
-                return name;
-            }).fadeIn(500);
-
-        $(".inventory_item_container")
-            .filter(function(){
-                var item_name = inventory_name_filter.val().toLowerCase();
-                var name = $(this).attr('data-game-name').indexOf(item_name) == -1;
-                return name;
-            }).fadeOut(500);
-    };
+    // details of the games are loaded when their modal is opened
+    $('#game-modal').on('show.bs.modal', function(e) {
+        var modal = $(this);
+        var url = $(e.relatedTarget).attr('data-game-url');
+        var not_available = modal.attr('data-not-available');
+        modal.data('game-url', url);
+        modal.find('.game-name, .game-players, .game-playtime, .game-description').text('...');
 
-    inventory_name_filter.on('input', refreshInventoryFilters);
+        $.getJSON(url, function(game) {
+            // another game might have been opened meanwhile
+            if (modal.data('game-url') != url) {
+                return;
+            }
+            modal.find('.game-name').text(game.name);
+            modal.find('.game-players').text(game.players || not_available);
+            modal.find('.game-playtime').text(game.playtime || not_available);
+            modal.find('.game-description').text(game.description || not_available);
+        }).fail(function() {
+            modal.find('.game-players, .game-playtime, .game-description').text(not_available);
+        });
+    });
 });
\ No newline at end of file
@@ -0,0 +1,52 @@
+from django.contrib import messages
+from django.contrib.auth.models import Permission
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.cache import SessionStore
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from .models import JhUser
+from .views import GamesView
+
+
+class GamesViewTest(TestCase):
+    """The games page is revalidated with its ETag, unless it would show something else."""
+
+    def setUp(self):
+        self.user = JhUser.objects.create(username='member')
+        self.client.force_login(self.user)
+        self.url = reverse('games')
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.get_etag()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_permissions_changed(self):
+        etag = self.get_etag()
+
+        # the menu of the page has a new item
+        self.user.user_permissions.add(Permission.objects.get(codename='manage_rents'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, reverse('rent:rents'))
+
+    def test_pending_messages(self):
+        etag = self.get_etag()
+
+        request = RequestFactory().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        request.user = self.user
+        request.session = SessionStore()
+        request._messages = FallbackStorage(request)
+        messages.success(request, "Successfully updated!")
+
+        response = GamesView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertContains(response.render(), "Successfully updated!")
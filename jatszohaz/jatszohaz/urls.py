@@ -26,6 +26,8 @@ urlpatterns = [
 
     # Games and renting related pages
     url(r'^games/$', views.GamesView.as_view(), name="games"),
+    url(r'^games/api/$', views.GamesApiView.as_view(), name="games-api"),
+    url(r'^games/api/(?P<pk>\d+)/$', views.GameApiView.as_view(), name="game-api"),
     url(r'', include('social_django.urls', namespace='social')),
     url(r'^logout/', LogoutView.as_view(), name='logout'),
 
@@ -1,24 +1,41 @@
 import logging
+from time import time
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.utils.html import strip_tags
-from django.template.loader import get_template
 from django.views.generic import UpdateView
 from django_slack import slack_message
 
-from .discord import send_message as discord_send_message
+from notifications.models import OutboxMessage
+from notifications.outbox import enqueue
+from notifications.rendering import CHANNEL_DISCORD, CHANNEL_EMAIL, SLACK_MESSAGE_TEMPLATE, MemberNotification
+
+from .discord import split_message as split_discord_message
 
 logger = logging.getLogger(__name__)
 
 
-def jh_send_mail(subject, html_message, recipient_list, fail_silently=False):
+def jh_create_mail(subject, html_message, recipient_list):
     message = strip_tags(html_message.replace("<br/>", "\n"))
     msg = EmailMultiAlternatives(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list)
     msg.attach_alternative(html_message, "text/html")
+    return msg
+
+
+def jh_send_mail(subject, html_message, recipient_list, fail_silently=False):
+    msg = jh_create_mail(subject, html_message, recipient_list)
     msg.send(fail_silently=fail_silently)
     logger.info("Email sent to: %s" % recipient_list)
 
 
+def jh_send_mails(messages, fail_silently=False):
+    """Sends the given emails (created by jh_create_mail) through one connection."""
+    connection = get_connection(fail_silently=fail_silently)
+    connection.send_messages(messages)
+    logger.info("%d emails sent to: %s" % (len(messages), [msg.to for msg in messages]))
+
+
 def send_slack_message(template, context=None):
     try:
         slack_message(template, context, fail_silently=False)
@@ -26,19 +43,52 @@ def send_slack_message(template, context=None):
         logger.error("Failed to send slack message: %s" % e)
 
 
-def send_message_to_members(template_path, context=None):
+def send_message_to_members(name, context=None, email_subject=None, email_recipients=()):
     """
     Sends out appropriate messages to notify group members.
+
+    Each channel is rendered only once, see notifications.rendering.MemberNotification.
+
+    :param name: name of the notification, see notifications.rendering.MemberNotification.
+    :param email_subject: subject of the email, which is sent only if there are email_recipients.
+    """
+    notification = MemberNotification(name, context)
+
+    # send out the already rendered message on Slack
+    send_slack_message(SLACK_MESSAGE_TEMPLATE, notification.get_slack_context())
+
+    # send out the message on Discord
+    # parts are queued separately, so a failed part is retried without resending the others
+    for part in split_discord_message(notification.render(CHANNEL_DISCORD)):
+        enqueue(OutboxMessage.CHANNEL_DISCORD[0], {'content': part})
+
+    # one email to every recipient
+    if email_recipients:
+        try:
+            jh_send_mail(email_subject, notification.render(CHANNEL_EMAIL), list(email_recipients))
+        except Exception as e:
+            logger.error("Failed to send email! %s" % e)
+
+
+def get_cache_version(name):
+    """
+    Returns the current version of a group of cached values.
+
+    The version should be part of the cache keys of the group, so bumping it invalidates all of them at once.
+    Versions are timestamps (in microseconds) of the last invalidation, so they are not reused even if the version
+    itself is evicted from the cache.
     """
-    # send out the message on Slack
-    # template will get rendered in the lib
-    send_slack_message(template_path, context)
-
-    # render template manually and send out the message on Discord
-    template_path = template_path.replace('slack', 'discord')  # fixme hack: remove this after dropping Slack...
-    template = get_template(template_path)
-    rendered_message = template.render(context)
-    discord_send_message(rendered_message)
+    key = 'version:%s' % name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time() * 1000000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(name):
+    """Invalidates every cached value of the given group, see get_cache_version."""
+    cache.set('version:%s' % name, int(time() * 1000000), timeout=None)
 
 
 class DefaultUpdateView(UpdateView):
@@ -1,4 +1,7 @@
+import hashlib
 import logging
+from datetime import datetime
+
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model, login
@@ -9,18 +12,24 @@ from django.core import signing
 from django.core.exceptions import SuspiciousOperation, PermissionDenied
 from django.db.models import Value
 from django.db.models.functions import Concat
+from django.http import JsonResponse
 from django.shortcuts import redirect, get_object_or_404
-from django.urls import reverse_lazy
-from django.utils.translation import ugettext_lazy as _
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.translation import get_language, ugettext_lazy as _
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView, ListView, DetailView, UpdateView, RedirectView, View, FormView
 
 from braces.views import PermissionRequiredMixin
 
 from .forms import JhUserForm
 from .forms import NewCommentForm
-from inventory.models import GameGroup
+from inventory.models import CATALOGUE_CACHE_TIMEOUT, CATALOGUE_CACHE_VERSION, GameGroup
 from .models import JhUser
 from .models import UserComment
+from .pagination import KeysetPaginationMixin
+from .utils import get_cache_version
 
 logger = logging.getLogger(__name__)
 
@@ -31,14 +40,131 @@ class CalendarView(TemplateView):
     template_name = "jatszohaz/calendar.html"
 
 
+def get_catalogue_version(request):
+    """Returns the cache version of the games catalogue, it is read only once per request."""
+    if not hasattr(request, 'catalogue_version'):
+        request.catalogue_version = get_cache_version(CATALOGUE_CACHE_VERSION)
+    return request.catalogue_version
+
+
+def has_pending_messages(request):
+    """Returns True if the request has messages to show, they are not marked as shown."""
+    return len(messages.get_messages(request)) > 0
+
+
+def get_permissions_hash(user):
+    """Returns a short hash of the permissions of the user, the menu of the pages depends on them."""
+    permissions = sorted(user.get_all_permissions()) + [str(user.is_superuser)]
+    return hashlib.md5(' '.join(permissions).encode()).hexdigest()[:12]
+
+
+def get_catalogue_etag(request, *args, **kwargs):
+    # the page with messages can't be revalidated, they would be lost
+    if has_pending_messages(request):
+        return None
+    # the menu of the page depends on the user and their permissions, the texts on the language
+    return '%d-%d-%s-%s' % (get_catalogue_version(request), request.user.pk or 0, get_language(),
+                            get_permissions_hash(request.user))
+
+
+def get_catalogue_last_modified(request, *args, **kwargs):
+    if has_pending_messages(request):
+        return None
+    return get_catalogue_api_last_modified(request)
+
+
+def get_catalogue_api_etag(request, *args, **kwargs):
+    return str(get_catalogue_version(request))
+
+
+def get_catalogue_api_last_modified(request, *args, **kwargs):
+    # the version is the time of the last change, in microseconds
+    return datetime.utcfromtimestamp(get_catalogue_version(request) / 1000000)
+
+
+def get_image_url(game):
+    return game.image.url if game.image else None
+
+
+@method_decorator(cache_control(private=True, no_cache=True), name='dispatch')
+@method_decorator(condition(etag_func=get_catalogue_etag, last_modified_func=get_catalogue_last_modified),
+                  name='dispatch')
 class GamesView(ListView):
-    """Displaying all games available for renting."""
+    """
+    Displaying all games available for renting.
+
+    The list of the games is cached until a game changes, and browsers revalidate the page with its ETag.
+    """
 
     model = GameGroup
     template_name = "jatszohaz/games.html"
     ordering = "name"
     queryset = GameGroup.objects.filter(hide=False)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['catalogue_version'] = get_catalogue_version(self.request)
+        context['catalogue_timeout'] = CATALOGUE_CACHE_TIMEOUT
+        return context
+
+
+@method_decorator(cache_control(no_cache=True), name='dispatch')
+@method_decorator(condition(etag_func=get_catalogue_api_etag,
+                            last_modified_func=get_catalogue_api_last_modified),
+                  name='dispatch')
+class GamesApiView(View):
+    """
+    JSON endpoint listing the games of the catalogue, without their descriptions.
+
+    Descriptions are loaded by GameApiView, when the user opens the details of a game.
+    """
+
+    http_method_names = ['get', ]
+
+    def get(self, request, *args, **kwargs):
+        games = GameGroup.objects.filter(hide=False)\
+            .only('name', 'image', 'min_players', 'max_players', 'playtime_category')\
+            .order_by('name')
+        return JsonResponse({
+            'games': [{
+                'id': game.pk,
+                'name': game.name,
+                'min_players': game.min_players,
+                'max_players': game.max_players,
+                'players': game.players,
+                'playtime_category': game.playtime_category,
+                'thumbnail': get_image_url(game),
+                'url': reverse('game-api', kwargs={'pk': game.pk}),
+            } for game in games],
+        })
+
+
+@method_decorator(cache_control(no_cache=True), name='dispatch')
+@method_decorator(condition(etag_func=get_catalogue_api_etag,
+                            last_modified_func=get_catalogue_api_last_modified),
+                  name='dispatch')
+class GameApiView(View):
+    """
+    JSON endpoint of the details of a game, shown in the modal of the games page and the rent wizard.
+
+    Hidden games are included, because they can be rented.
+    """
+
+    http_method_names = ['get', ]
+
+    def get(self, request, *args, **kwargs):
+        game = get_object_or_404(GameGroup, pk=kwargs.get('pk'))
+        return JsonResponse({
+            'id': game.pk,
+            'name': game.name,
+            'players': game.players,
+            'playtime': game.playtime,
+            'playtime_category': game.playtime_category,
+            'short_description': game.short_description,
+            'description': game.description,
+            'thumbnail': get_image_url(game),
+        })
+
 
 class MyProfileView(SuccessMessageMixin, LoginRequiredMixin, UpdateView):
     """View for editing the logged in user's profile."""
@@ -125,11 +251,12 @@ class AfterLoginView(RedirectView):
         return reverse_lazy('home')
 
 
-class UsersView(PermissionRequiredMixin, ListView):
+class UsersView(PermissionRequiredMixin, KeysetPaginationMixin, ListView):
     """Showing list of registered users."""
     model = JhUser
     permission_required = 'jatszohaz.view_all'
     template_name = "jatszohaz/user_list.html"
+    keyset_ordering = ('last_name', 'first_name', 'pk')
     paginate_by = 100
 
     def get_queryset(self):
@@ -4,6 +4,7 @@ from django.urls import reverse_lazy
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import ListView, CreateView
 
+from jatszohaz.pagination import KeysetPaginationMixin
 from jatszohaz.utils import DefaultUpdateView
 
 from .models import News
@@ -14,10 +15,11 @@ class NewsPermissionRequiredMixin(PermissionRequiredMixin):
     permission_required = 'news.manage_news'
 
 
-class NewsView(ListView):
+class NewsView(KeysetPaginationMixin, ListView):
     """Displaying news publicly."""
     model = News
     template_name = 'news.html'
+    keyset_ordering = ('-created', '-pk')
     paginate_by = 5
 
     def get_queryset(self):
@@ -0,0 +1,29 @@
+"""
+Email and Slack backends storing the messages in the outbox instead of sending them.
+
+The real backends are configured by OUTBOX_EMAIL_BACKEND and SLACK_BACKEND_FOR_QUEUE, they are used by the outbox
+worker to deliver the messages.
+"""
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django_slack.utils import Backend
+
+from .models import OutboxMessage
+from .outbox import enqueue, serialize_email
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Email backend storing every message in the outbox."""
+
+    def send_messages(self, email_messages):
+        with transaction.atomic():
+            for message in email_messages:
+                enqueue(OutboxMessage.CHANNEL_EMAIL[0], serialize_email(message))
+        return len(email_messages)
+
+
+class OutboxSlackBackend(Backend):
+    """django_slack backend storing the rendered messages in the outbox."""
+
+    def send(self, url, message_data, **kwargs):
+        enqueue(OutboxMessage.CHANNEL_SLACK[0], {'url': url, 'data': message_data})
@@ -0,0 +1,108 @@
+"""
+Sending batches of emails through one pooled connection.
+
+Opening an SMTP connection (with TLS and authentication) takes much longer than sending a message, so the outbox
+worker sends every email of a batch through one connection of OUTBOX_EMAIL_BACKEND.
+"""
+import logging
+from smtplib import SMTPServerDisconnected
+from time import perf_counter
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class BatchMetrics:
+    """Timing of a batch sent by BatchMailSender, durations are in seconds."""
+
+    def __init__(self):
+        self.messages = 0
+        self.failed = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.send_time = 0.0
+
+    def __str__(self):
+        return "%d/%d emails sent through %d connection(s) in %.1f ms (connecting: %.1f ms, %.1f ms per email)" % (
+            self.messages - self.failed, self.messages, self.connections,
+            (self.connect_time + self.send_time) * 1000, self.connect_time * 1000,
+            self.send_time * 1000 / self.messages if self.messages else 0)
+
+
+class BatchMailSender:
+    """
+    Sends emails through one connection, which is opened on the first message and reopened if the server drops it.
+
+    Use it as a context manager, the connection is closed and the metrics of the batch are logged at the end::
+
+        with BatchMailSender() as sender:
+            sender.send_messages(messages)
+        print(sender.metrics)
+    """
+
+    def __init__(self, backend=None):
+        self.connection = get_connection(backend or settings.OUTBOX_EMAIL_BACKEND)
+        self.metrics = BatchMetrics()
+        self.opened = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        if self.metrics.messages:
+            logger.info("Email batch: %s" % self.metrics)
+
+    def open(self):
+        started = perf_counter()
+        try:
+            self.connection.open()
+        finally:
+            self.metrics.connections += 1
+            self.metrics.connect_time += perf_counter() - started
+        self.opened = True
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            try:
+                self.connection.close()
+            except Exception as e:
+                logger.warning("Failed to close email connection: %s" % e)
+
+    def send(self, message):
+        """Sends a single EmailMessage, raises an exception on failure."""
+        self.metrics.messages += 1
+        try:
+            if not self.opened:
+                self.open()
+            try:
+                self._send(message)
+            except SMTPServerDisconnected:
+                # the server may close idle or long lived connections, try once more with a new one
+                self.close()
+                self.open()
+                self._send(message)
+        except Exception:
+            self.metrics.failed += 1
+            raise
+
+    def _send(self, message):
+        started = perf_counter()
+        try:
+            self.connection.send_messages([message])
+        finally:
+            self.metrics.send_time += perf_counter() - started
+
+    def send_messages(self, messages):
+        """Sends the given EmailMessage objects, returns the list of errors (None for the sent messages)."""
+        errors = list()
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append("%s: %s" % (e.__class__.__name__, e))
+        return errors
@@ -0,0 +1,98 @@
+from statistics import mean
+from time import perf_counter
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from jatszohaz import discord
+from jatszohaz.utils import jh_create_mail, jh_send_mail
+from notifications.models import OutboxMessage
+from notifications.outbox import enqueue, process_outbox
+from notifications.sink import SinkHTTPServer, SinkSMTPServer, start_in_thread
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares the latency of sending notifications directly and through the outbox, " \
+           "using local stand-in SMTP and webhook servers. Nothing is sent to real recipients, " \
+           "the messages of the outbox are created in one transaction, which is rolled back at the end."
+
+    smtp_backend = 'django.core.mail.backends.smtp.EmailBackend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Number of notifications to send.')
+        parser.add_argument('--delay', type=float, default=0.05,
+                            help='Simulated latency of the servers in seconds.')
+
+    def handle(self, *args, **options):
+        if OutboxMessage.objects.filter(status=OutboxMessage.STATUS_PENDING[0]).exists():
+            raise CommandError("The outbox has pending messages, they would be sent to the stand-in servers!")
+
+        smtp = SinkSMTPServer(('localhost', 0), connect_delay=options['delay'], message_delay=options['delay'])
+        http = SinkHTTPServer(('localhost', 0), delay=options['delay'])
+        smtp_host, smtp_port = start_in_thread(smtp)
+        http_host, http_port = start_in_thread(http)
+
+        with override_settings(EMAIL_HOST=smtp_host, EMAIL_PORT=smtp_port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                               EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                               DEFAULT_FROM_EMAIL=settings.DEFAULT_FROM_EMAIL or 'benchmark@example.com',
+                               OUTBOX_EMAIL_BACKEND=self.smtp_backend, OUTBOX_WORKER_THREADS=0,
+                               DISCORD_WEBHOOK_URL='http://%s:%d/discord/' % (http_host, http_port)):
+            direct = self.measure(options['count'], self.send_directly)
+
+            # the benchmark messages are never committed, so other workers can not deliver them to the real
+            # servers, whatever their status is at the end
+            try:
+                with transaction.atomic():
+                    queued = self.measure(options['count'], self.send_to_outbox)
+
+                    started = perf_counter()
+                    run = process_outbox()
+                    drain = perf_counter() - started
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        smtp.shutdown()
+        http.shutdown()
+
+        self.report("Direct", direct)
+        self.report("Outbox", queued)
+        self.stdout.write("Outbox worker: %s in %.1f ms." % (run, drain * 1000))
+        for metrics in run.email_batches:
+            self.stdout.write("  %s" % metrics)
+        self.stdout.write(self.style.SUCCESS("Stand-in servers received %d emails through %d connections and %d "
+                                             "webhook messages." % (smtp.stats.messages, smtp.stats.connections,
+                                                                    http.stats.messages)))
+
+    def send_directly(self, i):
+        """The old way: an own SMTP connection for every email and a synchronous webhook call."""
+        message = jh_create_mail("Benchmark %d" % i, "Hi!<br/>", ['benchmark@example.com'])
+        message.connection = get_connection(self.smtp_backend)
+        message.send()
+        discord.send_message("Benchmark %d" % i)
+
+    def send_to_outbox(self, i):
+        jh_send_mail("Benchmark %d" % i, "Hi!<br/>", ['benchmark@example.com'])
+        enqueue(OutboxMessage.CHANNEL_DISCORD[0], {'content': "Benchmark %d" % i})
+
+    def measure(self, count, function):
+        """Returns the list of durations of the calls in milliseconds."""
+        durations = list()
+        for i in range(count):
+            started = perf_counter()
+            function(i)
+            durations.append((perf_counter() - started) * 1000)
+        return durations
+
+    def report(self, name, durations):
+        durations = sorted(durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        self.stdout.write("%s: mean %.1f ms, p95 %.1f ms, max %.1f ms per notification" % (
+            name, mean(durations), p95, durations[-1]))
@@ -0,0 +1,29 @@
+from time import perf_counter, sleep
+
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = "Delivers the due notifications of the outbox. " \
+           "With --loop it keeps running and checks the outbox periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Number of messages claimed at once.')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of messages to process.')
+        parser.add_argument('--loop', action='store_true', help='Keep running until interrupted.')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds to wait between runs with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = perf_counter()
+            run = process_outbox(batch_size=options['batch_size'], limit=options['limit'])
+            if run.sent or run.failed or not options['loop']:
+                self.stdout.write("%s in %.2f s." % (run, perf_counter() - started))
+                for metrics in run.email_batches:
+                    self.stdout.write("  %s" % metrics)
+
+            if not options['loop']:
+                break
+            sleep(options['interval'])
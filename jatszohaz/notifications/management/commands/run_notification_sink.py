@@ -0,0 +1,40 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from notifications.sink import SinkHTTPServer, SinkSMTPServer, start_in_thread
+
+
+class Command(BaseCommand):
+    help = "Runs local stand-in SMTP and webhook servers, which accept and drop every notification. " \
+           "Point EMAIL_HOST/EMAIL_PORT and DISCORD_WEBHOOK_URL to them for testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--smtp-port', type=int, default=1025)
+        parser.add_argument('--http-port', type=int, default=8025)
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before accepting a message.')
+        parser.add_argument('--rate-limit-every', type=int, default=0,
+                            help='Respond with 429 Too Many Requests to every nth webhook request.')
+
+    def handle(self, *args, **options):
+        smtp = SinkSMTPServer((options['host'], options['smtp_port']),
+                              connect_delay=options['delay'], message_delay=options['delay'])
+        http = SinkHTTPServer((options['host'], options['http_port']), delay=options['delay'],
+                              rate_limit_every=options['rate_limit_every'])
+        start_in_thread(smtp)
+        start_in_thread(http)
+        self.stdout.write("SMTP server: %s:%d" % smtp.server_address)
+        self.stdout.write("Webhook server: http://%s:%d/discord/ (or /slack/)" % http.server_address)
+
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            smtp.shutdown()
+            http.shutdown()
+
+        self.stdout.write(self.style.SUCCESS("Received %d emails through %d connections and %d webhook messages." % (
+            smtp.stats.messages, smtp.stats.connections, http.stats.messages)))
@@ -0,0 +1,51 @@
+import json
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from model_utils.models import TimeStampedModel
+
+
+class OutboxMessage(TimeStampedModel):
+    """
+    Represents a notification (email, Slack or Discord message) waiting to be delivered.
+
+    Views only create these objects, the actual sending is done by the outbox worker, see notifications.outbox.
+    """
+
+    CHANNEL_EMAIL = ("email", _("Email"))
+    CHANNEL_SLACK = ("slack", _("Slack"))
+    CHANNEL_DISCORD = ("discord", _("Discord"))
+    CHANNEL_CHOICES = (
+        CHANNEL_EMAIL,
+        CHANNEL_SLACK,
+        CHANNEL_DISCORD,
+    )
+
+    STATUS_PENDING = ("pending", _("Pending"))
+    STATUS_SENT = ("sent", _("Sent"))
+    STATUS_FAILED = ("failed", _("Failed"))
+    STATUS_CHOICES = (
+        STATUS_PENDING,
+        STATUS_SENT,
+        STATUS_FAILED,
+    )
+
+    channel = models.CharField(verbose_name=_("Channel"), choices=CHANNEL_CHOICES, max_length=20)
+    payload = models.TextField(verbose_name=_("Payload"), help_text=_("JSON encoded message."))
+    status = models.CharField(verbose_name=_("Status"), choices=STATUS_CHOICES,
+                              default=STATUS_PENDING[0], max_length=20)
+    attempts = models.PositiveIntegerField(verbose_name=_("Attempts"), default=0)
+    next_attempt = models.DateTimeField(verbose_name=_("Next attempt"), default=timezone.now)
+    last_error = models.TextField(verbose_name=_("Last error"), blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outbox_status_next_attempt'),
+        ]
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.get_channel_display(), self.created, self.get_status_display())
+
+    def get_payload(self):
+        return json.loads(self.payload)
@@ -0,0 +1,222 @@
+"""
+Persistent outbox of notifications.
+
+Views only store the notifications with `enqueue`, which is fast and can not fail because of a slow or unavailable
+SMTP server, Slack or Discord. The messages are delivered by `process_outbox`, which is run
+
+* by a background thread pool of the web process after the enqueuing transaction is committed
+  (if OUTBOX_WORKER_THREADS is not 0), and
+* by the `process_outbox` management command, e.g. from cron or as a separate long running worker (--loop).
+
+Failed deliveries are retried with exponential backoff, at most OUTBOX_MAX_ATTEMPTS times.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .mail import BatchMailSender
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# time while a claimed message is not picked up by other workers, it should be enough to deliver a whole batch
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+_executor = None
+_worker_queued = False
+_worker_lock = threading.Lock()
+
+
+def enqueue(channel, payload):
+    """
+    Stores a notification to be delivered by the outbox worker.
+
+    :param channel: one of the OutboxMessage.CHANNEL_CHOICES keys.
+    :param payload: JSON serializable message, see the deliver_* functions for the format of each channel.
+    """
+    message = OutboxMessage.objects.create(channel=channel, payload=json.dumps(payload))
+    wake_up_worker()
+    return message
+
+
+def wake_up_worker():
+    """Schedules a run of process_outbox on the background thread pool, after the current transaction commits."""
+    if settings.OUTBOX_WORKER_THREADS:
+        transaction.on_commit(_submit_worker)
+
+
+def _submit_worker():
+    global _executor, _worker_queued
+
+    with _worker_lock:
+        # a queued run will deliver every message created until it starts
+        if _worker_queued:
+            return
+        _worker_queued = True
+
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.OUTBOX_WORKER_THREADS,
+                                           thread_name_prefix='outbox')
+
+    _executor.submit(_run_worker)
+
+
+def _run_worker():
+    global _worker_queued
+
+    with _worker_lock:
+        _worker_queued = False
+
+    try:
+        process_outbox()
+    except Exception:
+        logger.exception("Outbox worker failed!")
+    finally:
+        connection.close()
+
+
+def claim_messages(batch_size):
+    """
+    Returns a list of due messages and postpones their next attempt by CLAIM_TIMEOUT, so no other worker delivers
+    them at the same time. If a worker dies, its messages are picked up again after the timeout.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = OutboxMessage.objects\
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)\
+            .filter(status=OutboxMessage.STATUS_PENDING[0], next_attempt__lte=now)\
+            .order_by('next_attempt', 'pk')[:batch_size]
+        messages = list(messages)
+
+        OutboxMessage.objects.filter(pk__in=[m.pk for m in messages]).update(next_attempt=now + CLAIM_TIMEOUT)
+
+    return messages
+
+
+def get_retry_delay(attempts):
+    """Returns the time to wait before the next attempt after the given number of failed attempts."""
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+class OutboxRun:
+    """Result of process_outbox."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        # BatchMetrics of the emails of each batch
+        self.email_batches = list()
+
+    def __str__(self):
+        return "%d notifications sent, %d failed" % (self.sent, self.failed)
+
+
+def process_outbox(batch_size=50, limit=None):
+    """
+    Delivers the due messages of the outbox in batches.
+
+    :param limit: maximum number of messages to process, unlimited if None.
+    :return: OutboxRun object.
+    """
+    run = OutboxRun()
+
+    while limit is None or run.sent + run.failed < limit:
+        messages = claim_messages(batch_size if limit is None else min(batch_size, limit - run.sent - run.failed))
+        if not messages:
+            break
+
+        for message, error in deliver_messages(messages, run):
+            message.attempts += 1
+            if error is None:
+                message.status = OutboxMessage.STATUS_SENT[0]
+                message.last_error = ''
+                run.sent += 1
+            else:
+                logger.warning("Failed to deliver %s notification #%d (attempt %d): %s" % (
+                    message.channel, message.pk, message.attempts, error))
+                message.last_error = error
+                if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    message.status = OutboxMessage.STATUS_FAILED[0]
+                    logger.error("Giving up %s notification #%d!" % (message.channel, message.pk))
+                else:
+                    message.next_attempt = timezone.now() + get_retry_delay(message.attempts)
+                run.failed += 1
+            message.save(update_fields=['status', 'attempts', 'next_attempt', 'last_error', 'modified'])
+
+    return run
+
+
+def deliver_messages(messages, run=None):
+    """
+    Delivers the given messages, yields (message, error) tuples, where error is None on success.
+
+    :param run: optional OutboxRun to add the metrics of the emails to.
+    """
+    emails = [m for m in messages if m.channel == OutboxMessage.CHANNEL_EMAIL[0]]
+    if emails:
+        # one connection for every email of the batch
+        with BatchMailSender() as sender:
+            for message in emails:
+                yield message, _deliver(deliver_email, message, sender)
+        if run is not None:
+            run.email_batches.append(sender.metrics)
+
+    for message in messages:
+        if message.channel == OutboxMessage.CHANNEL_SLACK[0]:
+            yield message, _deliver(deliver_slack, message)
+        elif message.channel == OutboxMessage.CHANNEL_DISCORD[0]:
+            yield message, _deliver(deliver_discord, message)
+        elif message.channel != OutboxMessage.CHANNEL_EMAIL[0]:
+            yield message, "Unknown channel!"
+
+
+def _deliver(function, message, *args):
+    try:
+        function(message.get_payload(), *args)
+    except Exception as e:
+        return "%s: %s" % (e.__class__.__name__, e)
+    return None
+
+
+def serialize_email(message):
+    """Returns the JSON serializable payload of an EmailMessage, attachments are not supported."""
+    if message.attachments:
+        raise ValueError("Attachments can not be sent through the outbox!")
+
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'cc': message.cc,
+        'bcc': message.bcc,
+        'reply_to': message.reply_to,
+        'headers': message.extra_headers,
+        'alternatives': getattr(message, 'alternatives', []),
+    }
+
+
+def deliver_email(payload, sender):
+    sender.send(EmailMultiAlternatives(**payload))
+
+
+def deliver_slack(payload):
+    """Sends the message prepared by django_slack with the backend in SLACK_BACKEND_FOR_QUEUE."""
+    from django_slack.app_settings import app_settings
+
+    backend = import_string(app_settings.BACKEND_FOR_QUEUE)()
+    backend.send(payload['url'], payload['data'])
+
+
+def deliver_discord(payload):
+    from jatszohaz.discord import send_message
+
+    send_message(payload['content'])
@@ -0,0 +1,43 @@
+"""
+Rendering of the notifications sent to the members of the group.
+
+Every notification has a template for each channel it is sent on, named after the channel, e.g. `slack/new_rent.html`,
+`discord/new_rent.html` and `email/new_rent.html`. They are rendered from one shared context, each of them only once
+per notification, no matter how many recipients or message parts it is sent to.
+
+django_slack renders its template once for every parameter of the Slack API, so Slack gets the already rendered text
+through the tiny SLACK_MESSAGE_TEMPLATE.
+"""
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+CHANNEL_SLACK = 'slack'
+CHANNEL_DISCORD = 'discord'
+CHANNEL_EMAIL = 'email'
+
+# template passed to django_slack, its text is the `text` of the context
+SLACK_MESSAGE_TEMPLATE = 'slack/message.html'
+
+
+class MemberNotification:
+    """A notification of the group members, rendered from the templates called `name` of the channels."""
+
+    def __init__(self, name, context=None):
+        self.name = name
+        self.context = dict(context or {})
+        self.rendered = dict()
+
+    def get_template_name(self, channel):
+        return '%s/%s.html' % (channel, self.name)
+
+    def render(self, channel):
+        """Returns the text of the notification on the given channel, it's rendered only on the first call."""
+        if channel not in self.rendered:
+            # the output is already escaped, so it's not escaped again when used in another template
+            text = get_template(self.get_template_name(channel)).render(self.context)
+            self.rendered[channel] = mark_safe(text.strip())
+        return self.rendered[channel]
+
+    def get_slack_context(self):
+        """Returns the context of SLACK_MESSAGE_TEMPLATE."""
+        return {'text': self.render(CHANNEL_SLACK)}
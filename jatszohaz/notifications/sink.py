@@ -0,0 +1,141 @@
+"""
+Local stand-in servers accepting notifications, used for testing and benchmarking the delivery of notifications
+without sending real emails or messages.
+
+SinkSMTPServer speaks just enough SMTP for Django's SMTP backend, SinkHTTPServer accepts the webhook requests of
+Discord and Slack. Both count the received messages and can simulate a slow remote server.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socketserver
+import threading
+import time
+
+
+class SinkStats:
+    """Thread safe counter of the received messages."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.connections = 0
+
+    def add(self, messages=0, connections=0):
+        with self.lock:
+            self.messages += messages
+            self.connections += connections
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.stats.add(connections=1)
+        time.sleep(server.connect_delay)
+        self.reply('220 sink ESMTP')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+
+            if command.startswith('EHLO'):
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command.startswith(('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                time.sleep(server.message_delay)
+                server.stats.add(messages=1)
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SinkSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    SMTP server accepting and dropping every message.
+
+    :param connect_delay: seconds to wait before greeting a new connection, e.g. to simulate TLS handshake.
+    :param message_delay: seconds to wait before accepting a message.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, connect_delay=0, message_delay=0):
+        super().__init__(address, SMTPHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.stats = SinkStats()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(server.delay)
+
+        with server.stats.lock:
+            server.requests += 1
+            limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+
+        if limited:
+            # same as the rate limit response of Discord
+            self.send_json(429, {'message': 'You are being rate limited.', 'retry_after': server.retry_after})
+            return
+
+        server.stats.add(messages=1)
+        if 'slack' in self.path:
+            self.send_json(200, {'ok': True})
+        else:
+            self.send_response(204)
+            self.end_headers()
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SinkHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server accepting webhook POST requests.
+
+    Paths containing 'slack' get the JSON response of the Slack API, others the empty response of Discord.
+
+    :param delay: seconds to wait before responding.
+    :param rate_limit_every: respond with 429 to every nth request, 0 to disable.
+    :param retry_after: retry_after value of the 429 responses, in seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay=0, rate_limit_every=0, retry_after=0.1):
+        super().__init__(address, WebhookHandler)
+        self.delay = delay
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.stats = SinkStats()
+
+
+def start_in_thread(server):
+    """Runs the given server in a daemon thread and returns the (host, port) it listens on."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_address
@@ -0,0 +1,171 @@
+from datetime import timedelta
+import socket
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from jatszohaz.utils import jh_send_mail, send_message_to_members
+from . import rendering
+from .models import OutboxMessage
+from .outbox import CLAIM_TIMEOUT, claim_messages, enqueue, process_outbox
+from .sink import SinkHTTPServer, SinkSMTPServer, start_in_thread
+
+
+def get_closed_port():
+    """Returns a local port nothing listens on."""
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@override_settings(OUTBOX_WORKER_THREADS=0, OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_DELAY=60,
+                   EMAIL_BACKEND='notifications.backends.OutboxEmailBackend',
+                   OUTBOX_EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                   EMAIL_USE_TLS=False, EMAIL_USE_SSL=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                   DEFAULT_FROM_EMAIL='test@example.com')
+class OutboxTest(TestCase):
+    """Delivering the notifications of the outbox to the stand-in servers of notifications.sink."""
+
+    def setUp(self):
+        self.smtp = SinkSMTPServer(('localhost', 0))
+        self.http = SinkHTTPServer(('localhost', 0))
+        smtp_host, smtp_port = start_in_thread(self.smtp)
+        http_host, http_port = start_in_thread(self.http)
+        self.http_url = 'http://%s:%d/' % (http_host, http_port)
+
+        servers = override_settings(EMAIL_HOST=smtp_host, EMAIL_PORT=smtp_port,
+                                    DISCORD_WEBHOOK_URL=self.http_url + 'discord/')
+        servers.enable()
+        self.addCleanup(servers.disable)
+
+    def tearDown(self):
+        for server in (self.smtp, self.http):
+            server.shutdown()
+            server.server_close()
+
+    def enqueue_discord(self, content='Hi!'):
+        return enqueue(OutboxMessage.CHANNEL_DISCORD[0], {'content': content})
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt=timezone.now())
+
+    def test_claim(self):
+        now = timezone.now()
+        due = [self.enqueue_discord() for i in range(3)]
+        later = self.enqueue_discord()
+        later.next_attempt = now + timedelta(hours=1)
+        later.save()
+        sent = self.enqueue_discord()
+        sent.status = OutboxMessage.STATUS_SENT[0]
+        sent.save()
+
+        claimed = claim_messages(2)
+        self.assertEqual([m.pk for m in claimed], [m.pk for m in due[:2]])
+        for message in OutboxMessage.objects.filter(pk__in=[m.pk for m in claimed]):
+            self.assertGreaterEqual(message.next_attempt, now + CLAIM_TIMEOUT)
+
+        # claimed messages are not claimed again until the timeout
+        self.assertEqual([m.pk for m in claim_messages(10)], [due[2].pk])
+        self.assertEqual(claim_messages(10), [])
+
+    def test_deliver(self):
+        jh_send_mail("Test", "Hi!<br/>", ['member@example.com'])
+        self.enqueue_discord()
+        enqueue(OutboxMessage.CHANNEL_SLACK[0], {'url': self.http_url + 'slack/', 'data': {'text': 'Hi!'}})
+
+        run = process_outbox()
+
+        self.assertEqual((run.sent, run.failed), (3, 0))
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.STATUS_SENT[0]).count(), 3)
+        self.assertEqual(self.smtp.stats.messages, 1)
+        self.assertEqual(self.http.stats.messages, 2)
+        self.assertEqual(process_outbox().sent, 0)
+
+    def test_retry_with_backoff(self):
+        message = self.enqueue_discord()
+
+        with override_settings(DISCORD_WEBHOOK_URL='http://localhost:%d/' % get_closed_port()):
+            for attempt, delay in ((1, 60), (2, 120)):
+                started = timezone.now()
+                run = process_outbox()
+                message.refresh_from_db()
+
+                self.assertEqual((run.sent, run.failed), (0, 1))
+                self.assertEqual(message.status, OutboxMessage.STATUS_PENDING[0])
+                self.assertEqual(message.attempts, attempt)
+                self.assertIn('ConnectionError', message.last_error)
+                self.assertGreaterEqual(message.next_attempt, started + timedelta(seconds=delay))
+                self.assertLess(message.next_attempt, started + timedelta(seconds=delay + 10))
+
+                # not retried before the delay
+                self.assertEqual(process_outbox().failed, 0)
+                self.make_due()
+
+        run = process_outbox()
+        message.refresh_from_db()
+        self.assertEqual(run.sent, 1)
+        self.assertEqual(message.status, OutboxMessage.STATUS_SENT[0])
+        self.assertEqual(message.last_error, '')
+        self.assertEqual(self.http.stats.messages, 1)
+
+    def test_give_up(self):
+        with override_settings(EMAIL_PORT=get_closed_port()):
+            jh_send_mail("Test", "Hi!<br/>", ['member@example.com'])
+            message = OutboxMessage.objects.get()
+
+            for i in range(3):
+                self.assertEqual(process_outbox().failed, 1)
+                self.make_due()
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_FAILED[0])
+        self.assertEqual(message.attempts, 3)
+
+        # failed messages are not retried
+        self.assertEqual(process_outbox().failed, 0)
+        self.assertEqual(self.smtp.stats.messages, 0)
+
+
+@override_settings(OUTBOX_WORKER_THREADS=0, EMAIL_BACKEND='notifications.backends.OutboxEmailBackend',
+                   SLACK_TOKEN='token', SLACK_CHANNEL='#members')
+class MemberNotificationTest(TestCase):
+    """Member notifications are rendered once for every channel and recipient."""
+
+    context = {
+        'url': 'https://example.com/rent/1/',
+        'renter': 'Teszt Elek',
+        'date_from': '2020-01-01',
+        'date_to': '2020-01-03',
+        'games': 'Bang, Dixit',
+        'comment': '<b>Thanks!</b>',
+    }
+
+    def get_payloads(self, channel):
+        return [m.get_payload() for m in OutboxMessage.objects.filter(channel=channel).order_by('pk')]
+
+    def test_new_rent(self):
+        with mock.patch.object(rendering, 'get_template', wraps=rendering.get_template) as get_template:
+            send_message_to_members('new_rent', self.context, email_subject="New rent",
+                                    email_recipients=['list@example.com', 'admin@example.com'])
+
+        self.assertEqual(sorted(call[0][0] for call in get_template.call_args_list),
+                         ['discord/new_rent.html', 'email/new_rent.html', 'slack/new_rent.html'])
+
+        slack, = self.get_payloads(OutboxMessage.CHANNEL_SLACK[0])
+        discord, = self.get_payloads(OutboxMessage.CHANNEL_DISCORD[0])
+        email, = self.get_payloads(OutboxMessage.CHANNEL_EMAIL[0])
+        for text in (slack['data']['text'], discord['content'], email['alternatives'][0][0]):
+            self.assertIn('Teszt Elek', text)
+            self.assertIn('https://example.com/rent/1/', text)
+            self.assertIn('&lt;b&gt;Thanks!&lt;/b&gt;', text)
+        self.assertEqual(slack['data']['channel'], '#members')
+        self.assertEqual(email['subject'], "New rent")
+        self.assertEqual(email['to'], ['list@example.com', 'admin@example.com'])
+
+    def test_without_email(self):
+        send_message_to_members('pending_rents', {'rents': ['https://example.com/rent/1/']})
+
+        self.assertEqual(OutboxMessage.objects.filter(channel=OutboxMessage.CHANNEL_EMAIL[0]).count(), 0)
+        discord, = self.get_payloads(OutboxMessage.CHANNEL_DISCORD[0])
+        self.assertIn('https://example.com/rent/1/', discord['content'])
@@ -0,0 +1,201 @@
+"""
+Set based availability checks for GamePiece objects.
+
+Instead of checking the pieces one by one, the state of every piece is computed for a date window
+with a fixed number of queries, no matter how big the catalogue is.
+"""
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count, Q
+
+from inventory.models import GameGroup, GamePiece
+from jatszohaz.utils import get_cache_version
+from stats.models import GameStat, mark_stale
+from .models import AVAILABILITY_CACHE_VERSION, AVAILABILITY_CALENDAR_CACHE_TIMEOUT, Rent, RentOccupancy
+
+# reasons why a GamePiece cannot be rented
+REASON_NOT_RENTABLE = 'not_rentable'
+REASON_NOT_PLAYABLE = 'not_playable'
+REASON_RENTED = 'rented'
+
+
+def get_blocked_pieces(date_from, date_to, ignored_rent_pk=None, pieces=None):
+    """
+    Returns a dict mapping the pk of every GamePiece which can not be rented during the given period to the reason.
+
+    GamePiece objects missing from the result are free. Two queries are made: one for the pieces which are not
+    rentable or not playable according to their latest inventory and one for the pieces of overlapping rents.
+
+    :param ignored_rent_pk: rent which should not be considered, e.g. when the dates of the rent itself are edited.
+    :param pieces: optional iterable of GamePiece pks to restrict the check to.
+    """
+
+    blocked = get_unusable_pieces(pieces)
+
+    for pk in get_rented_pieces(date_from, date_to, ignored_rent_pk, pieces):
+        blocked.setdefault(pk, REASON_RENTED)
+
+    return blocked
+
+
+def get_unusable_pieces(pieces=None):
+    """
+    Returns a dict mapping the pk of every GamePiece which can not be rented at all to the reason, i.e. pieces which
+    are not rentable or not playable according to their latest inventory.
+
+    :param pieces: optional iterable of GamePiece pks to restrict the check to.
+    """
+
+    unusable = GamePiece.objects.filter(Q(rentable=False) | Q(playable=False))
+    if pieces is not None:
+        unusable = unusable.filter(pk__in=pieces)
+
+    return {pk: REASON_NOT_PLAYABLE if rentable else REASON_NOT_RENTABLE
+            for pk, rentable in unusable.values_list('pk', 'rentable')}
+
+
+def get_rented_pieces(date_from, date_to, ignored_rent_pk=None, pieces=None):
+    """Returns a set of GamePiece pks which are held by a rent overlapping the given period."""
+
+    # RentOccupancy periods already contain the RENT_RETURN_DELAY_DAYS
+    rented = filter_overlapping(RentOccupancy.objects.filter(active=True), date_from, date_to)
+    if ignored_rent_pk is not None:
+        rented = rented.exclude(rent_id=ignored_rent_pk)
+    if pieces is not None:
+        rented = rented.filter(game_piece_id__in=pieces)
+
+    return set(rented.values_list('game_piece_id', flat=True))
+
+
+def filter_overlapping(occupancies, date_from, date_to):
+    """Filters the given RentOccupancy queryset for periods overlapping the given period (both ends included)."""
+
+    if connections[occupancies.db].vendor == 'postgresql':
+        # same expression as the GiST index of active periods, so the index can be used
+        return occupancies.extra(
+            where=["tsrange(rent_rentoccupancy.date_from, rent_rentoccupancy.date_to, '[]') && "
+                   "tsrange(%s::timestamp, %s::timestamp, '[]')"],
+            params=[date_from, date_to]
+        )
+
+    return occupancies.filter(date_from__lte=date_to, date_to__gte=date_from)
+
+
+def get_available_game_groups(date_from, date_to):
+    """
+    Returns a queryset of GameGroup objects having at least one free GamePiece during the given period.
+
+    Every object is annotated with the number of its free pieces as `free_pieces`.
+    """
+
+    blocked = get_blocked_pieces(date_from, date_to)
+    free_filter = ~Q(game_pieces__pk__in=blocked.keys()) if blocked else Q()
+
+    return GameGroup.objects\
+        .annotate(free_pieces=Count('game_pieces', filter=free_filter))\
+        .filter(free_pieces__gt=0)
+
+
+def allocate_pieces(rent, game_groups, date_from, date_to):
+    """
+    Adds a free GamePiece of each given GameGroup to the rent and returns the list of added pieces.
+
+    If multiple pieces of a group are free, the one with the lowest priority is chosen. Must be called while holding
+    the locks of the pieces of the given groups, see rent.reservation.
+
+    :param game_groups: iterable of GameGroup pks.
+    :raises GameGroup.DoesNotExist if any of the groups has no free piece. Nothing is added in this case.
+    """
+    game_group_pks = set(int(pk) for pk in game_groups)
+
+    pieces = GamePiece.objects\
+        .select_related('game_group')\
+        .filter(game_group__in=game_group_pks)\
+        .order_by('game_group_id', 'priority', 'pk')
+    pieces = list(pieces)
+    blocked = get_blocked_pieces(date_from, date_to, pieces=[p.pk for p in pieces])
+
+    allocated = dict()
+    for piece in pieces:
+        if piece.pk not in blocked:
+            allocated.setdefault(piece.game_group_id, piece)
+
+    if game_group_pks - allocated.keys():
+        raise GameGroup.DoesNotExist("No free piece available!")
+
+    with transaction.atomic():
+        Rent.games.through.objects.bulk_create([
+            Rent.games.through(rent=rent, gamepiece=piece) for piece in allocated.values()
+        ])
+        RentOccupancy.sync_rent(rent)
+        # signals are not sent by the bulk operations
+        mark_stale(GameStat, [rent.date_from])
+
+    return list(allocated.values())
+
+
+def get_month_calendar(year, month):
+    """
+    Returns a dict mapping the pk of every GamePiece to a day bitmap of the given month.
+
+    The bitmap is a bytes object with one byte per day of the month, which is 1 if the piece can be rented on that
+    day. The calendar is built from a single pass over the rents of the month and it is cached until a rent or a game
+    piece changes, at most for AVAILABILITY_CALENDAR_CACHE_TIMEOUT seconds.
+    """
+
+    key = 'availability-calendar:%d:%04d-%02d' % (get_cache_version(AVAILABILITY_CACHE_VERSION), year, month)
+    calendar = cache.get(key)
+    if calendar is not None:
+        return calendar
+
+    first_day = date(year, month, 1)
+    days = ((first_day + timedelta(days=31)).replace(day=1) - first_day).days
+
+    unusable = get_unusable_pieces()
+    bitmaps = {pk: bytearray(days) if pk in unusable else bytearray(b'\x01' * days)
+               for pk in GamePiece.objects.values_list('pk', flat=True)}
+
+    occupancies = filter_overlapping(
+        RentOccupancy.objects.filter(active=True),
+        datetime.combine(first_day, datetime.min.time()),
+        datetime.combine(first_day + timedelta(days=days - 1), datetime.max.time())
+    )
+    for pk, date_from, date_to in occupancies.values_list('game_piece_id', 'date_from', 'date_to'):
+        start = max((date_from.date() - first_day).days, 0)
+        end = min((date_to.date() - first_day).days, days - 1)
+        bitmaps[pk][start:end + 1] = bytes(end - start + 1)
+
+    calendar = {pk: bytes(bitmap) for pk, bitmap in bitmaps.items()}
+    cache.set(key, calendar, AVAILABILITY_CALENDAR_CACHE_TIMEOUT)
+    return calendar
+
+
+def get_free_days(first_month, last_month, game_groups=None):
+    """
+    Returns a dict mapping GameGroup pks to the list of days when at least one of their pieces can be rented.
+
+    :param first_month: date of the first month to check. Day of the date is ignored.
+    :param last_month: date of the last month to check. Day of the date is ignored.
+    :param game_groups: optional iterable of GameGroup pks to restrict the result to.
+    """
+
+    pieces = GamePiece.objects.all()
+    if game_groups is not None:
+        pieces = pieces.filter(game_group__in=game_groups)
+    group_pieces = dict()
+    for pk, game_group in pieces.values_list('pk', 'game_group_id'):
+        group_pieces.setdefault(game_group, []).append(pk)
+
+    free_days = {game_group: [] for game_group in group_pieces.keys()}
+    month = first_month.replace(day=1)
+    while month <= last_month:
+        calendar = get_month_calendar(month.year, month.month)
+        for game_group, piece_pks in group_pieces.items():
+            # a group is free on a day if any of its pieces is free
+            group_bitmap = bytes(max(bits) for bits in zip(*(calendar[pk] for pk in piece_pks if pk in calendar)))
+            free_days[game_group].extend(month + timedelta(days=i) for i, free in enumerate(group_bitmap) if free)
+        month = (month + timedelta(days=31)).replace(day=1)
+
+    return free_days
@@ -2,6 +2,7 @@ from datetime import datetime
 from django import forms
 from django.utils.translation import ugettext_lazy as _
 from inventory.models import GameGroup, GamePiece
+from .availability import get_available_game_groups, get_blocked_pieces
 from .models import Rent
 from .widgets import GameSelectMultiple
 
@@ -42,15 +43,22 @@ class RentFormStep2(forms.Form):
         label="",
         error_messages={'invalid_choice': _('Some selected games are not available due to concurrent user rent.')})
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, available_game_pks=None, **kwargs):
+        """
+        :param available_game_pks: pks of the GameGroup objects already known to be available in the given period.
+            If not given, availability is computed.
+        """
         super().__init__(*args, **kwargs)
-        date_from = kwargs['initial']['date_from']
-        # HACK: need to revise rent dates!
-        date_to = datetime.combine(kwargs['initial']['date_to'], datetime.max.time())
 
-        available_games = [(g.pk, g) for g
-                           in GameGroup.objects.all().order_by('name') if g.has_free_piece(date_from, date_to)]
-        self.fields['game_groups'].choices = available_games
+        if available_game_pks is None:
+            date_from = kwargs['initial']['date_from']
+            # HACK: need to revise rent dates!
+            date_to = datetime.combine(kwargs['initial']['date_to'], datetime.max.time())
+            games = get_available_game_groups(date_from, date_to)
+        else:
+            games = GameGroup.objects.filter(pk__in=available_game_pks)
+
+        self.fields['game_groups'].choices = [(g.pk, g) for g in games.order_by('name')]
 
 
 class RentFormStep3(forms.Form):
@@ -102,9 +110,10 @@ class EditRentForm(forms.ModelForm):
         # check game availability in new dates
         not_available_games = []
         if 'date_from' in cleaned_data and 'date_to' in cleaned_data:
-            for game in self.instance.games.all():
-                if not game.is_free(cleaned_data['date_from'], cleaned_data['date_to'], self.instance.pk):
-                    not_available_games.append(str(game))
+            games = list(self.instance.games.all())
+            blocked = get_blocked_pieces(cleaned_data['date_from'], cleaned_data['date_to'], self.instance.pk,
+                                         pieces=[g.pk for g in games])
+            not_available_games = [str(g) for g in games if g.pk in blocked]
         if not_available_games:
             self.add_error('date_from', _("Failed to change date. Not available: %s" % ', '.join(not_available_games)))
 
@@ -118,5 +127,6 @@ class AddGameForm(forms.Form):
         date_from = kwargs.pop("date_from")
         date_to = kwargs.pop("date_to")
         super().__init__(*args, **kwargs)
-        available_games = [(g.pk, g) for g in GamePiece.objects.all() if g.is_free(date_from, date_to)]
+        blocked = get_blocked_pieces(date_from, date_to)
+        available_games = [(g.pk, g) for g in GamePiece.objects.select_related('game_group') if g.pk not in blocked]
         self.fields['game'].choices = available_games
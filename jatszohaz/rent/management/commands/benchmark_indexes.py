@@ -0,0 +1,183 @@
+import random
+from datetime import datetime, timedelta
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from inventory.models import GameGroup, GamePiece, InventoryItem
+from jatszohaz.models import JhUser
+from rent.models import Rent, RentHistory
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seeds a large synthetic dataset and shows the query plans and timings of the hot rent, rent history " \
+           "and inventory queries with and without their composite indexes. " \
+           "Everything is done in one transaction, which is rolled back at the end. " \
+           "Dropping the indexes locks the rent and inventory tables until then, so it should not be run " \
+           "on a live database."
+
+    # (model, index names) of the benchmarked indexes, they are dropped temporarily for the second round
+    indexes = (
+        (Rent, ('rent_status_created', 'rent_status_date_from', 'rent_status_date_to')),
+        (RentHistory, ('rent_history_rent_created', 'rent_history_user_rent')),
+        (InventoryItem, ('inventory_item_game_created', )),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rents', type=int, default=50000, help='Number of rents to create.')
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create.')
+        parser.add_argument('--pieces', type=int, default=500, help='Number of game pieces to create.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times each query is run.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random data.')
+        parser.add_argument('--force', action='store_true', help='Run even if DEBUG is not set.')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            raise CommandError("The database can not roll back dropping the indexes.")
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("DEBUG is not set, this might be a live database. Use --force to run anyway.")
+
+        # DROP INDEX takes an ACCESS EXCLUSIVE lock on PostgreSQL, which is held until the rollback
+        self.stdout.write(self.style.WARNING(
+            "The rent, rent history and inventory tables are locked until the benchmark finishes, "
+            "every request using them is blocked meanwhile!"))
+
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                started = perf_counter()
+                self.seed(options['rents'], options['users'], options['pieces'])
+                self.stdout.write("Seeded in %.1f s." % (perf_counter() - started))
+
+                queries = self.get_queries()
+                with_indexes = self.measure(queries, options['repeat'], 'indexed')
+                self.drop_indexes()
+                without_indexes = self.measure(queries, options['repeat'], 'not indexed')
+                raise Rollback()
+        except Rollback:
+            pass
+
+        header = "%-40s %12s %12s" % ("Median of %d runs" % options['repeat'], "Indexed", "Not indexed")
+        self.stdout.write(self.style.SUCCESS(header))
+        for name in queries:
+            self.stdout.write("%-40s %9.2f ms %9.2f ms" % (name, with_indexes[name], without_indexes[name]))
+
+    def seed(self, rent_count, user_count, piece_count):
+        now = datetime.now()
+        prefix = 'benchmark-%s-' % now.strftime('%Y%m%d%H%M%S')
+
+        JhUser.objects.bulk_create([JhUser(username='%s%d' % (prefix, i)) for i in range(user_count)])
+        users = list(JhUser.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+
+        GameGroup.objects.bulk_create([GameGroup(name='%s%d' % (prefix, i)) for i in range(piece_count // 2 or 1)])
+        groups = list(GameGroup.objects.filter(name__startswith=prefix).values_list('pk', flat=True))
+        GamePiece.objects.bulk_create([GamePiece(game_group_id=self.random.choice(groups)) for i in range(piece_count)])
+        pieces = list(GamePiece.objects.filter(game_group__in=groups).values_list('pk', flat=True))
+
+        # a few inspections of every piece in the last years
+        InventoryItem.objects.bulk_create([
+            InventoryItem(user_id=self.random.choice(users), game_id=piece, playable=self.random.random() < 0.9,
+                          created=now - timedelta(days=self.random.randint(0, 5 * 365)))
+            for piece in pieces for i in range(5)
+        ], batch_size=500)
+
+        # mostly closed rents spread over the last five years
+        statuses = [s for s, name in Rent.STATUS_CHOICES]
+        weights = [20 if s == Rent.STATUS_BACK[0] else 1 for s in statuses]
+        rents = list()
+        for i in range(rent_count):
+            created = now - timedelta(minutes=self.random.randint(0, 5 * 365 * 24 * 60))
+            date_from = created + timedelta(days=self.random.randint(0, 30))
+            rents.append(Rent(renter_id=self.random.choice(users), created=created, date_from=date_from,
+                              date_to=date_from + timedelta(days=self.random.randint(1, 7)),
+                              status=self.random.choices(statuses, weights)[0]))
+        Rent.objects.bulk_create(rents, batch_size=500)
+        rents = list(Rent.objects.filter(renter__in=users).values_list('pk', 'created', 'status'))
+
+        Rent.games.through.objects.bulk_create([
+            Rent.games.through(rent_id=pk, gamepiece_id=self.random.choice(pieces)) for pk, created, status in rents
+        ], batch_size=500)
+
+        # created by the renter, then handled by some members
+        histories = list()
+        for pk, created, status in rents:
+            histories.append(RentHistory(rent_id=pk, user_id=self.random.choice(users), created=created,
+                                         new_status=Rent.STATUS_PENDING[0]))
+            for i in range(self.random.randint(0, 3)):
+                histories.append(RentHistory(rent_id=pk, user_id=self.random.choice(users[:50]), new_status=status,
+                                             created=created + timedelta(hours=self.random.randint(1, 24 * 30))))
+        RentHistory.objects.bulk_create(histories, batch_size=500)
+
+        self.samples = {
+            'rent': self.random.choice(rents)[0],
+            'member': users[0],
+            'piece': self.random.choice(pieces),
+        }
+        self.stdout.write("%d users, %d game pieces, %d rents and %d histories created." % (
+            len(users), len(pieces), len(rents), len(histories)))
+
+        # let the query planner know about the new data
+        with connection.cursor() as cursor:
+            for model, names in self.indexes:
+                cursor.execute('ANALYZE %s' % connection.ops.quote_name(model._meta.db_table))
+
+    def get_queries(self):
+        day = datetime.now() - timedelta(days=1)
+        open_statuses = (Rent.STATUS_PENDING[0], Rent.STATUS_APPROVED[0], Rent.STATUS_GAVE_OUT[0])
+
+        return {
+            "Cron: pending since a day": Rent.objects
+            .filter(status=Rent.STATUS_PENDING[0], created__gt=day - timedelta(days=1), created__lte=day)
+            .values_list('pk', flat=True),
+            "Cron: not returned since a day": Rent.objects
+            .filter(status__in=open_statuses, date_to__gt=day - timedelta(days=1), date_to__lte=day)
+            .values_list('pk', flat=True),
+            "Stats: rents of a month by status": Rent.objects
+            .filter(status=Rent.STATUS_BACK[0], date_from__gte=day - timedelta(days=30), date_from__lte=day)
+            .values_list('pk', flat=True),
+            "Last history of a rent": RentHistory.objects
+            .filter(rent=self.samples['rent']).order_by('-created', '-pk')[:1],
+            "Rents handled by a member": RentHistory.objects
+            .filter(user=self.samples['member']).values('rent').distinct(),
+            "Latest inventory of a game piece": InventoryItem.objects
+            .filter(game=self.samples['piece']).order_by('-created')[:1],
+        }
+
+    def measure(self, queries, repeat, label):
+        """Prints the query plans and returns the median durations in milliseconds."""
+        results = dict()
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING("%s (%s)" % (name, label)))
+            self.stdout.write(self.explain(queryset, label))
+
+            durations = list()
+            for i in range(repeat):
+                started = perf_counter()
+                list(queryset.all())
+                durations.append((perf_counter() - started) * 1000)
+            results[name] = median(durations)
+        return results
+
+    def explain(self, queryset, label):
+        # the label makes the SQL unique, so SQLite does not reuse the plan prepared before dropping the indexes
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('%s %s /* %s */' % (connection.ops.explain_query_prefix(), sql, label), params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def drop_indexes(self):
+        self.stdout.write(self.style.WARNING("Dropping the indexes..."))
+        # not used as a context manager, which is not allowed inside a transaction on SQLite
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model, names in self.indexes:
+                for index in model._meta.indexes:
+                    if index.name in names:
+                        cursor.execute(str(index.remove_sql(model, schema_editor)))
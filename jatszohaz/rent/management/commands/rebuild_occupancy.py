@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from jatszohaz.utils import bump_cache_version
+from rent.models import AVAILABILITY_CACHE_VERSION, Rent, RentOccupancy
+
+
+class Command(BaseCommand):
+    help = "Recreates RentOccupancy objects for all rents. " \
+           "Must be run after changing RENT_RETURN_DELAY_DAYS."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            RentOccupancy.objects.all().delete()
+
+            occupancies = []
+            for rent_game in Rent.games.through.objects.select_related('rent').iterator(chunk_size=500):
+                values = RentOccupancy.get_period_values(rent_game.rent)
+                occupancies.append(RentOccupancy(rent=rent_game.rent, game_piece_id=rent_game.gamepiece_id, **values))
+            RentOccupancy.objects.bulk_create(occupancies, batch_size=500)
+        bump_cache_version(AVAILABILITY_CACHE_VERSION)
+
+        self.stdout.write(self.style.SUCCESS("%d occupancies created." % len(occupancies)))
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from inventory.models import GameGroup
+from jatszohaz.models import JhUser
+from rent.models import Rent
+from rent.reservation import count_double_booked, reserve_new_rent
+
+
+class Command(BaseCommand):
+    help = "Creates rents for the same games from parallel threads, " \
+           "checks that no game piece was double-booked and reports the throughput. " \
+           "Created rents are deleted at the end, unless --keep is given."
+
+    username = 'stress-test'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Number of parallel threads.')
+        parser.add_argument('--rents', type=int, default=100, help='Number of rents to try to create.')
+        parser.add_argument('--groups', type=int, default=3, help='Number of game groups rented at once.')
+        parser.add_argument('--keep', action='store_true', help='Do not delete the created rents.')
+        parser.add_argument('--force', action='store_true', help='Run even if DEBUG is not set.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("DEBUG is not set, this might be a live database. Use --force to run anyway.")
+
+        game_groups = list(GameGroup.objects.filter(game_pieces__isnull=False).distinct()
+                           .values_list('pk', flat=True)[:options['groups']])
+        if not game_groups:
+            raise CommandError("There are no games to rent.")
+
+        renter, created = JhUser.objects.get_or_create(username=self.username)
+
+        # use a period far in the future, so real rents are not affected
+        start = datetime.combine(datetime.now().date() + timedelta(days=3650), datetime.min.time())
+
+        def create_rent(i):
+            # overlapping periods, shifted by one day for every second rent
+            date_from = start + timedelta(days=i // 2)
+            try:
+                reserve_new_rent(renter, date_from, date_from + timedelta(days=2), Rent.STATUS_PENDING[0], game_groups)
+                return True
+            except GameGroup.DoesNotExist:
+                return False
+            finally:
+                connection.close()
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(create_rent, range(options['rents'])))
+        elapsed = perf_counter() - started
+
+        successful = results.count(True)
+        self.stdout.write("%d rents created, %d rejected in %.2f s (%.1f attempts/s)." % (
+            successful, len(results) - successful, elapsed, len(results) / elapsed))
+
+        double_booked = count_double_booked(Rent.objects.filter(renter=renter))
+
+        if not options['keep']:
+            Rent.objects.filter(renter=renter).delete()
+            if created:
+                renter.delete()
+
+        if double_booked:
+            raise CommandError("%d rented games overlap with another rent of the same game piece!" % double_booked)
+        self.stdout.write(self.style.SUCCESS("No game piece was double-booked."))
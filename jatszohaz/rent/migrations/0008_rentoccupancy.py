@@ -0,0 +1,75 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:37
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+INACTIVE_STATUSES = ('cancelled', 'declined', 'back')
+
+
+def populate_occupancies(apps, schema_editor):
+    Rent = apps.get_model('rent', 'Rent')
+    RentOccupancy = apps.get_model('rent', 'RentOccupancy')
+    delay_days = timedelta(days=settings.RENT_RETURN_DELAY_DAYS)
+
+    occupancies = []
+    for rent_game in Rent.games.through.objects.select_related('rent').iterator(chunk_size=500):
+        rent = rent_game.rent
+        occupancies.append(RentOccupancy(
+            rent=rent,
+            game_piece_id=rent_game.gamepiece_id,
+            date_from=rent.date_from - delay_days,
+            date_to=max(rent.date_from, rent.date_to) + delay_days,
+            active=rent.status not in INACTIVE_STATUSES,
+        ))
+    RentOccupancy.objects.bulk_create(occupancies, batch_size=500)
+
+
+def create_gist_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX rent_occupancy_active_period ON rent_rentoccupancy "
+        "USING gist (tsrange(date_from, date_to, '[]')) WHERE active"
+    )
+
+
+def drop_gist_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS rent_occupancy_active_period")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_auto_20211117_2033'),
+        ('rent', '0007_auto_20180528_1610'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateTimeField()),
+                ('date_to', models.DateTimeField()),
+                ('active', models.BooleanField(default=True, help_text='False if the rent does not hold the game anymore.')),
+                ('game_piece', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancies', to='inventory.GamePiece')),
+                ('rent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancies', to='rent.Rent')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rentoccupancy',
+            index=models.Index(fields=['game_piece', 'date_from', 'date_to'], name='rent_occupancy_piece_period'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rentoccupancy',
+            unique_together={('rent', 'game_piece')},
+        ),
+        migrations.RunPython(create_gist_index, drop_gist_index),
+        migrations.RunPython(populate_occupancies, migrations.RunPython.noop),
+    ]
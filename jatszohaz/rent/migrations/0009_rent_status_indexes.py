@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rent', '0008_rentoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rent',
+            index=models.Index(fields=['status', 'created'], name='rent_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='rent',
+            index=models.Index(fields=['status', 'date_from'], name='rent_status_date_from'),
+        ),
+        migrations.AddIndex(
+            model_name='rent',
+            index=models.Index(fields=['status', 'date_to'], name='rent_status_date_to'),
+        ),
+    ]
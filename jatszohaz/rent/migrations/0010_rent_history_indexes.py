@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rent', '0009_rent_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='renthistory',
+            index=models.Index(fields=['rent', 'created'], name='rent_history_rent_created'),
+        ),
+        migrations.AddIndex(
+            model_name='renthistory',
+            index=models.Index(fields=['user', 'rent'], name='rent_history_user_rent'),
+        ),
+    ]
@@ -2,19 +2,35 @@ from datetime import datetime, timedelta
 import logging
 from urllib.parse import urljoin
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.urls import reverse_lazy
 from django.utils.translation import ugettext_lazy as _
 
 from model_utils.models import TimeStampedModel
-from inventory.models import GamePiece
+from inventory.models import GamePiece, InventoryItem
 from jatszohaz.models import JhUser
-from jatszohaz.utils import jh_send_mail
+from jatszohaz.utils import bump_cache_version, get_cache_version, jh_create_mail, jh_send_mails
 
 
 logger = logging.getLogger(__name__)
 
+# cache version of everything derived from the availability of game pieces, and timeout (seconds) of the month
+# calendars, see rent.availability.get_month_calendar
+AVAILABILITY_CACHE_VERSION = 'availability'
+AVAILABILITY_CALENDAR_CACHE_TIMEOUT = 24 * 60 * 60
+
+# cache version and timeout (seconds) of Rent.get_list_counts
+RENT_COUNTS_CACHE_VERSION = 'rent-list-counts'
+RENT_COUNTS_CACHE_TIMEOUT = 60
+
+# cache version (bumped when users change) and timeout (seconds) of Rent.get_recipients
+RENT_RECIPIENTS_CACHE_VERSION = 'rent-recipients'
+RENT_RECIPIENTS_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 class Rent(TimeStampedModel):
     """
@@ -48,6 +64,12 @@ class Rent(TimeStampedModel):
         STATUS_DECLINED,
         STATUS_CANCELLED
     )
+    # rents in these statuses do not hold their games anymore
+    INACTIVE_STATUSES = (
+        STATUS_CANCELLED[0],
+        STATUS_DECLINED[0],
+        STATUS_BACK[0]
+    )
 
     renter = models.ForeignKey(JhUser, on_delete=models.PROTECT, verbose_name=_("Renter"), related_name="rents")
     games = models.ManyToManyField(GamePiece, verbose_name=_("Games"), related_name="rents")
@@ -65,6 +87,12 @@ class Rent(TimeStampedModel):
             ('manage_rents', _('Manage rents')),
             ('view_stat', _('View rent statistics')),
         )
+        # rents in some statuses during a period, e.g. overdue rents of the cron job and the stats
+        indexes = [
+            models.Index(fields=['status', 'created'], name='rent_status_created'),
+            models.Index(fields=['status', 'date_from'], name='rent_status_date_from'),
+            models.Index(fields=['status', 'date_to'], name='rent_status_date_to'),
+        ]
 
     def get_absolute_url(self):
         return reverse_lazy("rent:details", kwargs={'pk': self.pk})
@@ -84,7 +112,10 @@ class Rent(TimeStampedModel):
                                    edited_date_to=edited_date_to)
 
     def get_last_history(self):
-        return self.histories.last()
+        # use the history prefetched by Rent.prefetch_list_data if available
+        if hasattr(self, 'prefetched_last_history'):
+            return self.prefetched_last_history[0] if self.prefetched_last_history else None
+        return self.histories.order_by('created', 'pk').last()
 
     def is_past_due(self):
         """Returns True if the rent is in an invalid state, e.g. it should have already been returned but it was not."""
@@ -92,36 +123,107 @@ class Rent(TimeStampedModel):
                 or (self.date_from < datetime.now() and
                     self.status in (Rent.STATUS_PENDING[0], Rent.STATUS_APPROVED[0])))
 
-    def notify_users(self, subject, message, user_exclude):
+    def get_notification(self, subject, message, user_exclude):
         """
-        Send an email notification for all the users connected to this object.
+        Returns an email notification for all the users connected to this object, or None if there's nobody to notify.
 
         All users are considered to be connected who made a comment or made any change to this object.
         """
-        recipient_list = set([c.user.email for c in self.comments.all()] +
-                             [self.renter.email, ] +
-                             [h.user.email for h in self.histories.all()])
+        recipient_list = self.get_notification_recipients()
         recipient_list.discard(user_exclude.email)
 
-        if recipient_list:
-            url = urljoin(settings.SITE_DOMAIN, str(self.get_absolute_url()))
-            subject = settings.EMAIL_SUBJECT_PREFIX + str(subject)
-            message += _("You can check your rent here: <a href=\"%s\">%s<a><br/>"
-                         "Please do not reply to this email.<br/><br/>"
-                         "Best wishes,<br/>Játszóház") % (url, url)
+        if not recipient_list:
+            return None
+
+        url = urljoin(settings.SITE_DOMAIN, str(self.get_absolute_url()))
+        subject = settings.EMAIL_SUBJECT_PREFIX + str(subject)
+        message += _("You can check your rent here: <a href=\"%s\">%s<a><br/>"
+                     "Please do not reply to this email.<br/><br/>"
+                     "Best wishes,<br/>Játszóház") % (url, url)
+        return jh_create_mail(subject, message, list(recipient_list))
+
+    def get_notification_recipients(self):
+        """Returns the set of email addresses of the users connected to this object, see get_notification."""
+        # use the recipients loaded by Rent.get_recipients for multiple rents if available
+        if hasattr(self, 'prefetched_recipients'):
+            return set(self.prefetched_recipients)
+        return Rent.get_recipients([self.pk])[self.pk]
+
+    @staticmethod
+    def get_recipients(rent_pks, use_cache=True):
+        """
+        Returns a dict mapping the given Rent pks to the set of email addresses of the renter, the commenters and the
+        users who modified the rent.
+
+        Results are cached per rent until a comment or history is added, or the renter changes. Missing ones are
+        queried together with one UNION query.
+
+        :param use_cache: False to skip the cache, e.g. when the recipients of many rents are needed only once.
+        """
+        version = get_cache_version(RENT_RECIPIENTS_CACHE_VERSION) if use_cache else 0
+        keys = {'rent-recipients:%d:%d' % (version, pk): pk for pk in set(int(pk) for pk in rent_pks)}
+        recipients = dict()
+        if use_cache:
+            recipients = {keys[key]: emails for key, emails in cache.get_many(keys.keys()).items()}
+
+        missing = [pk for pk in keys.values() if pk not in recipients]
+        if missing:
+            emails = Rent.objects.filter(pk__in=missing).values_list('pk', 'renter__email').union(
+                Comment.objects.filter(rent__in=missing).values_list('rent_id', 'user__email'),
+                RentHistory.objects.filter(rent__in=missing).values_list('rent_id', 'user__email'),
+            )
+            for pk in missing:
+                recipients[pk] = set()
+            for pk, email in emails:
+                if email:
+                    recipients[pk].add(email)
+
+            if use_cache:
+                cache.set_many({key: recipients[pk] for key, pk in keys.items() if pk in missing},
+                               RENT_RECIPIENTS_CACHE_TIMEOUT)
+
+        # copies, so the callers can modify them
+        return {pk: set(emails) for pk, emails in recipients.items()}
+
+    @staticmethod
+    def invalidate_recipients(rent_pks, new_email=None):
+        """
+        Removes the cached recipients of the given Rent pks, see get_recipients.
+
+        :param new_email: email address of a user who has just commented or modified the rents. Cached recipients
+                          already containing it are still valid, so they are kept.
+        """
+        version = get_cache_version(RENT_RECIPIENTS_CACHE_VERSION)
+        keys = ['rent-recipients:%d:%d' % (version, pk) for pk in rent_pks]
+        if new_email is not None:
+            keys = [key for key, emails in cache.get_many(keys).items() if new_email and new_email not in emails]
+        cache.delete_many(keys)
+
+    def notify_users(self, subject, message, user_exclude):
+        """Send an email notification for all the users connected to this object, see get_notification."""
+        return Rent.send_notifications([self.get_notification(subject, message, user_exclude)])
+
+    @staticmethod
+    def send_notifications(notifications):
+        """Sends the given notifications in one batch, skipping None values. Returns False on failure."""
+        notifications = [n for n in notifications if n is not None]
+        if notifications:
             try:
-                jh_send_mail(subject, message, recipient_list)
+                jh_send_mails(notifications)
             except Exception as e:
                 logger.error("Failed to send email! %s" % e)
                 return False
 
         return True
 
-    def notify_new_status(self, user):
+    def get_new_status_notification(self, user):
         subject = _("new status")
         message = _("Hi!<br/><br/>Status of your rent was changed to %s.<br/><br/>") % self.get_status_display()
 
-        return self.notify_users(subject, message, user)
+        return self.get_notification(subject, message, user)
+
+    def notify_new_status(self, user):
+        return Rent.send_notifications([self.get_new_status_notification(user)])
 
     def notify_new_comment(self, comment):
         subject = _("new comment")
@@ -152,20 +254,62 @@ class Rent(TimeStampedModel):
         return 'info'
 
     @staticmethod
-    def get_count_by_status():
-        """Returns a dict representing the number of Rent object by status."""
-        status_counts = dict()
+    def get_list_counts(user):
+        """
+        Returns the counters displayed above the list of rents with one query: a dict representing the number of Rent
+        objects by status, and the number of active rents modified by the given user under the key `todo`.
 
-        for x in Rent.objects.all().values('status').annotate(total=Count('status')):
-            status_counts[x['status']] = x['total']
+        The result is cached for a short time or until a rent or its history changes.
+        """
+        key = 'rent-list-counts:%d:%d' % (get_cache_version(RENT_COUNTS_CACHE_VERSION), user.pk)
+        counts = cache.get(key)
+        if counts is not None:
+            return counts
 
-        return status_counts
+        aggregates = {status: Count('pk', filter=models.Q(status=status)) for status, _ in Rent.STATUS_CHOICES}
+        aggregates['todo'] = Count('pk', filter=(
+            models.Q(pk__in=RentHistory.objects.filter(user=user).values('rent')) &
+            ~models.Q(status__in=Rent.INACTIVE_STATUSES)
+        ))
+        counts = Rent.objects.aggregate(**aggregates)
 
-    def get_available_statuses(self, user):
-        """get available statuses based on current status, i.e. what can be next."""
+        cache.set(key, counts, RENT_COUNTS_CACHE_TIMEOUT)
+        return counts
+
+    @staticmethod
+    def prefetch_list_data(queryset):
+        """
+        Loads everything needed to display the rents of the given queryset in a list, i.e. renter, games with their
+        groups and the last history with its user, using a constant number of queries.
+        """
+        last_history = RentHistory.objects\
+            .filter(rent=models.OuterRef('rent'))\
+            .order_by('-created', '-pk')\
+            .values('pk')[:1]
+
+        return queryset\
+            .select_related('renter')\
+            .prefetch_related(
+                models.Prefetch('games', queryset=GamePiece.objects.select_related('game_group')),
+                models.Prefetch('histories',
+                                queryset=RentHistory.objects
+                                .filter(pk=models.Subquery(last_history))
+                                .select_related('user'),
+                                to_attr='prefetched_last_history'),
+            )
+
+    def get_available_statuses(self, user, can_manage=None):
+        """
+        get available statuses based on current status, i.e. what can be next.
+
+        :param can_manage: whether the user has rent.manage_rents permission, if already known.
+        """
+
+        if can_manage is None:
+            can_manage = user.has_perm('rent.manage_rents')
 
         available_statuses = []
-        if user.has_perm('rent.manage_rents'):
+        if can_manage:
             if self.status in (Rent.STATUS_DECLINED[0], Rent.STATUS_CANCELLED[0], Rent.STATUS_PENDING[0]):
                 s = Rent.STATUS_APPROVED[0]
                 available_statuses.append((s, Rent.STATUS_CHANGE_VERB[s]))
@@ -217,9 +361,156 @@ class RentHistory(TimeStampedModel):
     edited_date_to = models.DateTimeField(verbose_name=_("Edited to"), null=True)
     rent = models.ForeignKey(Rent, on_delete=models.PROTECT, related_name='histories')
 
+    class Meta:
+        indexes = [
+            # last history of a rent
+            models.Index(fields=['rent', 'created'], name='rent_history_rent_created'),
+            # rents handled by a member, see the members stats
+            models.Index(fields=['user', 'rent'], name='rent_history_user_rent'),
+        ]
+
 
 class Comment(TimeStampedModel):
     """Represents a comment for a rent object made by a user."""
     rent = models.ForeignKey(Rent, on_delete=models.PROTECT, related_name="comments")
     user = models.ForeignKey(JhUser, on_delete=models.PROTECT)
     message = models.TextField(verbose_name=_("Message"))
+
+
+class RentOccupancy(models.Model):
+    """
+    Denormalised period while a GamePiece is held by a Rent, used for availability checks.
+
+    There's one object for each game of each rent. The period is already extended by RENT_RETURN_DELAY_DAYS on both
+    ends, so checking availability is a plain interval overlap lookup. Objects are kept in sync with the rents by the
+    signal handlers below, `rebuild_occupancy` management command recreates all of them.
+    """
+    rent = models.ForeignKey(Rent, on_delete=models.CASCADE, related_name="occupancies")
+    game_piece = models.ForeignKey(GamePiece, on_delete=models.CASCADE, related_name="occupancies")
+    date_from = models.DateTimeField()
+    date_to = models.DateTimeField()
+    active = models.BooleanField(default=True, help_text=_("False if the rent does not hold the game anymore."))
+
+    class Meta:
+        unique_together = ('rent', 'game_piece')
+        # On PostgreSQL there's also a GiST index on the active periods, see migration 0008.
+        indexes = [
+            models.Index(fields=['game_piece', 'date_from', 'date_to'], name='rent_occupancy_piece_period'),
+        ]
+
+    @staticmethod
+    def get_period_values(rent):
+        """Returns the field values of the RentOccupancy objects of the given rent."""
+        delay_days = timedelta(days=settings.RENT_RETURN_DELAY_DAYS)
+
+        # rent dates can be plain dates before being reloaded from the database
+        date_from = Rent._meta.get_field('date_from').to_python(rent.date_from)
+        date_to = Rent._meta.get_field('date_to').to_python(rent.date_to)
+
+        return {
+            'date_from': date_from - delay_days,
+            'date_to': max(date_from, date_to) + delay_days,
+            'active': rent.status not in Rent.INACTIVE_STATUSES,
+        }
+
+    @classmethod
+    def sync_rent(cls, rent):
+        """Updates the RentOccupancy objects of the given rent to match its current games, dates and status."""
+        values = cls.get_period_values(rent)
+        piece_pks = set(rent.games.values_list('pk', flat=True))
+
+        occupancies = cls.objects.filter(rent=rent)
+        occupancies.exclude(game_piece__in=piece_pks).delete()
+        occupancies.update(**values)
+
+        existing_pks = set(occupancies.values_list('game_piece_id', flat=True))
+        cls.objects.bulk_create([cls(rent=rent, game_piece_id=pk, **values) for pk in piece_pks - existing_pks])
+
+        bump_cache_version(AVAILABILITY_CACHE_VERSION)
+
+    @classmethod
+    def sync_periods(cls, rents):
+        """
+        Updates the RentOccupancy objects of the given rents to match their current dates and status with two queries.
+
+        Used after changing the rents in bulk, their games must be unchanged.
+        """
+        values = {rent.pk: cls.get_period_values(rent) for rent in rents}
+
+        occupancies = list(cls.objects.filter(rent__in=values.keys()))
+        for occupancy in occupancies:
+            for name, value in values[occupancy.rent_id].items():
+                setattr(occupancy, name, value)
+        cls.objects.bulk_update(occupancies, ['date_from', 'date_to', 'active'])
+
+        bump_cache_version(AVAILABILITY_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Rent)
+def sync_occupancy_on_rent_save(sender, instance, **kwargs):
+    """Dates and status of the rent might have changed."""
+    RentOccupancy.sync_rent(instance)
+
+
+@receiver(m2m_changed, sender=Rent.games.through)
+def sync_occupancy_on_games_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Games of the rent were added or removed."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        RentOccupancy.sync_rent(instance)
+    elif action == 'post_clear':
+        RentOccupancy.objects.filter(game_piece=instance).delete()
+        bump_cache_version(AVAILABILITY_CACHE_VERSION)
+    else:
+        for rent in Rent.objects.filter(pk__in=pk_set):
+            RentOccupancy.sync_rent(rent)
+
+
+@receiver(post_save, sender=GamePiece)
+@receiver(post_delete, sender=GamePiece)
+@receiver(post_save, sender=InventoryItem)
+@receiver(post_delete, sender=InventoryItem)
+def invalidate_availability_on_inventory_change(sender, **kwargs):
+    """Rentable flag or playable state of a game piece might have changed."""
+    bump_cache_version(AVAILABILITY_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Rent)
+@receiver(post_delete, sender=Rent)
+@receiver(post_save, sender=RentHistory)
+def invalidate_rent_list_counts(sender, **kwargs):
+    """Status of a rent or the users who modified it might have changed."""
+    bump_cache_version(RENT_COUNTS_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=RentHistory)
+def invalidate_rent_recipients(sender, instance, **kwargs):
+    """A new user might be connected to the rent, or the renter might have changed."""
+    if sender is RentHistory and instance.new_renter_id is not None:
+        Rent.invalidate_recipients([instance.rent_id])
+    else:
+        Rent.invalidate_recipients([instance.rent_id], new_email=instance.user.email)
+
+
+@receiver(pre_save, sender=Rent)
+def store_previous_renter(sender, instance, **kwargs):
+    """The cached recipients of the rent contain the previous renter, see invalidate_recipients_on_renter_change."""
+    instance.previous_renter_id = Rent.objects.filter(pk=instance.pk).values_list('renter', flat=True).first() \
+        if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Rent)
+def invalidate_recipients_on_renter_change(sender, instance, created, **kwargs):
+    """The new renter has to be notified before a RentHistory of the change is saved."""
+    if not created and getattr(instance, 'previous_renter_id', None) != instance.renter_id:
+        Rent.invalidate_recipients([instance.pk])
+
+
+@receiver(post_save, sender=JhUser)
+def invalidate_recipients_on_user_change(sender, update_fields=None, **kwargs):
+    """Email address of the user might have changed. Saving only the time of the last login is ignored."""
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        bump_cache_version(RENT_RECIPIENTS_CACHE_VERSION)
@@ -0,0 +1,96 @@
+"""
+Locking of GamePiece objects around availability checks.
+
+Checking if a piece is free and assigning it to a rent must happen while holding the lock of the piece, otherwise two
+concurrent requests could get the same piece for overlapping periods.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from inventory.models import GamePiece
+from .availability import allocate_pieces, get_blocked_pieces
+from .models import Rent
+
+# first key of the PostgreSQL advisory locks, so they do not collide with other users of advisory locks
+ADVISORY_LOCK_NAMESPACE = 7301
+
+# fallback for databases without row locking (SQLite, used in development)
+_process_lock = threading.RLock()
+
+
+@contextmanager
+def lock_pieces(piece_pks):
+    """
+    Runs the block in a transaction, holding an exclusive lock for each given GamePiece pk.
+
+    On PostgreSQL transaction level advisory locks are used, on other databases supporting it the rows are locked with
+    SELECT FOR UPDATE. Both are released at the end of the outermost transaction. Otherwise a process wide lock is held
+    while the block runs, so it should not be nested in another transaction.
+    """
+    # always lock in the same order to avoid deadlocks
+    piece_pks = sorted(set(int(pk) for pk in piece_pks))
+
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for pk in piece_pks:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [ADVISORY_LOCK_NAMESPACE, pk])
+            yield
+    elif connection.features.has_select_for_update:
+        with transaction.atomic():
+            list(GamePiece.objects.select_for_update().filter(pk__in=piece_pks).order_by('pk').values_list('pk'))
+            yield
+    else:
+        with _process_lock, transaction.atomic():
+            yield
+
+
+def reserve_new_rent(renter, date_from, date_to, status, game_groups):
+    """
+    Creates a new rent with a free GamePiece of each given GameGroup.
+
+    :param game_groups: iterable of GameGroup pks.
+    :return: (rent, list of allocated GamePiece objects) tuple.
+    :raises GameGroup.DoesNotExist if any of the groups has no free piece. Nothing is saved in this case.
+    """
+    candidates = GamePiece.objects.filter(game_group__in=list(game_groups)).values_list('pk', flat=True)
+
+    with lock_pieces(candidates):
+        rent = Rent.objects.create(renter=renter, date_from=date_from, date_to=date_to, status=status)
+        games = allocate_pieces(rent, game_groups, rent.date_from, rent.date_to)
+
+    return rent, games
+
+
+def reserve_piece(rent, piece):
+    """Adds the given GamePiece to the rent if it is free during the rent. Returns True on success."""
+    with lock_pieces([piece.pk]):
+        if get_blocked_pieces(rent.date_from, rent.date_to, pieces=[piece.pk]):
+            return False
+        rent.games.add(piece)
+
+    return True
+
+
+def count_double_booked(rents):
+    """Returns the number of games of the given Rent queryset which overlap with a previous rent of the same piece."""
+    delay_days = timedelta(days=settings.RENT_RETURN_DELAY_DAYS)
+    rented_games = Rent.games.through.objects\
+        .filter(rent__in=rents)\
+        .exclude(rent__status__in=Rent.INACTIVE_STATUSES)\
+        .order_by('gamepiece_id', 'rent__date_from')\
+        .values_list('gamepiece_id', 'rent__date_from', 'rent__date_to')
+
+    double_booked = 0
+    last_piece, last_date_to = None, None
+    for piece, date_from, date_to in rented_games:
+        if piece == last_piece and date_from <= last_date_to + delay_days:
+            double_booked += 1
+        if piece != last_piece or date_to > last_date_to:
+            last_piece, last_date_to = piece, date_to
+
+    return double_booked
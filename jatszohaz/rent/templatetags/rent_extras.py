@@ -5,8 +5,10 @@ from rent.models import Rent
 register = template.Library()
 
 
-@register.inclusion_tag('rent/rent_statuses.html')
-def show_rent_available_statuses(rent, user, *args):
-    return {'statuses': rent.get_available_statuses(user),
+@register.inclusion_tag('rent/rent_statuses.html', takes_context=True)
+def show_rent_available_statuses(context, rent, user, *args):
+    # lists may provide the permission of the user, so it's not checked for every rent
+    can_manage = context.get('can_manage_rents')
+    return {'statuses': rent.get_available_statuses(user, can_manage),
             'rent_pk': rent.pk,
             'confirm_statuses': (Rent.STATUS_CANCELLED[0], )}
@@ -0,0 +1,268 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+import threading
+from time import perf_counter
+from unittest import SkipTest
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inventory.models import GameGroup, GamePiece, InventoryItem
+from jatszohaz.models import JhUser
+from .availability import REASON_NOT_PLAYABLE, REASON_NOT_RENTABLE, REASON_RENTED, get_available_game_groups, \
+    get_blocked_pieces
+from .forms import RentFormStep2
+from .models import Rent, RentOccupancy
+from .reservation import count_double_booked, reserve_new_rent
+
+
+def create_game_group(name, pieces=1, **kwargs):
+    """Creates a GameGroup with the given number of GamePiece objects."""
+    game_group = GameGroup.objects.create(name=name, description=name, short_description=name, image='%s.jpg' % name,
+                                          playtime='20 mins', playtime_category=GameGroup.LENGTH_SHORT[0])
+    for i in range(pieces):
+        GamePiece.objects.create(game_group=game_group, priority=i, **kwargs)
+    return game_group
+
+
+def create_rent(renter, date_from, date_to, pieces, status=Rent.STATUS_PENDING[0]):
+    rent = Rent.objects.create(renter=renter, date_from=date_from, date_to=date_to, status=status)
+    rent.games.add(*pieces)
+    rent.create_new_history(renter, new_status=status)
+    return rent
+
+
+class AvailabilityTest(TestCase):
+    """Availability of the games is computed with a fixed number of queries."""
+
+    def setUp(self):
+        self.renter = JhUser.objects.create(username='renter')
+        self.date_from = datetime.now() + timedelta(days=30)
+        self.date_to = self.date_from + timedelta(days=2)
+
+        self.free = create_game_group('Free')
+        self.rented = create_game_group('Rented')
+        self.not_rentable = create_game_group('Not rentable', rentable=False)
+        self.not_playable = create_game_group('Not playable')
+        self.partly_rented = create_game_group('Partly rented', pieces=2)
+
+        self.rented_piece = self.rented.game_pieces.get()
+        self.partly_rented_piece = self.partly_rented.game_pieces.get(priority=0)
+        create_rent(self.renter, self.date_from, self.date_to, [self.rented_piece, self.partly_rented_piece])
+
+        # an older inventory of the piece was playable, only the latest counts
+        self.not_playable_piece = self.not_playable.game_pieces.get()
+        InventoryItem.objects.create(user=self.renter, game=self.not_playable_piece, playable=True)
+        InventoryItem.objects.create(user=self.renter, game=self.not_playable_piece, playable=False)
+
+    def test_blocked_pieces(self):
+        with self.assertNumQueries(2):
+            blocked = get_blocked_pieces(self.date_from, self.date_to)
+
+        self.assertEqual(blocked, {
+            self.rented_piece.pk: REASON_RENTED,
+            self.partly_rented_piece.pk: REASON_RENTED,
+            self.not_rentable.game_pieces.get().pk: REASON_NOT_RENTABLE,
+            self.not_playable_piece.pk: REASON_NOT_PLAYABLE,
+        })
+
+    def test_available_game_groups(self):
+        with self.assertNumQueries(3):
+            available = {game.pk: game.free_pieces for game in get_available_game_groups(self.date_from, self.date_to)}
+
+        self.assertEqual(available, {self.free.pk: 1, self.partly_rented.pk: 1})
+
+    def test_available_after_rent(self):
+        date_from = self.date_to + timedelta(days=30)
+        available = get_available_game_groups(date_from, date_from + timedelta(days=2))
+
+        self.assertEqual({game.pk for game in available}, {self.free.pk, self.rented.pk, self.partly_rented.pk})
+
+    def test_wizard_game_choices(self):
+        with self.assertNumQueries(3):
+            form = RentFormStep2(initial={'date_from': self.date_from, 'date_to': self.date_to.date()})
+
+        self.assertEqual([pk for pk, game in form.fields['game_groups'].choices],
+                         [self.free.pk, self.partly_rented.pk])
+
+
+class RentsViewTest(TestCase):
+    """The rent list costs the same number of queries regardless of the number of rents."""
+
+    def setUp(self):
+        self.admin = JhUser.objects.create(username='admin')
+        self.admin.user_permissions.add(Permission.objects.get(codename='manage_rents'))
+        self.client.force_login(self.admin)
+
+        self.renters = [JhUser.objects.create(username='renter%d' % i) for i in range(10)]
+        self.game_groups = [create_game_group('Game %d' % i) for i in range(3)]
+        self.date_from = datetime.now() + timedelta(days=30)
+
+    def create_rents(self, count):
+        for i in range(count):
+            renter = self.renters[i % len(self.renters)]
+            date_from = self.date_from + timedelta(days=10 * Rent.objects.count())
+            rent = create_rent(renter, date_from, date_from + timedelta(days=2),
+                               [game_group.game_pieces.get() for game_group in self.game_groups])
+            rent.create_new_history(self.admin, new_status=Rent.STATUS_APPROVED[0])
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_constant_queries(self):
+        urls = (reverse('rent:rents'), reverse('rent:rents', args=['ToDo']))
+        self.create_rents(1)
+        few = [self.count_queries(url) for url in urls]
+        # a full page
+        self.create_rents(9)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+
+class EditViewTest(TestCase):
+    """Notifications of an edited rent are sent to its current users."""
+
+    def setUp(self):
+        self.admin = JhUser.objects.create(username='admin', email='admin@example.com')
+        self.admin.user_permissions.add(Permission.objects.get(codename='manage_rents'))
+        self.client.force_login(self.admin)
+
+        self.old_renter = JhUser.objects.create(username='old', email='old@example.com')
+        self.new_renter = JhUser.objects.create(username='new', email='new@example.com')
+        self.date_from = datetime.now().replace(microsecond=0) + timedelta(days=30)
+        self.rent = create_rent(self.old_renter, self.date_from, self.date_from + timedelta(days=2), [])
+
+    def test_change_renter_and_dates(self):
+        # the recipients are cached before the change
+        self.assertEqual(Rent.get_recipients([self.rent.pk])[self.rent.pk], {'old@example.com'})
+
+        date_from = self.date_from + timedelta(days=7)
+        response = self.client.post(reverse('rent:edit', args=[self.rent.pk]), {
+            'renter': self.new_renter.pk,
+            'date_from': date_from.strftime('%Y-%m-%d %H:%M:%S'),
+            'date_to': (date_from + timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.rent.refresh_from_db()
+        self.assertEqual((self.rent.renter, self.rent.date_from), (self.new_renter, date_from))
+        email, = mail.outbox
+        self.assertIn('new@example.com', email.to)
+
+
+@override_settings(STATS_WORKER_THREADS=0)
+class ReservationTest(TransactionTestCase):
+    """Parallel reservations must not get the same GamePiece for overlapping periods."""
+
+    def setUp(self):
+        self.game_group = create_game_group('Bang')
+        self.renters = [JhUser.objects.create(username='renter%d' % i) for i in range(2)]
+        self.date_from = datetime.now() + timedelta(days=30)
+        self.date_to = self.date_from + timedelta(days=2)
+
+    def test_race_for_last_piece(self):
+        barrier = threading.Barrier(len(self.renters))
+        results = dict()
+
+        def reserve(renter):
+            try:
+                barrier.wait()
+                reserve_new_rent(renter, self.date_from, self.date_to, Rent.STATUS_PENDING[0], [self.game_group.pk])
+                results[renter.pk] = True
+            except GameGroup.DoesNotExist:
+                results[renter.pk] = False
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve, args=(renter, )) for renter in self.renters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results.values()), [False, True])
+        self.assertEqual(Rent.objects.count(), 1)
+        self.assertEqual(RentOccupancy.objects.filter(active=True).count(), 1)
+
+
+@override_settings(STATS_WORKER_THREADS=0, OUTBOX_WORKER_THREADS=0)
+class NewViewStressTest(LiveServerTestCase):
+    """Renters sending the rent wizard at the same time to the threaded server must not get the same GamePiece."""
+
+    clients = 8
+    rents_per_client = 4
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise SkipTest("The shared in-memory SQLite database fails concurrent writes instead of waiting for them.")
+        super().setUpClass()
+
+    def setUp(self):
+        self.game_groups = [create_game_group(name, pieces=2) for name in ('Bang', 'Carcassonne')]
+        self.renters = [JhUser.objects.create(username='renter%d' % i) for i in range(self.clients)]
+        self.date_from = datetime.now().date() + timedelta(days=30)
+
+    def get_session_cookie(self, renter):
+        client = Client()
+        client.force_login(renter)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def rent(self, session_id, index):
+        """Sends every step of the wizard, returns the number of requests."""
+        url = self.live_server_url + reverse('rent:new')
+        cookies = {settings.SESSION_COOKIE_NAME: session_id}
+
+        def request(data=None):
+            cookie = '; '.join('%s=%s' % item for item in cookies.items())
+            with urlopen(Request(url, data=urlencode(data, doseq=True).encode() if data else None,
+                                 headers={'Cookie': cookie})) as response:
+                response.read()
+                for morsel in SimpleCookie(', '.join(response.headers.get_all('Set-Cookie', ()))).values():
+                    cookies[morsel.key] = morsel.value
+
+        # the form of the first step sets the CSRF cookie
+        request()
+        # overlapping periods, shifted by one day for every second rent
+        date_from = self.date_from + timedelta(days=index // 2)
+        steps = (
+            {'0-date_from': date_from, '0-date_to': date_from + timedelta(days=2)},
+            {'1-game_groups': [game_group.pk for game_group in self.game_groups]},
+            {'2-comment': 'stress test', '2-responsibility': 'on'},
+        )
+        for step, data in enumerate(steps):
+            data['new_view-current_step'] = step
+            request(dict(data, csrfmiddlewaretoken=cookies[settings.CSRF_COOKIE_NAME]))
+        return 1 + len(steps)
+
+    def test_parallel_wizards(self):
+        session_ids = [self.get_session_cookie(renter) for renter in self.renters]
+
+        def run(client):
+            try:
+                return sum(self.rent(session_ids[client], client + i * self.clients)
+                           for i in range(self.rents_per_client))
+            finally:
+                connection.close()
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=self.clients) as executor:
+            requests = sum(executor.map(run, range(self.clients)))
+        elapsed = perf_counter() - started
+        print("\n%d requests, %d rents in %.2f s (%.1f requests/s)." % (
+            requests, Rent.objects.count(), elapsed, requests / elapsed))
+
+        self.assertTrue(Rent.objects.exists())
+        self.assertEqual(count_double_booked(Rent.objects.all()), 0)
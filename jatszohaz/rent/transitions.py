@@ -0,0 +1,164 @@
+"""
+Changing the status of multiple rents at once.
+
+Rents are loaded with one query and validated in memory, then the new statuses and the RentHistory objects are written
+in bulk in one transaction. Notifications of the users are sent as one batch at the end.
+"""
+from datetime import datetime
+
+from django.core.exceptions import PermissionDenied
+from django.utils.translation import ugettext_lazy as _
+
+from jatszohaz.utils import bump_cache_version
+from stats.models import mark_rents_stale
+from .availability import filter_overlapping, get_unusable_pieces
+from .models import RENT_COUNTS_CACHE_VERSION, Rent, RentHistory, RentOccupancy
+from .reservation import lock_pieces
+
+
+class StatusChange:
+    """Result of change_statuses."""
+
+    def __init__(self):
+        # (rent, old status) tuples of the changed rents
+        self.changed = list()
+        # (rent, message) tuples of the rents which could not be changed
+        self.errors = list()
+        # (rent, message) tuples of the changed rents which need attention
+        self.warnings = list()
+        # changed rents whose users were not notified
+        self.not_notified = list()
+        self.notification_failed = False
+
+
+def change_statuses(rent_pks, status, user):
+    """
+    Changes the status of the given rents and notifies the users about it.
+
+    Rents which can not be changed are skipped and reported in the errors of the result.
+
+    :param rent_pks: iterable of Rent pks, missing rents are ignored.
+    :return: StatusChange object.
+    :raises PermissionDenied if the user can not change any of the rents to the given status.
+    """
+    can_manage = user.has_perm('rent.manage_rents')
+    rents = list(Rent.objects
+                 .filter(pk__in=rent_pks)
+                 .select_related('renter')
+                 .prefetch_related('games')
+                 .order_by('pk'))
+
+    # if has no permission, then can change only his own rent and only to cancelled
+    for rent in rents:
+        if not can_manage and (user != rent.renter or status != Rent.STATUS_CANCELLED[0]):
+            raise PermissionDenied("No permission to change status of rent!")
+
+    result = StatusChange()
+    if status not in dict(Rent.STATUS_CHOICES):
+        result.errors = [(rent, _("Unknown status!")) for rent in rents]
+        return result
+
+    # lock the games, so they can not be rented by someone else between the check and saving the statuses
+    with lock_pieces(game.pk for rent in rents for game in rent.games.all()):
+        # check game availability if rent was cancelled or declined
+        reactivated = [rent for rent in rents
+                       if rent.status in (Rent.STATUS_CANCELLED[0], Rent.STATUS_DECLINED[0]) and rent.status != status]
+        unavailable = get_unavailable_games(reactivated)
+
+        now = datetime.now()
+        # start of the rents moved by giving them out
+        previous_starts = list()
+        for rent in rents:
+            if status == rent.status:
+                result.errors.append((rent, _("Cannot change rent status to the same!")))
+                continue
+
+            if rent.pk in unavailable:
+                result.errors.append((
+                    rent,
+                    _("Failed to change status! Following games are not available anymore: %s") %
+                    ','.join(str(g) for g in unavailable[rent.pk])
+                ))
+                continue
+
+            if status == Rent.STATUS_GAVE_OUT[0]:
+                previous_starts.append(rent.date_from)
+                rent.date_from = now
+                if rent.date_to < rent.date_from:
+                    rent.date_to = rent.date_from
+                    result.warnings.append((rent, _("End date is in the past! Please set a correct end date!")))
+
+            result.changed.append((rent, rent.status))
+            rent.status = status
+            # bulk_update does not update it automatically
+            rent.modified = now
+
+        changed_rents = [rent for rent, old_status in result.changed]
+        if changed_rents:
+            Rent.objects.bulk_update(changed_rents, ['status', 'date_from', 'date_to', 'modified'])
+            RentHistory.objects.bulk_create([
+                RentHistory(user=user, rent=rent, new_status=status) for rent in changed_rents
+            ])
+            RentOccupancy.sync_periods(changed_rents)
+            # signals are not sent by the bulk operations
+            bump_cache_version(RENT_COUNTS_CACHE_VERSION)
+            Rent.invalidate_recipients([rent.pk for rent in changed_rents], new_email=user.email)
+            mark_rents_stale(changed_rents, previous_starts)
+
+    # notify users in case last status is not inmyroom
+    notified = list()
+    for rent, old_status in result.changed:
+        if old_status != Rent.STATUS_IN_MY_ROOM[0]:
+            notified.append(rent)
+        else:
+            result.not_notified.append(rent)
+
+    # load the recipients of every rent with one query, they are not needed again soon
+    recipients = Rent.get_recipients([rent.pk for rent in notified], use_cache=False)
+    for rent in notified:
+        rent.prefetched_recipients = recipients[rent.pk]
+    if not Rent.send_notifications(rent.get_new_status_notification(user) for rent in notified):
+        result.notification_failed = True
+
+    return result
+
+
+def get_unavailable_games(rents):
+    """
+    Returns a dict mapping the pk of the given rents to the list of their games which can not be rented during the
+    rent anymore. Rents missing from the result can hold all of their games.
+
+    The rents are checked in the given order, so besides the existing rents they also conflict with the previous
+    rents of the list. Two queries are made in total.
+    """
+    if not rents:
+        return dict()
+
+    piece_pks = set(game.pk for rent in rents for game in rent.games.all())
+    unusable = get_unusable_pieces(piece_pks)
+
+    # periods held by the active rents of the pieces, already containing RENT_RETURN_DELAY_DAYS
+    occupancies = filter_overlapping(
+        RentOccupancy.objects.filter(active=True, game_piece__in=piece_pks),
+        min(rent.date_from for rent in rents),
+        max(rent.date_to for rent in rents)
+    )
+    periods = dict()
+    for pk, date_from, date_to in occupancies.values_list('game_piece_id', 'date_from', 'date_to'):
+        periods.setdefault(pk, []).append((date_from, date_to))
+
+    unavailable = dict()
+    for rent in rents:
+        games = [game for game in rent.games.all()
+                 if game.pk in unusable or any(date_from <= rent.date_to and date_to >= rent.date_from
+                                               for date_from, date_to in periods.get(game.pk, ()))]
+        if games:
+            unavailable[rent.pk] = games
+            continue
+
+        # the rent holds its games from now on
+        values = RentOccupancy.get_period_values(rent)
+        for game in rent.games.all():
+            periods.setdefault(game.pk, []).append((values['date_from'], values['date_to']))
+
+    return unavailable
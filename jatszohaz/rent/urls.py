@@ -14,6 +14,7 @@ urlpatterns = [
     url(r'^new-comment/(?P<rent_pk>\d+)/$', views.NewCommentView.as_view(), name="new-comment"),
 
     url(r'^rules/$', views.RentRules.as_view(), name="rules"),
+    url(r'^availability/$', views.AvailabilityCalendarView.as_view(), name="availability"),
 
     url(r'^rents/$', views.RentsView.as_view(), name="rents"),
     url(r'^rents/(?P<status>\w+)/$', views.RentsView.as_view(), name="rents"),
@@ -6,6 +6,7 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.core.exceptions import SuspiciousOperation, PermissionDenied
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.utils.translation import ugettext_lazy as _
@@ -13,10 +14,14 @@ from django.utils.dateparse import parse_date
 from django.views.generic import ListView, DetailView, UpdateView, FormView, View, TemplateView
 from formtools.wizard.views import SessionWizardView
 
+from .availability import get_available_game_groups, get_free_days
 from .forms import RentFormStep1, RentFormStep2, RentFormStep3, NewCommentForm, EditRentForm, AddGameForm
 from inventory.models import GameGroup
-from jatszohaz.utils import jh_send_mail, send_message_to_members
+from jatszohaz.pagination import KeysetPaginationMixin
+from jatszohaz.utils import send_message_to_members
 from .models import Rent, Comment, GamePiece
+from .reservation import reserve_new_rent, reserve_piece
+from .transitions import change_statuses
 
 
 logger = logging.getLogger(__name__)
@@ -55,27 +60,35 @@ class NewView(LoginRequiredMixin, SessionWizardView):
 
         return self.initial_dict.get(step, data)
 
-    def send_email(self, context):
-        """Sends notification email to mailing list"""
+    def get_form_kwargs(self, step=None):
+        kwargs = super().get_form_kwargs(step)
+        if step == '1':
+            kwargs['available_game_pks'] = self.get_available_game_pks()
+        return kwargs
+
+    def get_available_game_pks(self):
+        """
+        Returns the pks of GameGroup objects available in the period selected at the first step.
+
+        The result is kept in the wizard storage, so rendering and validating the game selection step of the same
+        wizard session does not compute availability again, unless the dates are changed.
+        """
+        step0_data = self.storage.get_step_data('0')
+        if step0_data is None:
+            return None
 
-        if not settings.NEW_RENT_EMAIL_NOTIFICATION:
-            return
+        window = [step0_data['0-date_from'], step0_data['0-date_to']]
+        available_games = self.storage.extra_data.get('available_games')
+        if available_games is None or available_games['window'] != window:
+            date_from = parse_date(window[0])
+            # HACK: need to revise rent dates!
+            date_to = datetime.combine(parse_date(window[1]), datetime.max.time())
+            pks = list(get_available_game_groups(date_from, date_to).values_list('pk', flat=True))
 
-        recipient = settings.NOTIFICATION_EMAIL_TO
-        if recipient:
-            subject = _("%s new rent") % settings.EMAIL_SUBJECT_PREFIX
-            message = _("Hi!<br/><br/>New rent created!<br/><br/>"
-                        "Renter: %(renter)s<br/>"
-                        "Dates: %(date_from)s - %(date_to)s<br/>"
-                        "Games: %(games)s<br/>"
-                        "Comment: %(comment)s<br/>"
-                        "Details: <a href=\"%(url)s\">%(url)s<a><br/><br/>"
-                        "Best wishes,<br/>Játszóház") % context
+            available_games = {'window': window, 'pks': pks}
+            self.storage.extra_data = dict(self.storage.extra_data, available_games=available_games)
 
-            try:
-                jh_send_mail(subject, message, [recipient, ])
-            except Exception as e:
-                logger.error("Failed to send email! %s" % e)
+        return available_games['pks']
 
     def done(self, form_list, **kwargs):
         forms = list(form_list)
@@ -88,19 +101,18 @@ class NewView(LoginRequiredMixin, SessionWizardView):
         comment = step2_data['comment']
 
         user = self.request.user
-        rent = Rent.objects.create(
-            renter=user,
-            date_from=date_from,
-            date_to=datetime.combine(date_to, datetime.max.time())
-        )
-
-        if user.has_perm('rent.manage_rents'):
-            rent.status = Rent.STATUS_APPROVED[0]
+        try:
+            rent, games = reserve_new_rent(
+                renter=user,
+                date_from=date_from,
+                date_to=datetime.combine(date_to, datetime.max.time()),
+                status=Rent.STATUS_APPROVED[0] if user.has_perm('rent.manage_rents') else Rent.STATUS_PENDING[0],
+                game_groups=game_groups or ()
+            )
+        except GameGroup.DoesNotExist:
+            messages.error(self.request, _('Some selected games are not available due to concurrent user rent.'))
+            return redirect(reverse_lazy('rent:new'))
 
-        for gg_id in game_groups or ():
-            gg = GameGroup.objects.get(id=gg_id)
-            rent.games.add(gg.get_game_piece(date_from, date_to))
-        rent.save()
         comment = Comment.objects.create(
             rent=rent,
             user=user,
@@ -113,40 +125,45 @@ class NewView(LoginRequiredMixin, SessionWizardView):
                 'renter': rent.renter.full_name2(),
                 'date_from': rent.date_from,
                 'date_to': rent.date_to,
-                'games': ', '.join([gp.game_group.name for gp in rent.games.all()]),
+                'games': ', '.join([gp.game_group.name for gp in games]),
                 'comment': comment.message
             }
-            self.send_email(context)
-            send_message_to_members('slack/new_rent.html', context)
+            # email notification to the mailing list, if enabled
+            recipients = [settings.NOTIFICATION_EMAIL_TO] \
+                if settings.NEW_RENT_EMAIL_NOTIFICATION and settings.NOTIFICATION_EMAIL_TO else []
+            send_message_to_members('new_rent', context, email_subject=_("%s new rent") % settings.EMAIL_SUBJECT_PREFIX,
+                                    email_recipients=recipients)
 
         messages.success(self.request, _("Successfully rented!"))
         return redirect(rent.get_absolute_url())
 
 
-class MyView(LoginRequiredMixin, ListView):
+class MyView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """Showing Rent created by the logged in user."""
 
     model = Rent
     template_name = "rent/my_rents.html"
-    ordering = ['-date_from']
+    ordering = ['-date_from', '-pk']
+    keyset_ordering = ordering
     paginate_by = 10
 
     def get_queryset(self):
-        self.queryset = self.request.user.rents
+        self.queryset = Rent.prefetch_list_data(self.request.user.rents.all())
         return super().get_queryset()
 
 
-class RentsView(PermissionRequiredMixin, ListView):
+class RentsView(PermissionRequiredMixin, KeysetPaginationMixin, ListView):
     """Showing all the rents for administrators."""
 
     model = Rent
     template_name = "rent/rents.html"
     permission_required = 'rent.manage_rents'
+    keyset_ordering = ('-created', '-pk')
     paginate_by = 10
 
     def get_queryset(self):
         self.my_todo = Rent.objects.filter(histories__user=self.request.user).distinct().order_by('-created')\
-                    .exclude(status__in=(Rent.STATUS_CANCELLED[0], Rent.STATUS_DECLINED[0], Rent.STATUS_BACK[0]))
+                    .exclude(status__in=Rent.INACTIVE_STATUSES)
 
         status = self.kwargs.get('status')
 
@@ -157,26 +174,28 @@ class RentsView(PermissionRequiredMixin, ListView):
             else:
                 result = result.filter(status=status)
 
-        self.queryset = result
-
-        return result
+        return Rent.prefetch_list_data(result)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
 
         context['active_status'] = self.kwargs.get('status')
+        context['can_manage_rents'] = True  # checked by PermissionRequiredMixin
         context['statuses'] = list()
-        status_count = Rent.get_count_by_status()
+        counts = Rent.get_list_counts(self.request.user)
         sum_count = 0
         for status in Rent.STATUS_CHOICES:
-            count = status_count[status[0]] if status_count.get(status[0]) is not None else 0
+            count = counts[status[0]]
             context['statuses'].append(status + (count, ))
             sum_count += count
 
         context['sum_count'] = sum_count
-        context['todo_count'] = self.my_todo.count()
+        context['todo_count'] = counts['todo']
 
-        context['rent_pks'] = ','.join([str(r.pk) for r in self.queryset if r.status == Rent.STATUS_IN_MY_ROOM[0]])
+        # only the ToDo list offers to bring back every in my room rent
+        if context['active_status'] == 'ToDo':
+            rent_pks = self.my_todo.filter(status=Rent.STATUS_IN_MY_ROOM[0]).values_list('pk', flat=True)
+            context['rent_pks'] = ','.join(str(pk) for pk in rent_pks)
 
         return context
 
@@ -288,76 +307,33 @@ class EditView(PermissionRequiredMixin, UpdateView):
 
 
 class ChangeStatusView(LoginRequiredMixin, View):
-    """View for changing the status of the given rent."""
+    """View for changing the status of the given rents."""
 
     http_method_names = ['get', ]
 
-    def handle_rent(self, rent, status, user):
-        # if has no permission, then can change only his own rent and only to cancelled
-        if not user.has_perm('rent.manage_rents') and (
-                user != rent.renter or
-                status != Rent.STATUS_CANCELLED[0]):
-
-            raise PermissionDenied("No permission to change status of rent!")
-
-        if status == rent.status:
-            messages.error(self.request, _("Cannot change rent status to the same!"))
-            return redirect(rent.get_absolute_url())
-
-        # check game availability if rent was cancelled or declined
-        if rent.status in (Rent.STATUS_CANCELLED[0], Rent.STATUS_DECLINED[0]):
-            not_free = []
-            for game in rent.games.all():
-                if not game.is_free(rent.date_from, rent.date_to):
-                    not_free.append(str(game))
-            if not_free:
-                messages.error(
-                    self.request,
-                    _("Failed to change status! Following games are not available anymore: %s") % ','.join(not_free)
-                )
-                return redirect(rent.get_absolute_url())
-
-        # save new status
-        old_status = rent.status
-        if status == Rent.STATUS_GAVE_OUT[0]:
-            rent.date_from = datetime.now()
-            if rent.date_to < rent.date_from:
-                rent.date_to = rent.date_from
-                messages.warning(self.request, _("End date is in the past! Please set a correct end date!"))
-
-        rent.status = status
-        rent.save()
-        rent.create_new_history(self.request.user, new_status=status)
-
-        # notify user in case last status is not inmyroom
-        if old_status != Rent.STATUS_IN_MY_ROOM[0]:
-            if not rent.notify_new_status(self.request.user):
-                messages.error(self.request, _("Failed to send notification email!"))
-        else:
-            messages.success(self.request, _("User was not notified about this status change."))
-
     def get(self, request, *args, **kwargs):
         status = kwargs.get('status')
-        user = self.request.user
+        pks = [pk for pk in kwargs.get('rent_pk').split(',') if pk]
 
         # batch processing status change
-        successful = 0
-        pks = kwargs.get('rent_pk').split(',')
+        result = change_statuses(pks, status, self.request.user)
 
-        for pk in pks:
-            try:
-                rent = Rent.objects.get(pk=pk)
-                self.handle_rent(rent, status, user)
-                successful += 1
+        for rent, message in result.errors:
+            messages.error(self.request, message)
+        for rent, message in result.warnings:
+            messages.warning(self.request, message)
 
-                # if there's only one change, redirect
-                if len(pks) == 1:
-                    return redirect(rent.get_absolute_url())
-            except Rent.DoesNotExist:
-                pass
+        if result.notification_failed:
+            messages.error(self.request, _("Failed to send notification email!"))
+        if result.not_notified:
+            messages.success(self.request, _("User was not notified about this status change."))
+
+        # if there's only one change, redirect
+        if len(pks) == 1 and (result.changed or result.errors):
+            return redirect(reverse_lazy("rent:details", kwargs={'pk': pks[0]}))
 
-        if len(pks) != successful:
-            messages.error(self.request, "Only %d change was successful out of %d" % (successful, len(pks)))
+        if len(pks) != len(result.changed):
+            messages.error(self.request, "Only %d change was successful out of %d" % (len(result.changed), len(pks)))
 
         return redirect(reverse_lazy('rent:rents'))
 
@@ -375,8 +351,7 @@ class AddGameView(PermissionRequiredMixin, FormView):
     def form_valid(self, form):
         rent = self.get_rent()
         game = get_object_or_404(GamePiece, pk=form.cleaned_data['game'])
-        if game.is_free(rent.date_from, rent.date_to):
-            rent.games.add(game)
+        if reserve_piece(rent, game):
             rent.create_new_history(self.request.user, added_game=game)
             messages.success(self.request, _("Game added."))
         else:
@@ -417,6 +392,45 @@ class RemoveGameView(PermissionRequiredMixin, View):
         return redirect(rent.get_absolute_url())
 
 
+class AvailabilityCalendarView(LoginRequiredMixin, View):
+    """
+    JSON endpoint listing the days when game groups can be rented.
+
+    GET parameters:
+     - from, to: first and last month in YYYY-MM format. Defaults to the current month and the first month.
+     - game_group: optional GameGroup pk, otherwise all groups are listed.
+    """
+
+    http_method_names = ['get', ]
+    max_months = 12
+
+    def get(self, request, *args, **kwargs):
+        try:
+            first_month = self.parse_month('from')
+            last_month = self.parse_month('to', first_month)
+            game_group = request.GET.get('game_group')
+            game_groups = None if game_group is None else [int(game_group)]
+        except ValueError:
+            raise Http404()
+
+        months = (last_month.year - first_month.year) * 12 + last_month.month - first_month.month + 1
+        if not 0 < months <= self.max_months:
+            raise Http404()
+
+        free_days = get_free_days(first_month, last_month, game_groups)
+        return JsonResponse({
+            'from': first_month,
+            'to': last_month,
+            'free_days': {str(pk): days for pk, days in free_days.items()},
+        })
+
+    def parse_month(self, param_name, default=None):
+        value = self.request.GET.get(param_name)
+        if not value:
+            return default or datetime.now().date().replace(day=1)
+        return datetime.strptime(value, '%Y-%m').date()
+
+
 class RentRules(TemplateView):
     """Displaying static page about our rules."""
     template_name = "static_pages/rent_rules.html"
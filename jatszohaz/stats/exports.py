@@ -0,0 +1,85 @@
+"""
+Streaming CSV and JSON exports of the statistics and the rent history.
+
+Rows are written to the response while they are read from the database with `QuerySet.iterator`, so exporting
+years of data needs constant memory and the first bytes are sent before the whole result is read.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, StreamingHttpResponse
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+
+CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+    FORMAT_JSON: 'application/json',
+}
+
+# number of rows fetched from the database at once
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object for csv.writer, which returns the written line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(Echo())
+    # byte order mark, so Excel recognizes the encoding
+    yield '\ufeff'
+    yield writer.writerow([header for key, header in columns])
+    for row in rows:
+        yield writer.writerow([row[key] for key, header in columns])
+
+
+def stream_json(columns, rows):
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps({key: row[key] for key, header in columns}, cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+def stream_export(export_format, filename, columns, rows):
+    """
+    Returns a StreamingHttpResponse downloading the given rows in the given format.
+
+    :param columns: list of (key, header) tuples, the header is used only in CSV.
+    :param rows: iterable of dicts, e.g. the iterator of a values() queryset.
+    :raises Http404 if the format is unknown.
+    """
+    if export_format == FORMAT_CSV:
+        content = stream_csv(columns, rows)
+    elif export_format == FORMAT_JSON:
+        content = stream_json(columns, rows)
+    else:
+        raise Http404("Unknown export format!")
+
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_format)
+    return response
+
+
+class ExportMixin:
+    """
+    View mixin streaming the rows of `get_export_queryset` instead of rendering a page.
+
+    The format is given by the `format` URL parameter, see stream_export.
+    """
+    export_name = None
+    # (key, header) tuples
+    export_columns = ()
+
+    def get_export_queryset(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        rows = self.get_export_queryset().iterator(chunk_size=CHUNK_SIZE)
+        return stream_export(self.kwargs['format'], self.export_name, self.export_columns, rows)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from stats.models import GameStat, MemberStat, RentStat
+
+
+class Command(BaseCommand):
+    help = "Recomputes all monthly statistics from the rents. " \
+           "Must be run after changing rents without sending signals, e.g. with bulk operations or raw SQL."
+
+    def handle(self, *args, **options):
+        for model in (RentStat, GameStat, MemberStat):
+            count = model.refresh()
+            self.stdout.write(self.style.SUCCESS("%d %s rows created." % (count, model.__name__)))
@@ -0,0 +1,25 @@
+from time import perf_counter, sleep
+
+from django.core.management.base import BaseCommand
+
+from stats.models import refresh_stale_months
+
+
+class Command(BaseCommand):
+    help = "Recomputes the months of the statistics changed since the last refresh. " \
+           "With --loop it keeps running and checks the changed months periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running until interrupted.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds to wait between runs with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = perf_counter()
+            count = refresh_stale_months()
+            if count or not options['loop']:
+                self.stdout.write("%d months recomputed in %.2f s." % (count, perf_counter() - started))
+
+            if not options['loop']:
+                break
+            sleep(options['interval'])
@@ -0,0 +1,90 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    Rent = apps.get_model('rent', 'Rent')
+    RentHistory = apps.get_model('rent', 'RentHistory')
+    RentStat = apps.get_model('stats', 'RentStat')
+    GameStat = apps.get_model('stats', 'GameStat')
+    MemberStat = apps.get_model('stats', 'MemberStat')
+
+    rows = Rent.objects\
+        .values('status', month=TruncMonth('date_from', output_field=models.DateField()))\
+        .annotate(count=models.Count('pk'))\
+        .order_by()
+    RentStat.objects.bulk_create([RentStat(**row) for row in rows], batch_size=500)
+
+    rows = Rent.games.through.objects\
+        .values('gamepiece__game_group', 'rent__status',
+                month=TruncMonth('rent__date_from', output_field=models.DateField()))\
+        .annotate(count=models.Count('pk'))\
+        .order_by()
+    GameStat.objects.bulk_create([
+        GameStat(month=row['month'], game_group_id=row['gamepiece__game_group'], status=row['rent__status'],
+                 count=row['count']) for row in rows
+    ], batch_size=500)
+
+    rows = RentHistory.objects.exclude(user=models.F('rent__renter'))\
+        .values('user', month=TruncMonth('rent__created', output_field=models.DateField()))\
+        .annotate(count=models.Count('rent', distinct=True))\
+        .order_by()
+    MemberStat.objects.bulk_create([
+        MemberStat(month=row['month'], user_id=row['user'], count=row['count']) for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('inventory', '0024_gamepiece_latest_inventory'),
+        ('rent', '0010_rent_history_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, help_text='First day of the month.', verbose_name='Month')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('gaveout', 'Gave out'), ('inmyroom', 'In my room'), ('back', 'Brought back'), ('declined', 'Declined'), ('cancelled', 'Cancelled')], max_length=20, verbose_name='Status')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MemberStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, help_text='First day of the month.', verbose_name='Month')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='GameStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, help_text='First day of the month.', verbose_name='Month')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('gaveout', 'Gave out'), ('inmyroom', 'In my room'), ('back', 'Brought back'), ('declined', 'Declined'), ('cancelled', 'Cancelled')], max_length=20, verbose_name='Status')),
+                ('game_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='inventory.GameGroup', verbose_name='Game group')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    """Concurrent refreshes of a month could insert its rows twice, only the last copy of them is kept."""
+    for name, fields in (('RentStat', ('month', 'status')), ('GameStat', ('month', 'game_group', 'status')),
+                         ('MemberStat', ('month', 'user'))):
+        model = apps.get_model('stats', name)
+        duplicates = model.objects.values(*fields)\
+            .annotate(copies=models.Count('pk'), last=models.Max('pk'))\
+            .filter(copies__gt=1)\
+            .order_by()
+        for row in duplicates:
+            model.objects.filter(**{field: row[field] for field in fields}).exclude(pk=row['last']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0024_gamepiece_latest_inventory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stats', '0001_monthly_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='gamestat',
+            unique_together={('month', 'game_group', 'status')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='memberstat',
+            unique_together={('month', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='rentstat',
+            unique_together={('month', 'status')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_unique_months'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stat', models.CharField(choices=[('RentStat', 'RentStat'), ('GameStat', 'GameStat'), ('MemberStat', 'MemberStat')], max_length=20, verbose_name='Statistics')),
+                ('month', models.DateField(help_text='First day of the month.', verbose_name='Month')),
+            ],
+            options={
+                'unique_together': {('stat', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0003_stale_months'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='stalemonth',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,369 @@
+"""
+Pre-aggregated statistics of the rents by month.
+
+The stats views are answered from these few hundred rows instead of aggregating the whole rent history. When a rent
+changes, the signal handlers below only mark its months stale, in the same transaction. The stale months are
+recomputed by `refresh_stale_months`, which is run
+
+* by a background thread pool of the web process after the transaction is committed
+  (if STATS_WORKER_THREADS is not 0), and
+* by the `refresh_stats` management command, e.g. from cron.
+
+The `rebuild_stats` management command recomputes all of them. Refreshes of the same month are serialised with
+`lock_months`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
+
+from inventory.models import GameGroup, GamePiece
+from jatszohaz.models import JhUser
+from rent.models import Rent, RentHistory
+
+# first key of the PostgreSQL advisory locks of the months, rent.reservation uses 7301 for the game pieces
+ADVISORY_LOCK_NAMESPACE = 7302
+# second key of the lock held while every month is recomputed, it does not collide with the keys of the months
+ALL_MONTHS_LOCK = 0
+
+# fallback for other databases
+_process_lock = threading.RLock()
+
+_executor = None
+_worker_queued = False
+_worker_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def get_month(value):
+    """Returns the first day of the month of the given date or datetime."""
+    return date(value.year, value.month, 1)
+
+
+def get_month_range(month):
+    """Returns the (start, end) datetimes of the given month, the end is the start of the next month."""
+    start = datetime(month.year, month.month, 1)
+    if month.month == 12:
+        return start, datetime(month.year + 1, 1, 1)
+    return start, datetime(month.year, month.month + 1, 1)
+
+
+@contextmanager
+def lock_months(months):
+    """
+    Runs the block in a transaction, holding an exclusive lock for each given month, or for every month if None.
+
+    On PostgreSQL transaction level advisory locks are used, which are released at the end of the outermost
+    transaction. Otherwise a process wide lock is held while the block runs, so it should not be nested in another
+    transaction.
+
+    :param months: iterable of the first days of the months, or None.
+    """
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if months is None:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [ADVISORY_LOCK_NAMESPACE, ALL_MONTHS_LOCK])
+                else:
+                    cursor.execute("SELECT pg_advisory_xact_lock_shared(%s, %s)",
+                                   [ADVISORY_LOCK_NAMESPACE, ALL_MONTHS_LOCK])
+                    # always lock in the same order to avoid deadlocks
+                    for month in sorted(months):
+                        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)",
+                                       [ADVISORY_LOCK_NAMESPACE, month.year * 12 + month.month])
+            yield
+    else:
+        with _process_lock, transaction.atomic():
+            yield
+
+
+class MonthlyStat(models.Model):
+    """Base class of the statistics, a row is a count of a month, broken down by the fields of the subclass."""
+    month = models.DateField(verbose_name=_("Month"), db_index=True, help_text=_("First day of the month."))
+    count = models.PositiveIntegerField(verbose_name=_("Count"), default=0)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def aggregate(cls, months=None):
+        """
+        Returns the list of field values of the rows computed from the rents with one query.
+
+        :param months: set of the first days of the aggregated months, every month is aggregated if None.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def refresh(cls, months=None):
+        """
+        Recomputes the rows of the given months, holding the locks of the months.
+
+        :param months: iterable of dates (any day of the month), every row is recomputed if None.
+        """
+        if months is not None:
+            months = {get_month(month) for month in months}
+            if not months:
+                return 0
+
+        with lock_months(months):
+            stats = cls.objects.all() if months is None else cls.objects.filter(month__in=months)
+            stats.delete()
+            rows = cls.aggregate(months)
+            cls.objects.bulk_create([cls(**row) for row in rows], batch_size=500)
+        return len(rows)
+
+
+def _filter_months(queryset, field, months):
+    """Filters the queryset for the given months with date ranges, so the indexes of the field can be used."""
+    if months is None:
+        return queryset
+
+    condition = models.Q()
+    for month in months:
+        start, end = get_month_range(month)
+        condition |= models.Q(**{'%s__gte' % field: start, '%s__lt' % field: end})
+    return queryset.filter(condition)
+
+
+class RentStat(MonthlyStat):
+    """Number of rents by the month of their start and their status."""
+    status = models.CharField(verbose_name=_("Status"), choices=Rent.STATUS_CHOICES, max_length=20)
+
+    class Meta:
+        unique_together = ('month', 'status')
+
+    @classmethod
+    def aggregate(cls, months=None):
+        return list(_filter_months(Rent.objects, 'date_from', months)
+                    .values('status', month=TruncMonth('date_from', output_field=models.DateField()))
+                    .annotate(count=models.Count('pk'))
+                    .order_by())
+
+
+class GameStat(MonthlyStat):
+    """Number of times the pieces of a game group were rented, by the month of the start and the status of the rents."""
+    game_group = models.ForeignKey(GameGroup, on_delete=models.CASCADE, related_name='monthly_stats',
+                                   verbose_name=_("Game group"))
+    status = models.CharField(verbose_name=_("Status"), choices=Rent.STATUS_CHOICES, max_length=20)
+
+    class Meta:
+        unique_together = ('month', 'game_group', 'status')
+
+    @classmethod
+    def aggregate(cls, months=None):
+        rows = _filter_months(Rent.games.through.objects, 'rent__date_from', months)\
+            .values('gamepiece__game_group', 'rent__status',
+                    month=TruncMonth('rent__date_from', output_field=models.DateField()))\
+            .annotate(count=models.Count('pk'))\
+            .order_by()
+        return [{'month': row['month'], 'game_group_id': row['gamepiece__game_group'],
+                 'status': row['rent__status'], 'count': row['count']} for row in rows]
+
+
+class MemberStat(MonthlyStat):
+    """
+    Number of rents handled by a member, by the month of the creation of the rents.
+
+    Handled means the member has a RentHistory of the rent, the own rents of the member are not included.
+    """
+    user = models.ForeignKey(JhUser, on_delete=models.CASCADE, related_name='monthly_stats', verbose_name=_("User"))
+
+    class Meta:
+        unique_together = ('month', 'user')
+
+    @classmethod
+    def aggregate(cls, months=None):
+        rows = _filter_months(RentHistory.objects.exclude(user=models.F('rent__renter')), 'rent__created', months)\
+            .values('user', month=TruncMonth('rent__created', output_field=models.DateField()))\
+            .annotate(count=models.Count('rent', distinct=True))\
+            .order_by()
+        return [{'month': row['month'], 'user_id': row['user'], 'count': row['count']} for row in rows]
+
+
+class StaleMonth(models.Model):
+    """
+    A month of a statistics table, which has to be recomputed, see refresh_stale_months.
+
+    Every change adds its own rows, even if the month is already stale. A refresh deletes only the rows it has read, so
+    the rows of the changes not committed before the refresh are kept for the next one.
+    """
+    STAT_CHOICES = (
+        ('RentStat', 'RentStat'),
+        ('GameStat', 'GameStat'),
+        ('MemberStat', 'MemberStat'),
+    )
+
+    stat = models.CharField(verbose_name=_("Statistics"), choices=STAT_CHOICES, max_length=20)
+    month = models.DateField(verbose_name=_("Month"), help_text=_("First day of the month."))
+
+
+STAT_MODELS = (RentStat, GameStat, MemberStat)
+
+
+def mark_stale(model, months):
+    """
+    Marks the given months of the statistics table stale, they are recomputed after the current transaction commits.
+
+    :param model: one of STAT_MODELS.
+    :param months: iterable of dates (any day of the month).
+    """
+    months = {get_month(month) for month in months}
+    if not months:
+        return
+
+    StaleMonth.objects.bulk_create([StaleMonth(stat=model.__name__, month=month) for month in months])
+    wake_up_worker()
+
+
+def mark_rents_stale(rents, months=()):
+    """
+    Marks the months of the given rents stale in every statistics table, it must be called after bulk operations.
+
+    :param months: dates of other months to recompute, e.g. the previous months of the rents if they were moved.
+    """
+    months = set(months) | {rent.date_from for rent in rents}
+    mark_stale(RentStat, months)
+    mark_stale(GameStat, months)
+    mark_stale(MemberStat, [rent.created for rent in rents])
+
+
+def refresh_stale_months():
+    """Recomputes the stale months of every statistics table, returns the number of recomputed months."""
+    count = 0
+    for model in STAT_MODELS:
+        count += refresh_stale_rows(model, StaleMonth.objects.filter(stat=model.__name__).values_list('pk', 'month'))
+    return count
+
+
+def refresh_stale_rows(model, rows):
+    """
+    Recomputes the months of the given StaleMonth rows of the statistics table, and deletes only these rows.
+
+    :param rows: iterable of (pk, month) tuples of StaleMonth objects.
+    :return: number of recomputed months.
+    """
+    rows = list(rows)
+    months = {month for pk, month in rows}
+    if not months:
+        return 0
+
+    with lock_months(months):
+        StaleMonth.objects.filter(pk__in=[pk for pk, month in rows]).delete()
+        model.refresh(months)
+    return len(months)
+
+
+def wake_up_worker():
+    """Schedules a run of refresh_stale_months on the background thread pool, after the current transaction commits."""
+    if settings.STATS_WORKER_THREADS:
+        transaction.on_commit(_submit_worker)
+
+
+def _submit_worker():
+    global _executor, _worker_queued
+
+    with _worker_lock:
+        # a queued run will recompute every month marked until it starts
+        if _worker_queued:
+            return
+        _worker_queued = True
+
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.STATS_WORKER_THREADS, thread_name_prefix='stats')
+
+    _executor.submit(_run_worker)
+
+
+def _run_worker():
+    global _worker_queued
+
+    with _worker_lock:
+        _worker_queued = False
+
+    try:
+        refresh_stale_months()
+    except Exception:
+        logger.exception("Refreshing the statistics failed!")
+    finally:
+        connection.close()
+
+
+def get_rent_months(game_piece):
+    return list(game_piece.rents.dates('date_from', 'month'))
+
+
+@receiver(pre_save, sender=Rent)
+def store_previous_rent_values(sender, instance, **kwargs):
+    """The previous start and renter are needed to recompute the months the rent was moved from."""
+    instance.stats_previous = Rent.objects.filter(pk=instance.pk).values('date_from', 'renter').first() \
+        if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Rent)
+def mark_stale_on_rent_save(sender, instance, **kwargs):
+    previous = getattr(instance, 'stats_previous', None)
+    months = {instance.date_from}
+    if previous is not None:
+        months.add(previous['date_from'])
+    mark_stale(RentStat, months)
+    mark_stale(GameStat, months)
+
+    # the own rents of the renter are not counted as handled
+    if previous is not None and previous['renter'] != instance.renter_id:
+        mark_stale(MemberStat, [instance.created])
+
+
+@receiver(post_delete, sender=Rent)
+def mark_stale_on_rent_delete(sender, instance, **kwargs):
+    mark_rents_stale([instance])
+
+
+@receiver(m2m_changed, sender=Rent.games.through)
+def mark_stale_on_games_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Games of the rent were added or removed."""
+    if action == 'pre_clear' and reverse:
+        # the rents of the piece are not known after clearing them
+        instance.stats_months = get_rent_months(instance)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        mark_stale(GameStat, [instance.date_from])
+    elif action == 'post_clear':
+        mark_stale(GameStat, getattr(instance, 'stats_months', []))
+    else:
+        mark_stale(GameStat, Rent.objects.filter(pk__in=pk_set).dates('date_from', 'month'))
+
+
+@receiver(post_save, sender=GamePiece)
+def mark_stale_on_game_piece_save(sender, instance, created, **kwargs):
+    """Game group of the piece might have changed."""
+    if not created:
+        mark_stale(GameStat, get_rent_months(instance))
+
+
+@receiver(pre_delete, sender=GamePiece)
+def store_game_piece_months(sender, instance, **kwargs):
+    instance.stats_months = get_rent_months(instance)
+
+
+@receiver(post_delete, sender=GamePiece)
+def mark_stale_on_game_piece_delete(sender, instance, **kwargs):
+    mark_stale(GameStat, getattr(instance, 'stats_months', []))
+
+
+@receiver(post_save, sender=RentHistory)
+def mark_stale_on_history_save(sender, instance, **kwargs):
+    """The user of the history might have handled the rent the first time."""
+    mark_stale(MemberStat, [instance.rent.created])
@@ -0,0 +1,406 @@
+from datetime import date, datetime, timedelta
+import csv
+import json
+import random
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from inventory.models import GameGroup, GamePiece
+from jatszohaz.models import JhUser
+from rent.models import Rent, RentHistory
+from . import models, views
+from .models import GameStat, MemberStat, RentStat, StaleMonth, get_month_range, refresh_stale_months, \
+    refresh_stale_rows
+from .utilisation import get_game_group_demand, get_piece_utilisation
+
+
+class MembersViewTest(TestCase):
+    """Handled rents of the members from the rollup are the same as counted from the rent histories."""
+
+    def setUp(self):
+        self.random = random.Random(0)
+        self.admin = JhUser.objects.create(username='admin', first_name='Admin', last_name='Zz')
+        self.admin.user_permissions.add(Permission.objects.get(codename='view_stat'))
+        self.client.force_login(self.admin)
+
+        self.members = [JhUser.objects.create(username='member%d' % i, first_name='Member', last_name='M%d' % i)
+                        for i in range(5)]
+        self.renters = [JhUser.objects.create(username='renter%d' % i, first_name='Renter', last_name='R%d' % i)
+                        for i in range(3)]
+
+        start = datetime(2019, 11, 3, 12)
+        for i in range(40):
+            created = start + timedelta(days=self.random.randint(0, 120), hours=self.random.randint(0, 12))
+            renter = self.random.choice(self.renters + self.members)
+            rent = Rent.objects.create(renter=renter, date_from=created + timedelta(days=7),
+                                       date_to=created + timedelta(days=9), created=created)
+            rent.create_new_history(renter, new_status=Rent.STATUS_PENDING[0])
+            # some members handle the rent more than once
+            for j in range(self.random.randint(0, 4)):
+                rent.create_new_history(self.random.choice(self.members), new_status=Rent.STATUS_APPROVED[0])
+
+    def get_handled_rents(self, date_from=None, date_to=None):
+        """The old way: counting the handled rents of the members one by one, in whole months."""
+        queryset = RentHistory.objects.exclude(user=F('rent__renter'))
+        if date_from:
+            queryset = queryset.filter(rent__created__gte=get_month_range(date_from)[0])
+        if date_to:
+            queryset = queryset.filter(rent__created__lt=get_month_range(date_to)[1])
+
+        rents_users = []
+        for user in JhUser.objects.order_by('last_name', 'first_name').all():
+            rents_count = queryset.filter(user=user).values('rent').distinct().count()
+            if rents_count > 0:
+                rents_users.append((user.full_name2(), rents_count))
+        return sorted(rents_users, key=lambda e: e[1], reverse=True)
+
+    def get_view_rents(self, date_from=None, date_to=None):
+        params = {name: value.isoformat() for name, value in (('from', date_from), ('to', date_to)) if value}
+        response = self.client.get(reverse('stats:members'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(row['name'], row['count']) for row in response.context['rents_users']]
+
+    def assertSameRents(self):
+        refresh_stale_months()
+        for date_from, date_to in ((None, None), (date(2019, 12, 15), None), (None, date(2020, 1, 20)),
+                                   (date(2019, 12, 1), date(2020, 2, 29))):
+            expected = self.get_handled_rents(date_from, date_to)
+            self.assertTrue(expected)
+            self.assertEqual(self.get_view_rents(date_from, date_to), expected, (date_from, date_to))
+
+    def test_members(self):
+        self.assertSameRents()
+
+    def test_changed_rents(self):
+        rents = list(Rent.objects.all())
+        for rent in self.random.sample(rents, 10):
+            rent.renter = self.random.choice(self.members)
+            rent.save()
+        for rent in self.random.sample(rents, 10):
+            rent.create_new_history(self.random.choice(self.members), new_status=Rent.STATUS_BACK[0])
+        self.assertSameRents()
+
+    def test_rebuild(self):
+        refresh_stale_months()
+        expected = list(MemberStat.objects.order_by('month', 'user').values_list('month', 'user', 'count'))
+        MemberStat.objects.all().delete()
+
+        MemberStat.refresh()
+        self.assertEqual(list(MemberStat.objects.order_by('month', 'user').values_list('month', 'user', 'count')),
+                         expected)
+
+
+class ExportViewTest(TestCase):
+    """Exports stream the same rows in CSV and JSON, filtered by the from and to parameters."""
+
+    views = {
+        'export-overview': views.StatsExportView,
+        'export-members': views.MembersExportView,
+        'export-games': views.GamesExportView,
+        'export-rents': views.RentsExportView,
+        'export-histories': views.RentHistoriesExportView,
+    }
+
+    def setUp(self):
+        self.admin = JhUser.objects.create(username='admin', first_name='Admin', last_name='Zz')
+        self.admin.user_permissions.add(Permission.objects.get(codename='view_stat'))
+        self.client.force_login(self.admin)
+
+        self.renter = JhUser.objects.create(username='renter', first_name='Renter', last_name='R')
+        game_group = GameGroup.objects.create(name='Bang', description='-', short_description='-', image='bang.jpg',
+                                              playtime='20 mins', playtime_category=GameGroup.LENGTH_SHORT[0])
+        piece = GamePiece.objects.create(game_group=game_group)
+
+        self.rents = list()
+        for created in (datetime(2020, 1, 15, 10), datetime(2020, 2, 10, 10), datetime(2020, 3, 31, 18)):
+            rent = Rent.objects.create(renter=self.renter, date_from=created + timedelta(days=7),
+                                       date_to=created + timedelta(days=9), created=created)
+            rent.games.add(piece)
+            rent.create_new_history(self.admin, new_status=Rent.STATUS_APPROVED[0])
+            self.rents.append(rent)
+        refresh_stale_months()
+
+    def get_export(self, name, export_format, params=None):
+        response = self.client.get(reverse('stats:' + name, kwargs={'format': export_format}), params or {})
+        self.assertEqual(response.status_code, 200, name)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="%s.%s"' % (self.views[name].export_name, export_format))
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def get_csv(self, name, params=None):
+        """Returns the rows of the CSV export, checking its header row."""
+        content = self.get_export(name, 'csv', params)
+        self.assertTrue(content.startswith('\ufeff'), name)
+
+        rows = list(csv.reader(content[1:].splitlines()))
+        with translation.override(settings.LANGUAGE_CODE):
+            self.assertEqual(rows[0], [str(header) for key, header in self.views[name].export_columns], name)
+        return rows[1:]
+
+    def get_json(self, name, params=None):
+        """Returns the rows of the JSON export, checking their keys."""
+        rows = json.loads(self.get_export(name, 'json', params))
+        keys = [key for key, header in self.views[name].export_columns]
+        for row in rows:
+            self.assertEqual(list(row), keys, name)
+        return rows
+
+    def test_formats(self):
+        for name in self.views:
+            self.assertEqual([row[0] for row in self.get_csv(name)],
+                             [str(row[self.views[name].export_columns[0][0]]) for row in self.get_json(name)], name)
+
+        self.assertEqual(self.get_json('export-members'), [{'name': 'Zz Admin', 'count': 3}])
+        self.assertEqual(self.get_csv('export-games'), [['Bang', '3']])
+        self.assertEqual(self.get_json('export-histories')[0]['username'], 'admin')
+        rent = self.get_json('export-rents')[0]
+        self.assertEqual((rent['id'], rent['renter_username'], rent['renter_name'], rent['created']),
+                         (self.rents[0].pk, 'renter', 'R Renter', '2020-01-15T10:00:00'))
+
+    def test_filters(self):
+        params = {'from': '2020-02-01', 'to': '2020-03-31'}
+        rents = [rent.pk for rent in self.rents[1:]]
+
+        self.assertEqual([row['id'] for row in self.get_json('export-rents', params)], rents)
+        self.assertEqual([row['rent'] for row in self.get_json('export-histories', params)], rents)
+        self.assertEqual(self.get_json('export-members', params), [{'name': 'Zz Admin', 'count': 2}])
+        # rents and games are counted in the month of date_from, the last one is in April
+        self.assertEqual([row[0] for row in self.get_csv('export-overview', params)], ['2020-02-01'])
+        self.assertEqual(self.get_json('export-games', params), [{'name': 'Bang', 'rcount': 1}])
+
+        self.assertEqual(self.get_json('export-rents', {'to': '2020-01-14'}), [])
+        self.assertEqual(self.client.get(reverse('stats:export-rents', kwargs={'format': 'csv'}),
+                                         {'from': 'yesterday'}).status_code, 404)
+
+    def test_unknown_format(self):
+        for name in self.views:
+            self.assertEqual(self.client.get(reverse('stats:' + name, kwargs={'format': 'xml'})).status_code, 404,
+                             name)
+
+    def test_permission(self):
+        self.client.force_login(self.renter)
+        for name in self.views:
+            for export_format in ('csv', 'json'):
+                self.assertEqual(self.client.get(reverse('stats:' + name, kwargs={'format': export_format}))
+                                 .status_code, 403, name)
+
+
+class StaleMonthTest(TestCase):
+    """Changes mark only their months stale, which are recomputed once."""
+
+    def setUp(self):
+        self.renter = JhUser.objects.create(username='renter')
+        game_group = GameGroup.objects.create(name='Bang', description='-', short_description='-', image='bang.jpg',
+                                              playtime='20 mins', playtime_category=GameGroup.LENGTH_SHORT[0])
+        self.pieces = [GamePiece.objects.create(game_group=game_group) for i in range(2)]
+        for month in range(1, 7):
+            date_from = datetime(2020, month, 10)
+            rent = Rent.objects.create(renter=self.renter, date_from=date_from, date_to=date_from + timedelta(days=2))
+            rent.games.add(self.pieces[month % 2])
+        refresh_stale_months()
+
+    def get_stale_months(self, model):
+        return set(StaleMonth.objects.filter(stat=model.__name__).values_list('month', flat=True))
+
+    def get_rows(self, model):
+        return sorted(model.objects.values_list('month', 'game_group', 'status', 'count'))
+
+    def test_clear_rents_of_piece(self):
+        self.pieces[0].rents.clear()
+
+        self.assertEqual(self.get_stale_months(GameStat), {date(2020, 2, 1), date(2020, 4, 1), date(2020, 6, 1)})
+        self.assertEqual(refresh_stale_months(), 3)
+        self.assertEqual(self.get_rows(GameStat), [(date(2020, month, 1), self.pieces[0].game_group_id,
+                                                    Rent.STATUS_PENDING[0], 1) for month in (1, 3, 5)])
+
+    def test_coalesced(self):
+        with transaction.atomic():
+            for rent in Rent.objects.filter(date_from__month__lte=2):
+                for status in (Rent.STATUS_APPROVED[0], Rent.STATUS_GAVE_OUT[0], Rent.STATUS_BACK[0]):
+                    rent.status = status
+                    rent.save()
+
+        self.assertEqual(self.get_stale_months(RentStat), {date(2020, 1, 1), date(2020, 2, 1)})
+        self.assertEqual(self.get_stale_months(GameStat), {date(2020, 1, 1), date(2020, 2, 1)})
+        self.assertEqual(refresh_stale_months(), 4)
+        self.assertFalse(StaleMonth.objects.exists())
+        self.assertEqual(refresh_stale_months(), 0)
+        self.assertEqual(sorted(RentStat.objects.values_list('month', 'status')),
+                         [(date(2020, month, 1), Rent.STATUS_BACK[0] if month <= 2 else Rent.STATUS_PENDING[0])
+                          for month in range(1, 7)])
+
+    def test_marked_during_refresh(self):
+        rent = Rent.objects.get(date_from__month=3)
+        rent.status = Rent.STATUS_APPROVED[0]
+        rent.save()
+
+        # the worker reads the stale rows of the month
+        rows = list(StaleMonth.objects.filter(stat=RentStat.__name__).values_list('pk', 'month'))
+        # another transaction changes the month, and is committed after the worker
+        rent.status = Rent.STATUS_BACK[0]
+        rent.save()
+
+        self.assertEqual(refresh_stale_rows(RentStat, rows), 1)
+        self.assertEqual(self.get_stale_months(RentStat), {date(2020, 3, 1)})
+
+
+class UtilisationTest(TestCase):
+    """Occupied days of the pieces and peak demand of the games, computed from the periods of their rents."""
+
+    def setUp(self):
+        self.renter = JhUser.objects.create(username='renter')
+        self.game_groups = [GameGroup.objects.create(name=name, description='-', short_description='-',
+                                                     image='%s.jpg' % name, playtime='20 mins',
+                                                     playtime_category=GameGroup.LENGTH_SHORT[0])
+                            for name in ('Bang', 'Carcassonne')]
+        self.pieces = [GamePiece.objects.create(game_group=self.game_groups[0], notes='#%d' % i) for i in range(2)]
+        # March of 2020, 31 days
+        self.start = datetime(2020, 3, 1)
+        self.end = datetime(2020, 4, 1)
+
+    def create_rent(self, date_from, date_to, piece, status=Rent.STATUS_PENDING[0]):
+        rent = Rent.objects.create(renter=self.renter, date_from=date_from, date_to=date_to, status=status)
+        rent.games.add(piece)
+        return rent
+
+    def get_piece(self, piece):
+        return next(row for row in get_piece_utilisation(self.start, self.end) if row['id'] == piece.pk)
+
+    def get_peak_demands(self):
+        return {row['name']: (row['pieces'], row['peak_demand']) for row in get_game_group_demand(self.start, self.end)}
+
+    def test_overlapping_periods(self):
+        self.create_rent(datetime(2020, 3, 5), datetime(2020, 3, 10), self.pieces[0])
+        self.create_rent(datetime(2020, 3, 8), datetime(2020, 3, 12), self.pieces[0])
+        self.create_rent(datetime(2020, 3, 9), datetime(2020, 3, 11), self.pieces[0])
+        self.create_rent(datetime(2020, 3, 20), datetime(2020, 3, 21), self.pieces[0])
+
+        pieces = get_piece_utilisation(self.start, self.end)
+        self.assertEqual(pieces[0], {'id': self.pieces[0].pk, 'name': 'Bang - #0', 'rents': 4, 'occupied_days': 8.0,
+                                     'utilisation': round(8 / 31 * 100, 1)})
+        self.assertEqual(pieces[1], {'id': self.pieces[1].pk, 'name': 'Bang - #1', 'rents': 0, 'occupied_days': 0.0,
+                                     'utilisation': 0.0})
+
+    def test_clipped_periods(self):
+        self.create_rent(datetime(2020, 2, 25), datetime(2020, 3, 3), self.pieces[0])
+        self.create_rent(datetime(2020, 3, 30), datetime(2020, 4, 5), self.pieces[0])
+        self.create_rent(datetime(2020, 1, 10), datetime(2020, 1, 12), self.pieces[0])
+        self.create_rent(datetime(2020, 2, 20), datetime(2020, 4, 10), self.pieces[1])
+
+        piece = self.get_piece(self.pieces[0])
+        self.assertEqual((piece['rents'], piece['occupied_days']), (2, 4.0))
+        piece = self.get_piece(self.pieces[1])
+        self.assertEqual((piece['occupied_days'], piece['utilisation']), (31.0, 100.0))
+
+    def test_inactive_rents(self):
+        self.create_rent(datetime(2020, 3, 5), datetime(2020, 3, 7), self.pieces[0], Rent.STATUS_CANCELLED[0])
+        self.create_rent(datetime(2020, 3, 5), datetime(2020, 3, 7), self.pieces[1], Rent.STATUS_DECLINED[0])
+        # brought back games were held during the rent
+        self.create_rent(datetime(2020, 3, 10), datetime(2020, 3, 11), self.pieces[0], Rent.STATUS_BACK[0])
+
+        piece = self.get_piece(self.pieces[0])
+        self.assertEqual((piece['rents'], piece['occupied_days']), (1, 1.0))
+        self.assertEqual(self.get_piece(self.pieces[1])['rents'], 0)
+        self.assertEqual(self.get_peak_demands()['Bang'], (2, 1))
+
+    @override_settings(RENT_RETURN_DELAY_DAYS=1)
+    def test_return_delay(self):
+        self.create_rent(datetime(2020, 3, 10), datetime(2020, 3, 12), self.pieces[0])
+        # extended to the end of February, clipped to March
+        self.create_rent(datetime(2020, 3, 1), datetime(2020, 3, 2), self.pieces[1])
+
+        self.assertEqual(self.get_piece(self.pieces[0])['occupied_days'], 4.0)
+        self.assertEqual(self.get_piece(self.pieces[1])['occupied_days'], 2.0)
+
+    def test_peak_demand(self):
+        # both ends are included, so these are held at the same time
+        self.create_rent(datetime(2020, 3, 5), datetime(2020, 3, 10), self.pieces[0])
+        self.create_rent(datetime(2020, 3, 10), datetime(2020, 3, 15), self.pieces[1])
+        self.create_rent(datetime(2020, 3, 16), datetime(2020, 3, 18), self.pieces[1])
+
+        self.assertEqual(self.get_peak_demands(), {'Bang': (2, 2), 'Carcassonne': (0, 0)})
+        self.assertEqual([row['name'] for row in get_game_group_demand(self.start, self.end)], ['Bang', 'Carcassonne'])
+
+    def test_api(self):
+        self.create_rent(datetime(2020, 3, 5), datetime(2020, 3, 10), self.pieces[1])
+        url = reverse('stats:utilisation-api')
+        params = {'from': '2020-03-01', 'to': '2020-03-31'}
+
+        self.client.force_login(self.renter)
+        self.assertEqual(self.client.get(url, params).status_code, 403)
+
+        self.renter.user_permissions.add(Permission.objects.get(codename='view_stat'))
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['from'], data['to']), ('2020-03-01', '2020-03-31'))
+        self.assertEqual([(row['id'], row['occupied_days']) for row in data['pieces']],
+                         [(self.pieces[1].pk, 5.0), (self.pieces[0].pk, 0.0)])
+        self.assertEqual([(row['name'], row['pieces'], row['peak_demand']) for row in data['game_groups']],
+                         [('Bang', 2, 1), ('Carcassonne', 0, 0)])
+
+        self.assertEqual(self.client.get(url, {'from': '2020-04-01', 'to': '2020-03-01'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'from': '2020-13-01'}).status_code, 404)
+
+
+@override_settings(STATS_WORKER_THREADS=1)
+class WorkerTest(TransactionTestCase):
+    """The stale months are recomputed by the background thread after the commit."""
+
+    def test_refresh_after_commit(self):
+        renter = JhUser.objects.create(username='renter')
+        with transaction.atomic():
+            Rent.objects.create(renter=renter, date_from=datetime(2020, 5, 5), date_to=datetime(2020, 5, 7))
+            self.assertIsNone(models._executor)
+
+        # waits for the queued run
+        models._executor.submit(lambda: None).result()
+        self.assertEqual(list(RentStat.objects.values_list('month', 'count')), [(date(2020, 5, 1), 1)])
+        self.assertFalse(StaleMonth.objects.exists())
+
+
+@override_settings(STATS_WORKER_THREADS=0)
+class RefreshTest(TransactionTestCase):
+    """Parallel refreshes of the same month must not fail or duplicate its rows."""
+
+    def setUp(self):
+        self.renter = JhUser.objects.create(username='renter')
+        self.month = date(2020, 3, 1)
+        for i in range(5):
+            date_from = datetime(2020, 3, 1 + i * 5)
+            Rent.objects.create(renter=self.renter, date_from=date_from, date_to=date_from + timedelta(days=2),
+                                status=Rent.STATUS_CHOICES[i % 3][0])
+
+    def test_parallel_refresh(self):
+        barrier = threading.Barrier(4)
+        errors = list()
+
+        def refresh(months):
+            try:
+                barrier.wait()
+                for i in range(5):
+                    RentStat.refresh(months)
+                    GameStat.refresh(months)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh, args=(months, ))
+                   for months in ([self.month], [self.month], [self.month, date(2020, 4, 1)], None)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(RentStat.objects.values_list('status', 'count')),
+                         sorted((Rent.STATUS_CHOICES[i][0], 2 if i < 2 else 1) for i in range(3)))
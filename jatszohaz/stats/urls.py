@@ -7,4 +7,12 @@ urlpatterns = [
     path('', views.StatsView.as_view(), name="overview"),
     path('members/', views.MembersView.as_view(), name="members"),
     path('games/', views.GamesView.as_view(), name="games"),
+    path('utilisation/', views.UtilisationView.as_view(), name="utilisation"),
+    path('utilisation/api/', views.UtilisationApiView.as_view(), name="utilisation-api"),
+
+    path('export/overview.<str:format>', views.StatsExportView.as_view(), name="export-overview"),
+    path('export/members.<str:format>', views.MembersExportView.as_view(), name="export-members"),
+    path('export/games.<str:format>', views.GamesExportView.as_view(), name="export-games"),
+    path('export/rents.<str:format>', views.RentsExportView.as_view(), name="export-rents"),
+    path('export/rent-histories.<str:format>', views.RentHistoriesExportView.as_view(), name="export-histories"),
 ]
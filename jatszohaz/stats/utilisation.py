@@ -0,0 +1,135 @@
+"""
+Utilisation of the games in a period, computed in the database.
+
+The periods are read from RentOccupancy, so they already contain RENT_RETURN_DELAY_DAYS on both ends, and
+cancelled or declined rents are not included. The periods are clipped to the requested range, then
+
+* the occupied days of a piece are the total length of the union of its periods: overlapping periods are merged
+  into islands with window functions (running maximum of the ends, running count of the island starts), and
+* the peak demand of a game group is the maximum number of its periods at the same time: the running sum of the
+  +1 / -1 start and end events, ordered by time.
+
+Window functions are needed, so it works on PostgreSQL and SQLite 3.25+.
+"""
+from django.db import NotSupportedError, connection
+
+from inventory.models import GameGroup, GamePiece
+from rent.models import Rent, RentOccupancy
+
+# vendor specific SQL of the (greatest, least, days between {start} and {end}) expressions
+SQL_FUNCTIONS = {
+    'postgresql': ('GREATEST', 'LEAST', "EXTRACT(EPOCH FROM ({end} - {start})) / 86400"),
+    'sqlite': ('MAX', 'MIN', "(julianday({end}) - julianday({start}))"),
+}
+
+# periods of the rents overlapping the range, clipped to the range, params: start, end, start, end
+PERIODS_SQL = """
+    SELECT o.game_piece_id AS piece, p.game_group_id AS game_group,
+           {greatest}(o.date_from, %s) AS date_from, {least}(o.date_to, %s) AS date_to
+    FROM {occupancy} o
+    JOIN {rent} r ON r.id = o.rent_id
+    JOIN {piece} p ON p.id = o.game_piece_id
+    WHERE r.status NOT IN ('{cancelled}', '{declined}') AND o.date_from <= %s AND o.date_to >= %s
+"""
+
+PIECES_SQL = """
+    WITH periods AS ({periods}),
+    marked AS (
+        SELECT piece, date_from, date_to,
+               MAX(date_to) OVER (PARTITION BY piece ORDER BY date_from, date_to
+                                  ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS previous_end
+        FROM periods
+    ),
+    islands AS (
+        SELECT piece, date_from, date_to,
+               SUM(CASE WHEN previous_end IS NULL OR date_from > previous_end THEN 1 ELSE 0 END)
+                   OVER (PARTITION BY piece ORDER BY date_from, date_to ROWS UNBOUNDED PRECEDING) AS island
+        FROM marked
+    ),
+    occupied AS (
+        SELECT piece, SUM(days) AS days, SUM(periods) AS periods
+        FROM (
+            SELECT piece, {days} AS days, COUNT(*) AS periods
+            FROM islands
+            GROUP BY piece, island
+        ) merged
+        GROUP BY piece
+    )
+    SELECT p.id, g.name, p.notes, COALESCE(o.days, 0), COALESCE(o.periods, 0)
+    FROM {piece} p
+    JOIN {game_group} g ON g.id = p.game_group_id
+    LEFT JOIN occupied o ON o.piece = p.id
+    ORDER BY COALESCE(o.days, 0) DESC, g.name, p.id
+"""
+
+GAME_GROUPS_SQL = """
+    WITH periods AS ({periods}),
+    events AS (
+        SELECT game_group, date_from AS time, 1 AS delta FROM periods
+        UNION ALL
+        SELECT game_group, date_to AS time, -1 AS delta FROM periods
+    ),
+    levels AS (
+        -- both ends are inclusive, so periods touching each other are concurrent
+        SELECT game_group, SUM(delta) OVER (PARTITION BY game_group ORDER BY time, delta DESC
+                                            ROWS UNBOUNDED PRECEDING) AS level
+        FROM events
+    ),
+    peaks AS (
+        SELECT game_group, MAX(level) AS peak FROM levels GROUP BY game_group
+    )
+    SELECT g.id, g.name, COUNT(p.id), COALESCE(MAX(k.peak), 0)
+    FROM {game_group} g
+    LEFT JOIN {piece} p ON p.game_group_id = g.id
+    LEFT JOIN peaks k ON k.game_group = g.id
+    GROUP BY g.id, g.name
+    ORDER BY COALESCE(MAX(k.peak), 0) DESC, g.name
+"""
+
+
+def _format(sql):
+    try:
+        greatest, least, days = SQL_FUNCTIONS[connection.vendor]
+    except KeyError:
+        raise NotSupportedError("Utilisation is not supported on %s!" % connection.vendor)
+
+    periods = PERIODS_SQL.format(
+        greatest=greatest, least=least, occupancy=RentOccupancy._meta.db_table, rent=Rent._meta.db_table,
+        piece=GamePiece._meta.db_table, cancelled=Rent.STATUS_CANCELLED[0], declined=Rent.STATUS_DECLINED[0],
+    )
+    return sql.format(
+        periods=periods, days=days.format(start='MIN(date_from)', end='MAX(date_to)'),
+        piece=GamePiece._meta.db_table, game_group=GameGroup._meta.db_table,
+    )
+
+
+def get_piece_utilisation(date_from, date_to):
+    """
+    Returns a list of dicts with the occupied days and the utilisation percentage of every GamePiece in the given
+    period, ordered by the occupied days.
+    """
+    total_days = (date_to - date_from).total_seconds() / 86400
+    with connection.cursor() as cursor:
+        cursor.execute(_format(PIECES_SQL), [date_from, date_to, date_to, date_from])
+        return [{
+            'id': pk,
+            'name': '%s - %s' % (name, notes),
+            'rents': periods,
+            'occupied_days': round(float(days), 1),
+            'utilisation': round(float(days) / total_days * 100, 1) if total_days > 0 else 0,
+        } for pk, name, notes, days, periods in cursor.fetchall()]
+
+
+def get_game_group_demand(date_from, date_to):
+    """
+    Returns a list of dicts with the number of pieces and the peak concurrent demand (pieces held at the same
+    time) of every GameGroup in the given period, ordered by the peak demand.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(_format(GAME_GROUPS_SQL), [date_from, date_to, date_to, date_from])
+        return [{
+            'id': pk,
+            'name': name,
+            'pieces': pieces,
+            'peak_demand': peak,
+        } for pk, name, pieces, peak in cursor.fetchall()]
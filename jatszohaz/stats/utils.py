@@ -16,3 +16,17 @@ def parse_get_date(request, param_name):
             raise ValueError()
         return get_date, date
     return get_date, None
+
+
+def filter_months(queryset, date_from, date_to, field='month'):
+    """
+    Filters the monthly statistics of the months overlapping the given period, see stats.models.
+
+    :param date_from: date or None, the whole month of the date is included.
+    :param date_to: date or None, the whole month of the date is included.
+    """
+    if date_from:
+        queryset = queryset.filter(**{'%s__gte' % field: date_from.replace(day=1)})
+    if date_to:
+        queryset = queryset.filter(**{'%s__lte' % field: date_to})
+    return queryset
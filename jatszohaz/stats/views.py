@@ -1,33 +1,49 @@
+from datetime import datetime, timedelta
+
 from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.db.models import Count, F, Q
-from django.db.models.functions import TruncMonth
-from django.http import Http404
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Concat
+from django.http import Http404, JsonResponse
+from django.utils.translation import ugettext_lazy as _
 from django.views.generic import TemplateView
 from inventory.models import GameGroup
-from jatszohaz.models import JhUser
 from rent.models import Rent, RentHistory
-from stats.utils import parse_get_date
+from stats.exports import ExportMixin
+from stats.models import MemberStat, RentStat
+from stats.utilisation import get_game_group_demand, get_piece_utilisation
+from stats.utils import filter_months, parse_get_date
 
 
 class StatBase(PermissionRequiredMixin, TemplateView):
     permission_required = 'rent.view_stat'
 
+    def get_dates(self):
+        """Returns the (get_date_from, date_from, get_date_to, date_to) of the from and to GET parameters."""
+        try:
+            get_date_from, date_from = parse_get_date(self.request, 'from')
+            get_date_to, date_to = parse_get_date(self.request, 'to')
+        except ValueError:
+            # handle datetime format exceptions
+            raise Http404()
+        return get_date_from, date_from, get_date_to, date_to
+
 
 class StatsView(StatBase):
     """Overview page showing the count of rents by month."""
 
     template_name = 'stats/overview.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data()
+    def get_queryset(self):
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
 
-        context['monthly_rents'] = Rent.objects\
-            .annotate(month=TruncMonth('date_from'))\
+        return filter_months(RentStat.objects.all(), date_from, date_to)\
             .values('month')\
-            .annotate(count=Count('id'))\
-            .order_by('-month')\
-            .all()
+            .annotate(count=Sum('count'))\
+            .order_by('-month')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data()
+        context['monthly_rents'] = self.get_queryset()
         return context
 
 
@@ -36,34 +52,21 @@ class MembersView(StatBase):
 
     template_name = 'stats/members.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data()
+    def get_queryset(self):
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
 
-        try:
-            get_date_from, date_from = parse_get_date(self.request, 'from')
-            get_date_to, date_to = parse_get_date(self.request, 'to')
-        except ValueError:
-            # handle datetime format exceptions
-            raise Http404()
+        # number of handled rents by user, name is the same as JhUser.full_name2
+        return filter_months(MemberStat.objects.all(), date_from, date_to)\
+            .values('user')\
+            .annotate(name=Concat('user__last_name', Value(' '), 'user__first_name'),
+                      count=Sum('count'))\
+            .order_by('-count', 'user__last_name', 'user__first_name')
 
-        queryset = RentHistory.objects.exclude(user=F('rent__renter'))
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data()
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
 
-        if date_from:
-            queryset = queryset.filter(rent__created__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(rent__created__lte=date_to)
-
-        # todo solve this with a much faster subquery
-        rents_users = []
-        for user in JhUser.objects.order_by('last_name', 'first_name').all():
-            rents_count = queryset.filter(user=user).values('rent').distinct().count()
-            if rents_count > 0:
-                rents_users.append({
-                    'user': user.full_name2(),
-                    'count': rents_count,
-                })
-
-        context['rents_users'] = sorted(rents_users, key=lambda e: e['count'], reverse=True)
+        context['rents_users'] = self.get_queryset()
         context['date_from'] = get_date_from
         context['date_to'] = get_date_to
 
@@ -75,35 +78,166 @@ class GamesView(StatBase):
 
     template_name = 'stats/games.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data()
-
-        # parse filters
-        try:
-            get_date_from, date_from = parse_get_date(self.request, 'from')
-            get_date_to, date_to = parse_get_date(self.request, 'to')
-        except ValueError:
-            # handle datetime format exceptions
-            raise Http404()
+    def get_queryset(self):
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
 
         # do not include DECLINED and CANCELLED rents
         included_statuses = (Rent.STATUS_PENDING[0], Rent.STATUS_APPROVED[0], Rent.STATUS_GAVE_OUT[0],
                              Rent.STATUS_IN_MY_ROOM[0], Rent.STATUS_BACK[0])
         count_filter = {
-            'game_pieces__rents__status__in': included_statuses,
+            'monthly_stats__status__in': included_statuses,
         }
 
         # apply filters for count
         if date_from:
-            count_filter['game_pieces__rents__date_from__gte'] = date_from
+            count_filter['monthly_stats__month__gte'] = date_from.replace(day=1)
         if date_to:
-            count_filter['game_pieces__rents__date_from__lte'] = date_to
+            count_filter['monthly_stats__month__lte'] = date_to
 
-        queryset = GameGroup.objects\
-            .annotate(rcount=Count('game_pieces__rents', filter=Q(**count_filter)))\
+        return GameGroup.objects\
+            .annotate(rcount=Coalesce(Sum('monthly_stats__count', filter=Q(**count_filter)), 0))\
             .values('rcount', 'name').order_by('-rcount', 'name')
 
-        context['stat_data'] = queryset.all()
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data()
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
+
+        context['stat_data'] = self.get_queryset()
         context['date_from'] = get_date_from
         context['date_to'] = get_date_to
         return context
+
+
+class UtilisationView(StatBase):
+    """Showing the occupied days of the game pieces and the peak demand of the games in a period."""
+
+    template_name = 'stats/utilisation.html'
+    # length of the default period, ending today
+    default_days = 365
+
+    def get_period(self):
+        """Returns the (get_date_from, get_date_to, start, end) of the period, both days are included."""
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
+        date_to = date_to or datetime.now().date()
+        date_from = date_from or date_to - timedelta(days=self.default_days - 1)
+        if date_from > date_to:
+            raise Http404()
+
+        start = datetime.combine(date_from, datetime.min.time())
+        end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        return date_from, date_to, start, end
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data()
+        date_from, date_to, start, end = self.get_period()
+
+        context['pieces'] = get_piece_utilisation(start, end)
+        context['game_groups'] = get_game_group_demand(start, end)
+        context['date_from'] = date_from
+        context['date_to'] = date_to
+        return context
+
+
+class UtilisationApiView(UtilisationView):
+    """
+    JSON endpoint of the utilisation statistics.
+
+    GET parameters:
+     - from, to: first and last day in YYYY-MM-DD format. Defaults to the last 365 days.
+    """
+
+    http_method_names = ['get', ]
+
+    def get(self, request, *args, **kwargs):
+        date_from, date_to, start, end = self.get_period()
+        return JsonResponse({
+            'from': date_from,
+            'to': date_to,
+            'pieces': get_piece_utilisation(start, end),
+            'game_groups': get_game_group_demand(start, end),
+        })
+
+
+class StatsExportView(ExportMixin, StatsView):
+    export_name = 'monthly_rents'
+    export_columns = (('month', _("Month")), ('count', _("Count")))
+
+    def get_export_queryset(self):
+        return self.get_queryset()
+
+
+class MembersExportView(ExportMixin, MembersView):
+    export_name = 'members'
+    export_columns = (('name', _("Member")), ('count', _("Count")))
+
+    def get_export_queryset(self):
+        return self.get_queryset()
+
+
+class GamesExportView(ExportMixin, GamesView):
+    export_name = 'games'
+    export_columns = (('name', _("Game")), ('rcount', _("Count")))
+
+    def get_export_queryset(self):
+        return self.get_queryset()
+
+
+class RentsExportView(ExportMixin, StatBase):
+    """Every rent created in the given period, for processing it elsewhere."""
+    export_name = 'rents'
+    export_columns = (
+        ('id', _("ID")),
+        ('renter_username', _("Renter")),
+        ('renter_name', _("Renter name")),
+        ('status', _("Status")),
+        ('date_from', _("From")),
+        ('date_to', _("To")),
+        ('created', _("Created")),
+        ('modified', _("Modified")),
+    )
+
+    def get_export_queryset(self):
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
+
+        queryset = Rent.objects.all()
+        if date_from:
+            queryset = queryset.filter(created__date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(created__date__lte=date_to)
+
+        return queryset\
+            .values('id', 'status', 'date_from', 'date_to', 'created', 'modified',
+                    renter_username=F('renter__username'),
+                    renter_name=Concat('renter__last_name', Value(' '), 'renter__first_name'))\
+            .order_by('pk')
+
+
+class RentHistoriesExportView(ExportMixin, StatBase):
+    """Every change of the rents created in the given period, for processing it elsewhere."""
+    export_name = 'rent_histories'
+    export_columns = (
+        ('id', _("ID")),
+        ('rent', _("Rent")),
+        ('username', _("User")),
+        ('created', _("Created")),
+        ('new_status', _("Status")),
+        ('new_renter_username', _("New renter")),
+        ('added_game', _("New game piece")),
+        ('deleted_game', _("Deleted game piece")),
+        ('edited_date_from', _("Edited from")),
+        ('edited_date_to', _("Edited to")),
+    )
+
+    def get_export_queryset(self):
+        get_date_from, date_from, get_date_to, date_to = self.get_dates()
+
+        queryset = RentHistory.objects.all()
+        if date_from:
+            queryset = queryset.filter(rent__created__date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(rent__created__date__lte=date_to)
+
+        return queryset\
+            .values('id', 'rent', 'created', 'new_status', 'added_game', 'deleted_game', 'edited_date_from',
+                    'edited_date_to', username=F('user__username'), new_renter_username=F('new_renter__username'))\
+            .order_by('pk')